@@ -3,6 +3,10 @@ import sqlite3
 from mysql_connector import *
 from math import ceil
 from polygon_forex import get_data
+from schema import ensure_mysql_schema
+from time_ranges import day_bounds_ms, date_range_bounds_ms, to_date
+from storage import MySQLStorage
+from volume_at_price import BIN_SIZES as VAP_BIN_SIZES, EXACT_BIN as VAP_EXACT_BIN, EXACT_PRICES as VAP_EXACT_PRICES
 import json
 from io import StringIO
 import pandas as pd
@@ -15,6 +19,8 @@ DATABASE_NAME = "klines_data.db"
 
 DEFAULT_PAGE_SIZE = 100
 
+DEFAULT_PRICE_BIN = 5.0  # bin width used by /api/vp_data
+
 # def query_db(query, args=(), one=False):
 #     conn = sqlite3.connect(DATABASE_NAME)
 #     cur = conn.cursor().execute(query, args)
@@ -383,6 +389,12 @@ def atas_data():
             connection.close()
 
 
+@app.route("/api/db_pool", methods=["GET"])
+def get_db_pool_stats():
+    # Pool checkout / wait counters; a growing wait_time_avg means db_pool_size is too small
+    return jsonify(pool_stats())
+
+
 @app.route("/api/forex", methods=["GET"])
 def get_forex():
     symbol = request.args.get('symbol')
@@ -506,14 +518,29 @@ def get_klines():
 @app.route("/api/aggregated_trades", methods=["GET"])
 def get_aggregated_trades():
     symbol = request.args.get('symbol')
+    date = request.args.get('date')  # optional YYYY-MM-DD, limits the scan to that day's partition
+    end_date = request.args.get('end_date')  # optional, makes [date, end_date] an inclusive range
     page = int(request.args.get('page', 1))
     limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
     offset = (page - 1) * limit
 
+    conditions = []
+    where_params = ()
     if symbol:
-        data = query_mysql("SELECT * FROM aggregated_trades WHERE symbol=%s LIMIT %s OFFSET %s", (symbol, limit, offset))
-    else:
-        data = query_mysql("SELECT * FROM aggregated_trades LIMIT %s OFFSET %s", (limit, offset))
+        conditions.append("symbol=%s")
+        where_params += (symbol,)
+    if date:
+        try:
+            start_ms, end_ms = date_range_bounds_ms(date, end_date)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        # Bounds on the partition column let MySQL prune to the matching days
+        conditions.append("transact_time >= %s AND transact_time < %s")
+        where_params += (start_ms, end_ms)
+    where_clause = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+
+    data = query_mysql(f"SELECT * FROM aggregated_trades {where_clause} LIMIT %s OFFSET %s",
+                       where_params + (limit, offset))
 
     
     # Convert data to a list of dictionaries for JSON serialization
@@ -532,12 +559,6 @@ def get_aggregated_trades():
         for trade in data
     ]
 
-    where_clause = ""
-    where_params = ()
-    if symbol:
-        where_clause = "WHERE symbol=%s"
-        where_params = (symbol,)
-
     total_pages = get_total_pages("aggregated_trades", limit, where_clause, where_params)
 
     return jsonify({
@@ -547,44 +568,78 @@ def get_aggregated_trades():
 
 
 # Additional function to get the opening and closing price
-def get_open_close(symbol, date):
-    data = query_mysql("""
-        SELECT open, close 
-        FROM klines 
-        WHERE symbol=%s 
-        AND DATE(FROM_UNIXTIME(open_time/1000)) = %s 
-        LIMIT 1
-    """, (symbol, date))
-    if data:
-        return {"open": data[0][0], "close": data[0][1]}
+def get_open_close(symbol, date, end_date=None):
+    start_ms, end_ms = date_range_bounds_ms(date, end_date)
+    # Prefer the 1-minute rollups (one row per minute); fall back to klines
+    # for ranges the rollups don't cover yet
+    for table, time_column in (("agg_trades_1m", "minute_time"), ("klines", "open_time")):
+        first = query_mysql(f"""
+            SELECT open 
+            FROM {table} 
+            WHERE symbol=%s 
+            AND {time_column} >= %s AND {time_column} < %s
+            ORDER BY {time_column} 
+            LIMIT 1
+        """, (symbol, start_ms, end_ms))
+        last = query_mysql(f"""
+            SELECT close 
+            FROM {table} 
+            WHERE symbol=%s 
+            AND {time_column} >= %s AND {time_column} < %s
+            ORDER BY {time_column} DESC 
+            LIMIT 1
+        """, (symbol, start_ms, end_ms))
+        if first and last:
+            return {"open": first[0][0], "close": last[0][0]}
     return {"open": None, "close": None}
 
 # Function to get the POC
-def get_poc(symbol, date):
+def get_poc(symbol, date, end_date=None, from_trades=False):
+    start_day, end_day = _day_range(date, end_date)
+    if from_trades:
+        # Tick-level answer on request: groups every raw trade of the range
+        start_ms, end_ms = date_range_bounds_ms(date, end_date)
+        data = query_mysql("""
+            SELECT price, SUM(quantity) AS total_volume 
+            FROM aggregated_trades 
+            WHERE symbol=%s 
+            AND transact_time >= %s AND transact_time < %s
+            GROUP BY price 
+            ORDER BY total_volume DESC 
+            LIMIT 1
+        """, (symbol, start_ms, end_ms))
+        if data:
+            return {"poc_price": data[0][0], "poc_volume": data[0][1], "poc_bin_size": VAP_EXACT_BIN}
+        return {"poc_price": None, "poc_volume": None, "poc_bin_size": None}
+
+    # Materialized daily profile (volume_at_price.py): the exact-price rows
+    # when kept, else the finest bin, whose start is the POC to poc_bin_size
+    bin_size = VAP_EXACT_BIN if VAP_EXACT_PRICES else min(VAP_BIN_SIZES)
     data = query_mysql("""
-        SELECT price, SUM(quantity) AS total_volume 
-        FROM aggregated_trades 
-        WHERE symbol=%s 
-        AND DATE(FROM_UNIXTIME(transact_time/1000)) = %s
-        GROUP BY price 
+        SELECT bin_start, SUM(buy_volume + sell_volume) AS total_volume 
+        FROM volume_at_price 
+        WHERE symbol=%s AND bin_size=%s 
+        AND day >= %s AND day <= %s
+        GROUP BY bin_start 
         ORDER BY total_volume DESC 
         LIMIT 1
-    """, (symbol, date))
+    """, (symbol, bin_size, start_day, end_day))
     if data:
-        return {"poc_price": data[0][0], "poc_volume": data[0][1]}
-    return {"poc_price": None, "poc_volume": None}
+        return {"poc_price": data[0][0], "poc_volume": data[0][1], "poc_bin_size": bin_size}
+    return {"poc_price": None, "poc_volume": None, "poc_bin_size": None}
 
 # Function to get volume and transaction times for each price level
 def get_volume_per_price_(symbol, date):
+    start_ms, end_ms = day_bounds_ms(date)
     # First, get volume and transaction times for each price level from aggregated_trades
     aggregated_data = query_mysql("""
         SELECT price, GROUP_CONCAT(transact_time) AS transaction_times, SUM(quantity) AS total_volume 
         FROM aggregated_trades 
         WHERE symbol=%s 
-        AND DATE(FROM_UNIXTIME(transact_time/1000)) = %s
+        AND transact_time >= %s AND transact_time < %s
         GROUP BY price 
         ORDER BY price
-    """, (symbol, date))
+    """, (symbol, start_ms, end_ms))
 
     result = []
     for d in aggregated_data:
@@ -597,9 +652,9 @@ def get_volume_per_price_(symbol, date):
             SELECT SUM(close_time - open_time) 
             FROM klines 
             WHERE symbol=%s 
-            AND DATE(FROM_UNIXTIME(close_time/1000)) = %s 
+            AND close_time >= %s AND close_time < %s 
             AND close=%s
-        """, (symbol, date, price))
+        """, (symbol, start_ms, end_ms, price))
 
         # Assuming the SQL returns a single row with the sum of the durations
         duration = kline_durations[0][0] if kline_durations else 0
@@ -614,34 +669,40 @@ def get_volume_per_price_(symbol, date):
     return result
 
 
-def get_volume_per_price(symbol, date, limit, offset, price_difference=5.0):
-    # Adjusted query to fully comply with ONLY_FULL_GROUP_BY SQL mode and added LIMIT/OFFSET
+def _day_range(date, end_date=None):
+    """Validated inclusive [date, end_date] as ISO strings for the DATE columns."""
+    date_range_bounds_ms(date, end_date)  # raises ValueError on bad input
+    return to_date(date).isoformat(), to_date(end_date or date).isoformat()
+
+
+def get_volume_per_price(symbol, date, limit, offset, price_difference=DEFAULT_PRICE_BIN, end_date=None):
+    if price_difference not in VAP_BIN_SIZES:
+        raise ValueError(f"bin size {price_difference} is not materialized, add it to vap_bin_sizes")
+    start_day, end_day = _day_range(date, end_date)
+    # Reads the materialized daily profile (volume_at_price.py) instead of
+    # grouping the raw trades; a multi-day range sums the days per bin
     aggregated_data = query_mysql("""
-        SELECT 
-            FLOOR(price / %s) * %s AS price_bin_start, 
-            (FLOOR(price / %s) + 1) * %s AS price_bin_end,
-            GROUP_CONCAT(transact_time) AS transaction_times, 
-            SUM(quantity) AS total_volume 
-        FROM aggregated_trades 
-        WHERE symbol=%s 
-        AND DATE(FROM_UNIXTIME(transact_time/1000)) = %s
-        GROUP BY price_bin_start, price_bin_end
-        ORDER BY price_bin_start
+        SELECT bin_start, SUM(buy_volume), SUM(sell_volume), SUM(trades)
+        FROM volume_at_price 
+        WHERE symbol=%s AND bin_size=%s 
+        AND day >= %s AND day <= %s
+        GROUP BY bin_start
+        ORDER BY bin_start
         LIMIT %s OFFSET %s
-    """, (price_difference, price_difference, price_difference, price_difference, symbol, date, limit, offset))
+    """, (symbol, price_difference, start_day, end_day, limit, offset))
 
     result = []
     for d in aggregated_data:
         price_bin_start = d[0]
-        price_bin_end = d[1]
-        transaction_times = list(map(int, d[2].split(',')))
-        volume = d[3]
+        buy_volume, sell_volume = d[1], d[2]
 
         result.append({
             "price_bin_start": price_bin_start,
-            "price_bin_end": price_bin_end,
-            "transaction_times": transaction_times,
-            "volume": volume
+            "price_bin_end": price_bin_start + price_difference,
+            "volume": buy_volume + sell_volume,
+            "buy_volume": buy_volume,
+            "sell_volume": sell_volume,
+            "trades": d[3]
         })
 
     return result
@@ -661,19 +722,29 @@ def flatten(json_data, parent_key='', sep='_'):
 def get_vp_data():
     symbol = request.args.get('symbol')
     date = request.args.get('date')  # expecting date in format YYYY-MM-DD
+    end_date = request.args.get('end_date')  # optional, makes [date, end_date] an inclusive range
     page = int(request.args.get('page', 1))  # default to first page
     limit = int(request.args.get('limit', 10))  # default limit to 10 items per page
     
     if not symbol or not date:
         return jsonify({"error": "Both symbol and date are required."}), 400
 
-    open_close = get_open_close(symbol, date)
-    poc = get_poc(symbol, date)
-    volume_data = get_volume_per_price(symbol, date, limit, (page - 1) * limit)
-
-    where_clause = "WHERE symbol=%s AND DATE(FROM_UNIXTIME(transact_time/1000)) = %s"
-    where_params = (symbol, date)
-    total_pages = get_total_pages("aggregated_trades", limit, where_clause, where_params)
+    try:
+        start_day, end_day = _day_range(date, end_date)
+        volume_data = get_volume_per_price(symbol, date, limit, (page - 1) * limit, end_date=end_date)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    open_close = get_open_close(symbol, date, end_date)
+    # `poc_source=trades` computes the POC from the raw ticks instead
+    poc = get_poc(symbol, date, end_date, from_trades=request.args.get('poc_source') == 'trades')
+
+    # Pages are over price bins, so count the distinct bins rather than raw trades
+    total_bins = query_mysql("""
+        SELECT COUNT(DISTINCT bin_start) FROM volume_at_price
+        WHERE symbol=%s AND bin_size=%s AND day >= %s AND day <= %s
+    """, (symbol, DEFAULT_PRICE_BIN, start_day, end_day))[0][0]
+    total_pages = ceil(total_bins / limit)
 
     return jsonify({
         "total_pages": total_pages,
@@ -685,6 +756,30 @@ def get_vp_data():
 
 
 
+@app.route("/api/bars", methods=["GET"])
+def get_bars():
+    """OHLCV + buy/sell volume bars built from the 1-minute agg trade rollups."""
+    symbol = request.args.get('symbol')
+    date = request.args.get('date')  # expecting date in format YYYY-MM-DD
+    end_date = request.args.get('end_date')  # optional, makes [date, end_date] an inclusive range
+    interval = request.args.get('interval', '1h')
+
+    if not symbol or not date:
+        return jsonify({"error": "Both symbol and date are required."}), 400
+
+    try:
+        start_ms, end_ms = date_range_bounds_ms(date, end_date)
+        bars = MySQLStorage().read_trade_bars(symbol, interval, start_ms, end_ms)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "symbol": symbol,
+        "interval": interval,
+        "bars": bars.to_dict(orient="records")
+    })
+
+
 @app.route("/api/klines_aggregated_trades", methods=["GET"])
 def get_klines_agg_data():
     symbol = request.args.get('symbol')
@@ -751,4 +846,5 @@ def get_klines_agg_data():
 
 # To run the API
 if __name__ == "__main__":
+    ensure_mysql_schema()
     app.run(debug=True, host='0.0.0.0',port=8080)
@@ -0,0 +1,159 @@
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Content-addressed on-disk cache of data.binance.vision archives.
+#
+# Archives are stored once per content under <dir>/<sha256[:2]>/<sha256>.zip
+# and indexed by URL (index.db) with their SHA256, size and last use. Past
+# archives never change, so archive_downloader.py answers fetches, checksum
+# lookups and existence checks for cached URLs from here without touching the
+# network: a repeated backfill makes no requests for the archives it has
+# seen. A lookup that names a different SHA256 (the archive was republished)
+# is a miss. Once the cache grows past its cap the least recently used
+# archives are evicted. Only archives whose digest matched the published
+# .CHECKSUM are cached, since cache hits then answer checksum lookups too.
+#
+# The cache writes every archive to disk, so it is off by default with
+# `stream_archives=1` (download_agg.py), which promises not to touch the disk;
+# set archive_cache=1 to cache there anyway.
+#
+# Settings (.env): archive_cache (default 1, 0 with stream_archives=1),
+# archive_cache_dir (default data/archive_cache), archive_cache_mb (default
+# 10240). Warm it with:
+#
+#   python archive_cache.py DATA_TYPE SYMBOL[,SYMBOL...] START_DATE [END_DATE]
+
+CACHE_ENABLED = os.getenv("archive_cache", "0" if os.getenv("stream_archives") == "1" else "1") == "1"
+CACHE_DIR = os.getenv("archive_cache_dir", os.path.join("data", "archive_cache"))
+CACHE_BYTES = int(float(os.getenv("archive_cache_mb", 10240)) * 1024 * 1024)
+
+COPY_BUFFER = 1024 * 1024
+
+
+class ArchiveCache:
+    """Thread safe: download workers share one instance."""
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(cache_dir, "index.db"), check_same_thread=False)
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evicted": 0}
+        with self._lock, self._conn:
+            self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS archives (
+                url TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_archives_last_used ON archives (last_used)")
+
+    def path(self, sha256):
+        return os.path.join(self.cache_dir, sha256[:2], f"{sha256}.zip")
+
+    def checksum(self, url):
+        """SHA256 of the cached archive for `url`, or None if it is not cached."""
+        with self._lock:
+            row = self._conn.execute("SELECT sha256 FROM archives WHERE url = ?", (url,)).fetchone()
+        return row[0] if row else None
+
+    def get(self, url, sha256=None):
+        """
+        Path of the cached archive for `url` (and `sha256`, if given), or None.
+        A hit counts as a use for the LRU order.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT sha256 FROM archives WHERE url = ?", (url,)).fetchone()
+            if row is None or (sha256 is not None and row[0] != sha256) or not os.path.exists(self.path(row[0])):
+                self.stats["misses"] += 1
+                return None
+            with self._conn:
+                self._conn.execute("UPDATE archives SET last_used = ? WHERE url = ?", (time.time(), url))
+            self.stats["hits"] += 1
+            return self.path(row[0])
+
+    def put(self, url, sha256, f):
+        """Store the archive read from binary file `f` (read from its current position)."""
+        path = self.path(sha256)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            part = f"{path}.{uuid.uuid4().hex[:8]}.part"
+            with open(part, "wb") as out:
+                shutil.copyfileobj(f, out, COPY_BUFFER)
+            os.replace(part, path)
+        size = os.path.getsize(path)
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO archives (url, sha256, size, last_used) VALUES (?, ?, ?, ?)",
+                               (url, sha256, size, time.time()))
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM archives").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            for url, sha256, size in self._conn.execute(
+                    "SELECT url, sha256, size FROM archives ORDER BY last_used").fetchall():
+                if total <= self.max_bytes:
+                    break
+                with self._conn:
+                    self._conn.execute("DELETE FROM archives WHERE url = ?", (url,))
+                    shared = self._conn.execute("SELECT 1 FROM archives WHERE sha256 = ?", (sha256,)).fetchone()
+                if not shared and os.path.exists(self.path(sha256)):
+                    os.remove(self.path(sha256))
+                total -= size
+                self.stats["evicted"] += 1
+
+    def format_stats(self):
+        with self._lock:
+            count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM archives").fetchone()
+        return (f"Archive cache: {count} archives, {total / 1e6:,.1f} of {self.max_bytes / 1e6:,.0f} MB | "
+                f"hits {self.stats['hits']} | misses {self.stats['misses']} | evicted {self.stats['evicted']}")
+
+    def close(self):
+        self._conn.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_archive_cache():
+    """The process-wide cache, or None with archive_cache=0."""
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ArchiveCache()
+        return _cache
+
+
+def prefetch(data_type, symbols, start_date, end_date):
+    """Download every archive of the range into the cache without storing it."""
+    from archive_downloader import Downloader, plan_archives
+
+    downloader = Downloader(cache=get_archive_cache() or ArchiveCache())
+    jobs = plan_archives([data_type], symbols, start_date, end_date, downloader)
+    downloader.run(jobs, lambda context, archive, sha256: None, spooled=True, verify=True)
+    print(downloader.cache.format_stats())
+    downloader.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print("usage: python archive_cache.py DATA_TYPE SYMBOL[,SYMBOL...] START_DATE [END_DATE]")
+        sys.exit(1)
+    symbols = [s.strip().upper() for s in sys.argv[2].split(",")]
+    prefetch(sys.argv[1], symbols, sys.argv[3], sys.argv[4] if len(sys.argv) > 4 else sys.argv[3])
@@ -0,0 +1,182 @@
+import os
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Vectorized parsing of data.binance.vision archive CSVs.
+#
+# The C CSV reader parses `csv_chunk_rows` rows at a time straight into typed
+# numpy columns (explicit dtypes, 'true'/'false' read as bool), so ingestion
+# never builds a Python object per field. Chunks go to the storage writers
+# as DataFrames (Storage.write_frame), which turn the columns into insert
+# rows in one pass per column. Archives come with or without a header line;
+# both parse the same.
+#
+# DATATYPES is the registry of the archive data types the ingester knows.
+# Each entry gives:
+#
+#   table        target table (schema.py migrations, parquet_store.TABLES)
+#   columns      table columns in insert order, including `symbol`
+#   dtypes       the archive CSV columns in file order with their dtypes
+#                ("str" for text); a `symbol` column in the file is replaced
+#                by the symbol of the archive
+#   datetimes    CSV columns holding 'YYYY-MM-DD HH:MM:SS' UTC text, stored
+#                as epoch milliseconds
+#   time_column  column the readers, partitions and Parquet days key on
+#   key          dedupe key; the primary / unique key of the table, so
+#                INSERT IGNORE drops replayed rows
+#
+# Adding a data type is a registry entry plus a migration creating its table.
+#
+# Settings (.env): csv_chunk_rows (default 100000).
+
+CHUNK_ROWS = int(os.getenv("csv_chunk_rows", 100000))
+
+AGG_TRADE_DTYPES = {
+    "agg_trade_id": "int64",
+    "price": "float64",
+    "quantity": "float64",
+    "first_trade_id": "int64",
+    "last_trade_id": "int64",
+    "transact_time": "int64",
+    "is_buyer_maker": "bool",
+}
+
+BOOKTICKER_DTYPES = {
+    "update_id": "int64",
+    "best_bid_price": "float64",
+    "best_bid_qty": "float64",
+    "best_ask_price": "float64",
+    "best_ask_qty": "float64",
+    "transaction_time": "int64",
+    "event_time": "int64",
+}
+
+METRICS_DTYPES = {
+    "create_time": "str",
+    "symbol": "str",
+    "sum_open_interest": "float64",
+    "sum_open_interest_value": "float64",
+    "count_toptrader_long_short_ratio": "float64",
+    "sum_toptrader_long_short_ratio": "float64",
+    "count_long_short_ratio": "float64",
+    "sum_taker_long_short_vol_ratio": "float64",
+}
+
+# No symbol column in these archives; it is only in the file name
+LIQUIDATION_SNAPSHOT_DTYPES = {
+    "time": "int64",
+    "side": "str",
+    "order_type": "str",
+    "time_in_force": "str",
+    "original_quantity": "float64",
+    "price": "float64",
+    "average_price": "float64",
+    "order_status": "str",
+    "last_fill_quantity": "float64",
+    "accumulated_fill_quantity": "float64",
+}
+
+DATATYPES = {
+    "aggTrades": {
+        "table": "aggregated_trades",
+        "columns": ["agg_trade_id", "symbol", "price", "quantity", "first_trade_id", "last_trade_id",
+                    "transact_time", "is_buyer_maker"],
+        "dtypes": AGG_TRADE_DTYPES,
+        "datetimes": [],
+        "time_column": "transact_time",
+        "key": ["symbol", "agg_trade_id"],
+    },
+    "bookTicker": {
+        "table": "bookticker",
+        "columns": ["update_id", "symbol", "best_bid_price", "best_bid_qty", "best_ask_price", "best_ask_qty",
+                    "transaction_time", "event_time"],
+        "dtypes": BOOKTICKER_DTYPES,
+        "datetimes": [],
+        "time_column": "transaction_time",
+        "key": ["symbol", "update_id"],
+    },
+    "metrics": {
+        "table": "metrics",
+        "columns": list(METRICS_DTYPES),
+        "dtypes": METRICS_DTYPES,
+        "datetimes": ["create_time"],
+        "time_column": "create_time",
+        "key": ["symbol", "create_time"],
+    },
+    "liquidationSnapshot": {
+        "table": "liquidation_snapshot",
+        "columns": ["time", "symbol", *list(LIQUIDATION_SNAPSHOT_DTYPES)[1:]],
+        "dtypes": LIQUIDATION_SNAPSHOT_DTYPES,
+        "datetimes": [],
+        "time_column": "time",
+        "key": ["symbol", "time", "side", "price", "original_quantity"],
+    },
+}
+
+
+def get_datatype(data_type):
+    try:
+        return DATATYPES[data_type]
+    except KeyError:
+        raise ValueError(f"Unknown data type {data_type!r}; expected one of {', '.join(DATATYPES)}") from None
+
+
+def stored_dtypes(data_type):
+    """{column: dtype} of the rows stored for `data_type`, without `symbol`."""
+    datatype = get_datatype(data_type)
+    return {column: "int64" if column in datatype["datetimes"] else dtype
+            for column, dtype in datatype["dtypes"].items() if column != "symbol"}
+
+
+_EPOCH = pd.Timestamp(0, tz="UTC")
+
+
+def _has_header(f):
+    first = f.readline()
+    f.seek(0)
+    return not first[:1].isdigit()
+
+
+def read_chunks(source, dtypes, chunk_rows=CHUNK_ROWS):
+    """
+    Yield DataFrames of up to `chunk_rows` rows with the columns and dtypes of
+    `dtypes` from an archive CSV, given as a file name or a seekable binary
+    file object (e.g. a zip member).
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            yield from read_chunks(f, dtypes, chunk_rows)
+        return
+    reader = pd.read_csv(
+        source,
+        header=None,
+        names=list(dtypes),
+        skiprows=1 if _has_header(source) else 0,
+        dtype=dtypes,
+        true_values=["true", "True", "TRUE"],
+        false_values=["false", "False", "FALSE"],
+        chunksize=chunk_rows,
+        engine="c",
+    )
+    with reader:
+        yield from reader
+
+
+def read_datatype_chunks(data_type, source, chunk_rows=CHUNK_ROWS):
+    """read_chunks() with the registry dtypes of `data_type`, datetimes converted to epoch ms."""
+    datatype = get_datatype(data_type)
+    dtypes = {column: str if dtype == "str" else dtype for column, dtype in datatype["dtypes"].items()}
+    for chunk in read_chunks(source, dtypes, chunk_rows):
+        for column in datatype["datetimes"]:
+            chunk[column] = (pd.to_datetime(chunk[column], utc=True) - _EPOCH) // pd.Timedelta(milliseconds=1)
+        yield chunk
+
+
+def read_agg_trades_chunks(source, chunk_rows=CHUNK_ROWS):
+    return read_chunks(source, AGG_TRADE_DTYPES, chunk_rows)
+
+
+def read_bookticker_chunks(source, chunk_rows=CHUNK_ROWS):
+    return read_chunks(source, BOOKTICKER_DTYPES, chunk_rows)
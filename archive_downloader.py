@@ -0,0 +1,355 @@
+import hashlib
+import io
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from archive_cache import get_archive_cache
+from time_ranges import iter_days, month_end, to_date
+
+load_dotenv()
+
+# Concurrent downloads of data.binance.vision archives.
+#
+# A thread pool keeps up to `download_workers` archives in flight, while a
+# semaphore per host caps the open connections to any one server. Failed
+# requests (connection errors, timeouts, 429 and 5xx) are retried with
+# exponential backoff and jitter, honouring Retry-After. A 404 is not an
+# error: Binance simply has no archive for that day, so fetch() returns None.
+#
+# With verify=True every archive is checked against the SHA256 Binance
+# publishes next to it (<archive>.CHECKSUM). The body is hashed while it is
+# written, and a mismatch is retried like any other failed transfer.
+#
+# Each job is downloaded and then handed to a callback on the same worker,
+# so storing one archive overlaps with downloading the next ones. In spooled
+# mode the body goes to a SpooledTemporaryFile instead of the working
+# directory (download_spool_mb in memory, an anonymous temp file beyond).
+#
+# Archives already in the local archive cache (archive_cache.py) are served
+# from disk: fetches, checksum lookups and existence checks for cached URLs
+# make no requests, and every archive downloaded and verified against its
+# .CHECKSUM is added to the cache.
+#
+# plan_archives() turns a date range into download jobs: one monthly archive
+# per whole calendar month that has already ended, daily archives for the
+# partial months at either end and for the current month. Monthly archives
+# Binance has not published yet are replaced by their daily archives, so a
+# year of backfill is ~12 requests instead of ~365.
+#
+# Settings (.env): download_workers (default 8), download_per_host (default
+# 8), download_retries (default 5), download_backoff_secs (default 1),
+# download_timeout (seconds, default 60), download_spool_mb (default 64).
+
+BASE_URL = "https://data.binance.vision/data/futures/um/"
+
+WORKERS = int(os.getenv("download_workers", 8))
+PER_HOST = int(os.getenv("download_per_host", 8))
+RETRIES = int(os.getenv("download_retries", 5))
+BACKOFF_SECS = float(os.getenv("download_backoff_secs", 1))
+TIMEOUT = float(os.getenv("download_timeout", 60))
+SPOOL_MEMORY = int(float(os.getenv("download_spool_mb", 64)) * 1024 * 1024)
+
+CHUNK_SIZE = 1024 * 1024
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class DownloadError(Exception):
+    """An archive could not be downloaded after all retries."""
+
+
+class Downloader:
+    """
+    Shared HTTP session plus the worker pool. One instance per run; fetch()
+    is safe to call from several threads.
+    """
+
+    def __init__(self, workers=WORKERS, per_host=PER_HOST, retries=RETRIES,
+                 backoff_secs=BACKOFF_SECS, timeout=TIMEOUT, cache=None):
+        self.workers = workers
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff_secs = backoff_secs
+        self.timeout = timeout
+        self.cache = cache or get_archive_cache()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=per_host)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._host_slots = {}
+        self._lock = threading.Lock()
+        self.stats = {"downloaded": 0, "missing": 0, "failed": 0, "retries": 0, "corrupt": 0, "cached": 0, "bytes": 0}
+
+    def _slot(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self._host_slots[host]
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def _backoff(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = float(retry_after)
+        else:
+            delay = self.backoff_secs * 2 ** attempt
+        time.sleep(delay + random.uniform(0, delay / 2))
+
+    def _get(self, url, open_sink, sha256=None, archive=True):
+        """
+        GET `url` with retries, writing the body to a fresh open_sink() per
+        attempt. Returns (sink, sha256 of the body), or (None, None) if the
+        archive does not exist.
+        With `sha256` set, a body with a different digest is retried.
+        archive=False keeps the request out of the download stats.
+        """
+        for attempt in range(self.retries + 1):
+            response = None
+            try:
+                with self._slot(url):
+                    response = self.session.get(url, stream=True, timeout=self.timeout)
+                    if response.status_code == 404:
+                        response.close()
+                        if archive:
+                            self._count("missing")
+                        return None, None
+                    if response.status_code not in RETRY_STATUS:
+                        response.raise_for_status()
+                        sink = open_sink()
+                        digest = hashlib.sha256()
+                        size = 0
+                        try:
+                            for chunk in response.iter_content(CHUNK_SIZE):
+                                sink.write(chunk)
+                                digest.update(chunk)
+                                size += len(chunk)
+                        except BaseException:
+                            sink.close()
+                            raise
+                        if sha256 is None or digest.hexdigest() == sha256:
+                            if archive:
+                                self._count("downloaded")
+                                self._count("bytes", size)
+                            return sink, digest.hexdigest()
+                        sink.close()
+                        self._count("corrupt")
+                        print(f"Checksum mismatch for {url}, attempt {attempt + 1}/{self.retries + 1}")
+                    else:
+                        response.close()
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                print(f"Download of {url} failed ({e}), attempt {attempt + 1}/{self.retries + 1}")
+            if attempt < self.retries:
+                self._count("retries")
+                self._backoff(attempt, response)
+        self._count("failed")
+        raise DownloadError(f"Giving up on {url} after {self.retries + 1} attempts")
+
+    def checksum(self, url, use_cache=True):
+        """
+        SHA256 (hex) Binance publishes for the archive at `url`, or None if
+        there is no .CHECKSUM file. Cached archives answer from the cache
+        unless use_cache=False.
+        """
+        cached = self.cache.checksum(url) if self.cache and use_cache else None
+        if cached:
+            return cached
+        sink, _ = self._get(f"{url}.CHECKSUM", io.BytesIO, archive=False)
+        if sink is None:
+            return None
+        # "<sha256>  <file name>"
+        return sink.getvalue().decode().split()[0].lower()
+
+    def exists(self, url):
+        """True if `url` exists (a HEAD request, retried like a download, unless it is cached)."""
+        if self.cache and self.cache.checksum(url):
+            return True
+        for attempt in range(self.retries + 1):
+            response = None
+            try:
+                with self._slot(url):
+                    response = self.session.head(url, timeout=self.timeout, allow_redirects=True)
+                if response.status_code == 404:
+                    return False
+                if response.status_code not in RETRY_STATUS:
+                    response.raise_for_status()
+                    return True
+            except (requests.ConnectionError, requests.Timeout) as e:
+                print(f"HEAD {url} failed ({e}), attempt {attempt + 1}/{self.retries + 1}")
+            if attempt < self.retries:
+                self._count("retries")
+                self._backoff(attempt, response)
+        raise DownloadError(f"Giving up on {url} after {self.retries + 1} attempts")
+
+    def existing(self, urls):
+        """The subset of `urls` that exist, checked on the pool."""
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="exists") as pool:
+            return {url for url, found in zip(urls, pool.map(self.exists, urls)) if found}
+
+    def checksums(self, urls):
+        """
+        Published checksum() of every url, fetched on the pool (never from
+        the cache). Returns {url: sha256 or None}.
+        """
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="checksum") as pool:
+            return dict(zip(urls, pool.map(lambda url: self.checksum(url, use_cache=False), urls)))
+
+    def _cached(self, url, sha256):
+        path = self.cache.get(url, sha256) if self.cache else None
+        if path:
+            self._count("cached")
+        return path
+
+    def fetch(self, url, dest, sha256=None):
+        """
+        Download `url` to `dest` (streamed, written via a .part file), or
+        link / copy it from the cache. Returns dest, or None if the archive
+        does not exist.
+        """
+        cached = self._cached(url, sha256)
+        if cached:
+            try:
+                os.link(cached, dest)
+            except OSError:
+                shutil.copyfile(cached, dest)
+            return dest
+
+        part = f"{dest}.part"
+        try:
+            sink, digest = self._get(url, lambda: open(part, "wb"), sha256)
+        except DownloadError:
+            if os.path.exists(part):
+                os.remove(part)
+            raise
+        if sink is None:
+            return None
+        sink.close()
+        os.replace(part, dest)
+        # Unverified digests would answer later checksum lookups; keep them out
+        if self.cache and sha256:
+            with open(dest, "rb") as f:
+                self.cache.put(url, digest, f)
+        return dest
+
+    def fetch_spooled(self, url, max_memory=SPOOL_MEMORY, sha256=None):
+        """
+        Download `url` into a SpooledTemporaryFile, rewound and ready to read:
+        it stays in memory up to max_memory bytes and rolls over to an
+        anonymous temp file beyond that. Cached archives are opened from the
+        cache instead. None if the archive does not exist.
+        """
+        cached = self._cached(url, sha256)
+        if cached:
+            return open(cached, "rb")
+
+        sink, digest = self._get(url, lambda: tempfile.SpooledTemporaryFile(max_size=max_memory), sha256)
+        if sink is not None:
+            sink.seek(0)
+            if self.cache and sha256:
+                self.cache.put(url, digest, sink)
+                sink.seek(0)
+        return sink
+
+    def run(self, jobs, handle, spooled=False, verify=False):
+        """
+        Download every (url, dest, context) job on the pool and call
+        handle(context, path, sha256) on the worker once it is on disk (path
+        is None for missing archives; sha256 is the verified digest with
+        verify=True, else None). With spooled=True nothing is written to
+        `dest`: handle gets the fetch_spooled() file object instead, closed
+        after it returns. Returns [(context, result or exception)] in
+        completion order; one failed job does not stop the others.
+        """
+        started = time.perf_counter()
+
+        def work(url, dest, context):
+            sha256 = self.checksum(url) if verify else None
+            if not spooled:
+                return handle(context, self.fetch(url, dest, sha256), sha256)
+            archive = self.fetch_spooled(url, sha256=sha256)
+            try:
+                return handle(context, archive, sha256)
+            finally:
+                if archive is not None:
+                    archive.close()
+
+        results = []
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="download") as pool:
+            futures = {pool.submit(work, *job): job[2] for job in jobs}
+            for future in as_completed(futures):
+                try:
+                    results.append((futures[future], future.result()))
+                except Exception as e:
+                    print(f"{futures[future]} failed: {e}")
+                    results.append((futures[future], e))
+
+        elapsed = time.perf_counter() - started
+        print(f"Downloaded {self.stats['downloaded']} archives ({self.stats['bytes'] / 1e6:,.1f} MB) in "
+              f"{elapsed:.1f}s, {self.stats['bytes'] / 1e6 / elapsed if elapsed else 0:,.1f} MB/s | "
+              f"cached {self.stats['cached']} | missing {self.stats['missing']} | retries {self.stats['retries']} | corrupt {self.stats['corrupt']} | "
+              f"failed {self.stats['failed']}")
+        return results
+
+    def close(self):
+        self.session.close()
+
+
+def archive_job(data_type, symbol, freq, period):
+    """(url, zip file name, context) of one 'monthly' or 'daily' archive."""
+    stamp = period.strftime("%Y-%m" if freq == "monthly" else "%Y-%m-%d")
+    filename = f"{symbol}-{data_type}-{stamp}.zip"
+    return f"{BASE_URL}{freq}/{data_type}/{symbol}/{filename}", filename, (data_type, symbol, period)
+
+
+def plan_archives(data_types, symbols, start_date, end_date, downloader=None, daily_only=False, today=None,
+                  done=()):
+    """
+    Download jobs covering every day of [start_date, end_date] for each
+    (symbol, data type) with the fewest archives: monthly archives for whole,
+    finished calendar months, daily archives for the rest (all daily with
+    daily_only). With a downloader, monthly archives are checked with HEAD
+    requests first and missing ones fall back to that month's daily archives.
+
+    `done` holds the (data_type, symbol, period) units already ingested
+    (Manifest.completed()). A month with any of its days done stays on daily
+    archives, so a month synced day by day while it was current is not
+    loaded again as a monthly archive once it closes.
+    """
+    start_date, end_date = to_date(start_date), to_date(end_date)
+    today = today or datetime.now(timezone.utc).date()
+
+    monthly, daily = [], []
+    for symbol in symbols:
+        for data_type in data_types:
+            day = start_date
+            while day <= end_date:
+                last = month_end(day)
+                days_done = any((data_type, symbol, d.strftime("%Y-%m-%d")) in done for d in iter_days(day, last))
+                if not daily_only and day.day == 1 and last <= end_date and last < today and not days_done:
+                    monthly.append(archive_job(data_type, symbol, "monthly", day))
+                else:
+                    daily.extend(archive_job(data_type, symbol, "daily", d) for d in iter_days(day, min(last, end_date)))
+                day = last + timedelta(days=1)
+
+    if downloader is not None and monthly:
+        published = downloader.existing([job[0] for job in monthly])
+        for url, _, (data_type, symbol, period) in monthly:
+            if url not in published:
+                print(f"No monthly {data_type} archive for {symbol} {period.strftime('%Y-%m')}; using daily archives")
+                daily.extend(archive_job(data_type, symbol, "daily", d) for d in iter_days(period, month_end(period)))
+        monthly = [job for job in monthly if job[0] in published]
+    print(f"Planned {len(monthly)} monthly and {len(daily)} daily archives")
+    return monthly + daily
@@ -0,0 +1,55 @@
+import argparse
+import random
+import time
+from dotenv import load_dotenv
+from schema import bootstrap_schema
+from storage import STORAGE_BACKENDS, get_storage
+
+# Write/read throughput of each storage backend on synthetic aggTrades.
+#
+#   python bench_storage.py --rows 200000 --backends sqlite3 csv parquet
+#
+# mysql is only included when asked for, since it writes to the configured DB.
+
+
+def synthetic_agg_trades(symbol, rows, start_ms=1692144000000):
+    price = 29000.0
+    trades = []
+    for i in range(rows):
+        price += random.uniform(-0.5, 0.5)
+        trades.append((symbol, 10_000_000 + i, round(price, 1), round(random.uniform(0.001, 2), 3),
+                       20_000_000 + i * 2, 20_000_000 + i * 2 + 1, start_ms + i * 10, random.randint(0, 1)))
+    return trades
+
+
+def bench(backend, trades, symbol, batch_size):
+    storage = get_storage(backend)
+    bootstrap_schema(backend)
+
+    started = time.perf_counter()
+    for i in range(0, len(trades), batch_size):
+        storage.write_agg_trades(trades[i:i + batch_size], symbol)
+    storage.close()
+    write_elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    df = storage.read_agg_trades(symbol, trades[0][6], trades[-1][6] + 1)
+    read_elapsed = time.perf_counter() - started
+
+    print(f"{backend:>8}: write {len(trades) / write_elapsed:>12,.0f} rows/s   "
+          f"read {len(df) / read_elapsed if read_elapsed else 0:>12,.0f} rows/s   ({len(df)} rows read)")
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Benchmark storage backends on synthetic aggTrades")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--symbol", default="BENCHUSDT")
+    parser.add_argument("--backends", nargs="+", default=["sqlite3", "csv", "parquet"],
+                        choices=sorted(STORAGE_BACKENDS))
+    args = parser.parse_args()
+
+    trades = synthetic_agg_trades(args.symbol, args.rows)
+    for backend in args.backends:
+        bench(backend, trades, args.symbol, args.batch_size)
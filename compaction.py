@@ -0,0 +1,245 @@
+import calendar
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+from mysql_connector import create_connection
+from partitions import PARTITIONED_TABLES
+from time_ranges import date_to_ms, day_bounds_ms, ms_to_date, to_date
+
+load_dotenv()
+
+# Per-symbol downsampling and retention for the MySQL tick tables.
+#
+# Raw ticks (aggregated_trades, bookticker) older than the symbol's raw
+# retention are compacted one (table, symbol, day) at a time:
+#
+#   rolled_up  agg_trades_1m and volume_at_price are rebuilt for the day
+#              (aggregated_trades only), so nothing is lost for the API
+#   archived   the day is written to the Parquet store (compaction_archive=1)
+#   deleting   the raw rows are being deleted in batches of compaction_batch_rows
+#   deleted    the day is done
+#
+# Each finished stage and the running delete count are recorded in the
+# compaction_checkpoint table, so an interrupted run resumes where it stopped.
+# Rollups older than the symbol's rollup retention are deleted the same way.
+#
+# partitions.py drops whole days for every symbol at once; use it (with
+# retention_days at least the longest raw retention below) for the bulk and
+# this job for symbols that need to be kept longer or shorter. Run from cron:
+#
+#   python compaction.py
+#
+# Settings (.env): raw_retention_days, rollup_retention_months (unset keeps
+# everything), raw_retention_overrides / rollup_retention_overrides
+# (e.g. "BTCUSDT:90,ETHUSDT:60"), compaction_archive (default 1),
+# compaction_batch_rows (default 50000), compaction_pause_secs (default 0.1).
+
+RAW_TABLES = PARTITIONED_TABLES
+
+# Rollup tables and how their time column is compared with the cutoff
+ROLLUP_TABLES = {
+    "agg_trades_1m": ("minute_time", lambda day: date_to_ms(day)),
+    "volume_at_price": ("day", lambda day: to_date(day).isoformat()),
+}
+
+ARCHIVE = os.getenv("compaction_archive", "1") == "1"
+BATCH_ROWS = int(os.getenv("compaction_batch_rows", 50000))
+PAUSE_SECS = float(os.getenv("compaction_pause_secs", 0.1))
+
+
+def _parse_overrides(value):
+    overrides = {}
+    for item in (value or "").split(","):
+        if item.strip():
+            symbol, amount = item.split(":")
+            overrides[symbol.strip().upper()] = int(amount)
+    return overrides
+
+
+RAW_RETENTION_DAYS = os.getenv("raw_retention_days")
+ROLLUP_RETENTION_MONTHS = os.getenv("rollup_retention_months")
+RAW_OVERRIDES = _parse_overrides(os.getenv("raw_retention_overrides"))
+ROLLUP_OVERRIDES = _parse_overrides(os.getenv("rollup_retention_overrides"))
+
+
+def _months_before(day, months):
+    year, month = divmod(day.year * 12 + day.month - 1 - months, 12)
+    month += 1
+    # Clamp to the month's length (e.g. 31 March - 1 month = 28/29 February)
+    return day.replace(year=year, month=month, day=min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def raw_cutoff(symbol, today=None):
+    """First UTC day whose raw ticks are kept for `symbol`, or None to keep all."""
+    days = RAW_OVERRIDES.get(symbol, RAW_RETENTION_DAYS)
+    if days is None:
+        return None
+    today = today or datetime.now(timezone.utc).date()
+    return today - timedelta(days=int(days))
+
+
+def rollup_cutoff(symbol, today=None):
+    """First UTC day whose rollups are kept for `symbol`, or None to keep all."""
+    months = ROLLUP_OVERRIDES.get(symbol, ROLLUP_RETENTION_MONTHS)
+    if months is None:
+        return None
+    return _months_before(today or datetime.now(timezone.utc).date(), int(months))
+
+
+def _checkpoint(cursor, table, symbol, day):
+    cursor.execute("""
+        SELECT stage, rows_deleted FROM compaction_checkpoint
+        WHERE table_name = %s AND symbol = %s AND day = %s
+    """, (table, symbol, to_date(day).isoformat()))
+    row = cursor.fetchone()
+    return (row[0], row[1]) if row else (None, 0)
+
+
+def _save_checkpoint(connection, cursor, table, symbol, day, stage, rows_deleted=0):
+    cursor.execute("""
+        INSERT INTO compaction_checkpoint (table_name, symbol, day, stage, rows_deleted)
+        VALUES (%s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE stage = VALUES(stage), rows_deleted = VALUES(rows_deleted)
+    """, (table, symbol, to_date(day).isoformat(), stage, rows_deleted))
+    connection.commit()
+
+
+def _delete_in_batches(connection, cursor, delete_query, params, on_batch=None, total=0):
+    """Run a `DELETE ... LIMIT` until it stops deleting; returns `total` plus the rows deleted."""
+    while True:
+        cursor.execute(delete_query, params + (BATCH_ROWS,))
+        deleted = cursor.rowcount
+        connection.commit()
+        total += deleted
+        if on_batch:
+            on_batch(total)
+        if deleted < BATCH_ROWS:
+            return total
+        if PAUSE_SECS:
+            time.sleep(PAUSE_SECS)  # let replication and live writers keep up
+
+
+def _archive_day(table, symbol, day):
+    import parquet_store
+    from storage import get_storage
+
+    start_ms, end_ms = day_bounds_ms(day)
+    storage = get_storage("mysql")
+    read = storage.read_agg_trades if table == "aggregated_trades" else storage.read_bookticker
+    # Fixed file name per day, so archiving a day again overwrites it
+    parquet_store.write_frame(read(symbol, start_ms, end_ms), table, symbol, f"archive-{to_date(day).isoformat()}")
+
+
+def _roll_up_day(symbol, day):
+    from rollups import refresh_mysql
+    from volume_at_price import rebuild_mysql
+
+    refresh_mysql(symbol, *day_bounds_ms(day))
+    rebuild_mysql(symbol, day)
+
+
+def compact_raw(connection, table, symbol, cutoff_day):
+    """Compact every day of `symbol` in `table` before cutoff_day. Returns rows deleted."""
+    column = RAW_TABLES[table]
+    cutoff_ms = date_to_ms(cutoff_day)
+    cursor = connection.cursor()
+    total = 0
+    try:
+        while True:
+            # Oldest remaining day; finished days have no rows left, so gaps are skipped
+            cursor.execute(f"SELECT MIN({column}) FROM {table} WHERE symbol = %s AND {column} < %s",
+                           (symbol, cutoff_ms))
+            oldest = cursor.fetchone()[0]
+            connection.commit()
+            if oldest is None:
+                return total
+            day = ms_to_date(oldest)
+            start_ms, end_ms = day_bounds_ms(day)
+
+            stage, rows_deleted = _checkpoint(cursor, table, symbol, day)
+            if stage == "deleted":
+                stage = None  # the day was loaded again after an earlier compaction
+            if stage != "deleting":
+                rows_deleted = 0
+
+            if table == "aggregated_trades" and stage is None:
+                _roll_up_day(symbol, day)
+                stage = "rolled_up"
+                _save_checkpoint(connection, cursor, table, symbol, day, stage)
+
+            if ARCHIVE and stage in (None, "rolled_up"):
+                _archive_day(table, symbol, day)
+                stage = "archived"
+                _save_checkpoint(connection, cursor, table, symbol, day, stage)
+
+            deleted = _delete_in_batches(
+                connection, cursor,
+                f"DELETE FROM {table} WHERE symbol = %s AND {column} >= %s AND {column} < %s LIMIT %s",
+                (symbol, start_ms, end_ms),
+                on_batch=lambda n: _save_checkpoint(connection, cursor, table, symbol, day, "deleting", n),
+                total=rows_deleted)
+            _save_checkpoint(connection, cursor, table, symbol, day, "deleted", deleted)
+            print(f"Compacted {table} {symbol} {day}: {deleted} rows deleted")
+            total += deleted - rows_deleted
+    finally:
+        cursor.close()
+
+
+def expire_rollups(connection, table, symbol, cutoff_day):
+    """Delete `symbol`'s rows in a rollup table before cutoff_day. Returns rows deleted."""
+    column, cutoff_value = ROLLUP_TABLES[table]
+    cursor = connection.cursor()
+    try:
+        deleted = _delete_in_batches(
+            connection, cursor,
+            f"DELETE FROM {table} WHERE symbol = %s AND {column} < %s LIMIT %s",
+            (symbol, cutoff_value(cutoff_day)),
+            on_batch=lambda n: _save_checkpoint(connection, cursor, table, symbol, cutoff_day, "deleting", n))
+        _save_checkpoint(connection, cursor, table, symbol, cutoff_day, "deleted", deleted)
+    finally:
+        cursor.close()
+    if deleted:
+        print(f"Expired {deleted} {table} rows of {symbol} before {cutoff_day}")
+    return deleted
+
+
+def _symbols(cursor, table):
+    # symbol leads the primary key of every table here, so this is a loose index scan
+    cursor.execute(f"SELECT DISTINCT symbol FROM {table}")
+    return [row[0] for row in cursor.fetchall()]
+
+
+def run(today=None):
+    """Apply raw and rollup retention to every symbol. Returns {table: rows deleted}."""
+    connection = create_connection()
+    if not connection:
+        return {}
+
+    totals = {}
+    try:
+        for table in list(RAW_TABLES) + list(ROLLUP_TABLES):
+            cursor = connection.cursor()
+            symbols = _symbols(cursor, table)
+            cursor.close()
+            connection.commit()
+            for symbol in symbols:
+                if table in RAW_TABLES:
+                    cutoff_day = raw_cutoff(symbol, today)
+                    compact = compact_raw
+                else:
+                    cutoff_day = rollup_cutoff(symbol, today)
+                    compact = expire_rollups
+                if cutoff_day is not None:
+                    totals[table] = totals.get(table, 0) + compact(connection, table, symbol, cutoff_day)
+    finally:
+        connection.close()
+    return totals
+
+
+if __name__ == "__main__":
+    from schema import ensure_mysql_schema
+
+    ensure_mysql_schema()
+    for table, deleted in run().items():
+        print(f"{table}: {deleted} rows deleted")
@@ -6,9 +6,11 @@ from binance import AsyncClient, BinanceSocketManager
 from dotenv import load_dotenv
 from collections import defaultdict
 import pandas as pd
-from utils import store_klines_to_db, vsa_volume, check_spikes,send_to_telegram
+from utils import vsa_volume, check_spikes,send_to_telegram
 from datetime import datetime
-from mysql_connector import store_klines_to_mysql
+from schema import bootstrap_schema
+from storage import get_storage
+from time_ranges import interval_to_ms, interval_open_ms
 # from vp import calculate_vp
 import pandas as pd
 from utils import calculate_advanced_volume_profile as cavp
@@ -74,13 +76,40 @@ async def fetch_historical_data(symbol: str, interval: str, desired_limit: int =
 
 
 
+def read_rollup_bars(symbol: str, interval: str, limit: int) -> pd.DataFrame:
+    """
+    Last `limit` bars of `interval` from the stored 1-minute agg trade rollups,
+    in the same column layout as the REST klines frame used by check_spikes.
+    """
+    interval_ms = interval_to_ms(interval)
+    end_ms = int(time.time() * 1000)
+    start_ms = interval_open_ms(end_ms, interval_ms) - (limit - 1) * interval_ms
+    bars = get_storage().read_trade_bars(symbol, interval, start_ms, end_ms)
+    return bars.rename(columns={
+        "open_time": "Open_Time", "open": "Open", "high": "High", "low": "Low",
+        "close": "Close", "volume": "Volume", "trades": "Number_of_Trades",
+    })
+
+
 async def main(symbols: List[str],intervals_list: List[str]):
     print(f'Started Collecting Tick Data of {symbols}...')
+    # `alert_source=rollups` checks spikes on bars built from stored agg trades
+    # instead of fetching klines over REST (monthly intervals always use REST)
+    alert_source = os.getenv("alert_source", "rest").lower().strip()
     for interval in intervals_list:
         limit = get_limit_from_interval(interval)
 
         # Fetch historical data (M=month,w=week,d=day,h=hour,m=minute)
         for symbol in symbols:
+            if alert_source == "rollups" and not interval.endswith("M"):
+                # Bars come from our own ingested ticks: no REST calls, no rate limit
+                df = read_rollup_bars(symbol, interval, limit)
+                last_rows = check_spikes(df,2)
+                for _, row in last_rows.iterrows():
+                    if row['Result_Bearish'] or row['Result_Bullish']:
+                        send_to_telegram(symbol)
+                continue
+
             time.sleep(5)
             print(f"Fetching historical data for {symbol} with interval {interval} and limit {limit}")
             klines = await fetch_historical_data(symbol, interval=interval, desired_limit=limit)
@@ -89,19 +118,17 @@ async def main(symbols: List[str],intervals_list: List[str]):
             columns = ["Open_Time", "Open", "High", "Low", "Close", "Volume", "Close_Time", "Quote_Asset_Volume", "Number_of_Trades", "Taker_Buy_Base_Asset_Volume", "Taker_Buy_Quote_Asset_Volume", "Ignore"]
             df = pd.DataFrame(klines, columns=columns)
             df[['Open', 'High', 'Low', 'Close', 'Volume']] = df[['Open', 'High', 'Low', 'Close', 'Volume']].apply(pd.to_numeric)
-            if os.getenv('storage') == 'sqlite3':
-                store_klines_to_db(klines,interval,symbol)
-            if os.getenv('storage') == 'mysql':
-                store_klines_to_mysql(klines,interval,symbol)
-            else:
-                # df = vsa_volume(df)
-                last_rows = check_spikes(df,2)
-                for _, row in last_rows.iterrows():
-                    if row['Result_Bearish'] or row['Result_Bullish']:
-                        send_to_telegram(symbol)
+            get_storage().write_klines(klines,interval,symbol)
+
+            # df = vsa_volume(df)
+            last_rows = check_spikes(df,2)
+            for _, row in last_rows.iterrows():
+                if row['Result_Bearish'] or row['Result_Bullish']:
+                    send_to_telegram(symbol)
 
 if __name__ == "__main__":
     load_dotenv()
+    bootstrap_schema()
     # logger.remove()
 
     # Load symbol from .env
@@ -1,140 +1,273 @@
-import requests
 import os
+import shutil
 import zipfile
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from utils import store_aggregated_trades_to_db
-from mysql_connector import store_aggregated_trades_to_mysql
-
-BASE_URL = "https://data.binance.vision/data/futures/um/"
-
-# DATA_TYPES = ["aggTrades", "bookTicker", "metrics", "liquidationSnapshot"]
-
-DATA_TYPES = ["aggTrades"]
-
-import csv
-
-def combine_csv_files(file_paths, output_file_name):
-    combined_data = []
-    for file_path in file_paths:
-        with open(file_path, 'r') as f:
-            reader = csv.reader(f)
-            data = list(reader)
-            if combined_data:  # If combined_data is not empty
-                data = data[1:]  # remove the header
-            combined_data.extend(data)
-    with open(output_file_name, 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerows(combined_data)
-
-
-def read_csv_and_store(file_name, symbol):
-    with open(file_name, 'r') as csv_file:
-        # Use csv.reader to read the file
-        reader = csv.reader(csv_file)
-        
-        # Skip the header
-        next(reader)
-        
-        # Process the CSV rows
-        aggregated_trades_data = []
-        for row in reader:
-            # Convert the "is_buyer_maker" column from string 'true' or 'false' to int (1 or 0)
-            is_buyer_maker = 1 if row[6].lower() == 'true' else 0
-            trade = (symbol,) + tuple(row[:6]) + (is_buyer_maker,)
-            aggregated_trades_data.append(trade)
-        
-        # Now, store this processed data in the DB
-        if os.getenv('storage') == 'mysql':
-            store_aggregated_trades_to_mysql(aggregated_trades_data, symbol)
-        if os.getenv('storage') == 'sqlite3':
-            store_aggregated_trades_to_db(aggregated_trades_data, symbol)        
-
-def download_data(data_type, symbol, start_date, end_date,freq):
+import time
+from archive_csv import CHUNK_ROWS, get_datatype, read_datatype_chunks
+from archive_downloader import CHUNK_SIZE, Downloader, plan_archives
+from ingest_pipeline import IngestPipeline
+from manifest import MANIFEST_ENABLED, VERIFY_CHECKSUMS, Manifest, ingest_archives
+from schema import bootstrap_schema
+from storage import get_storage
+from tick_cache import build_from_csv as build_tick_cache
+
+# Archive data types to ingest (`data_types`, comma separated): any entry of
+# the archive_csv.DATATYPES registry, e.g. aggTrades,bookTicker,metrics,
+# liquidationSnapshot. Every type goes through the same downloader, manifest
+# and pipeline; only aggTrades has the LOAD DATA / Arrow bulk paths and the
+# tick cache.
+DATA_TYPES = [s.strip() for s in os.getenv("data_types", "aggTrades").split(",") if s.strip()]
+
+# `stream_archives=1` never writes archives or extracted CSVs to disk: each
+# download is spooled (archive_downloader.py), its CSV members are read
+# straight out of the zip and stored in batches of `stream_batch_rows`, so
+# memory stays bounded however large the archive is. The archive cache
+# (archive_cache.py) is off by default in this mode, as it writes to disk.
+STREAM_ARCHIVES = os.getenv("stream_archives") == "1"
+STREAM_BATCH_ROWS = int(os.getenv("stream_batch_rows", CHUNK_ROWS))
+
+# Database and Parquet backends ingest through the staged download -> parse ->
+# write pipeline (ingest_pipeline.py) unless `ingest_pipeline=0` or
+# `bulk_load=1` (which needs the extracted file for LOAD DATA).
+PIPELINE = os.getenv("ingest_pipeline", "1") == "1"
+
+# Read/write buffer of combine_csv_files
+COMBINE_BUFFER_SIZE = 16 * 1024 * 1024
+
+
+def combine_csv_files(file_paths, output_file_name, buffer_size=COMBINE_BUFFER_SIZE):
+    """
+    Concatenate archive CSVs into one file in constant memory: the bytes
+    after each file's header are copied with large buffered reads and
+    writes. The header of the first file (if it has one) is kept; header-less
+    archives are copied whole.
+    """
+    part = f"{output_file_name}.part"
+    with open(part, 'wb', buffering=buffer_size) as out:
+        for file_path in file_paths:
+            with open(file_path, 'rb', buffering=buffer_size) as f:
+                first_line = f.readline()
+                if first_line[:1].isdigit() or out.tell() == 0:
+                    out.write(first_line)
+                shutil.copyfileobj(f, out, buffer_size)
+                # Keep rows apart if a file does not end with a newline
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':
+                        out.write(b'\n')
+    os.replace(part, output_file_name)
+
+
+def store_csv_stream(csv_file, symbol, data_type="aggTrades", batch_rows=STREAM_BATCH_ROWS):
+    """
+    Store an archive CSV of `data_type` from a file name or an open binary
+    file (e.g. a zip member), parsed in vectorized chunks of `batch_rows`
+    (archive_csv.py). Returns the number of rows stored.
+    """
+    rows = 0
+    for chunk in read_datatype_chunks(data_type, csv_file, batch_rows):
+        get_storage().write_frame(data_type, chunk, symbol)
+        rows += len(chunk)
+    return rows
+
+def read_csv_and_store(file_name, symbol, data_type="aggTrades"):
+    return store_csv_stream(file_name, symbol, data_type)
+
+def bulk_load_csv(file_name, symbol):
+    """
+    Load an extracted aggTrades CSV with the backend's bulk path
+    (LOAD DATA LOCAL INFILE for MySQL, staged INSERT ... SELECT for SQLite)
+    and report the throughput.
+    """
+    started = time.perf_counter()
+    rows = get_storage().load_agg_trades_csv(file_name, symbol)
+    elapsed = time.perf_counter() - started
+    print(f"Bulk loaded {rows} rows from {os.path.basename(file_name)} in {elapsed:.2f}s "
+          f"({rows / elapsed if elapsed else 0:,.0f} rows/s)")
+    return rows
+
+def process_archive(context, zip_path):
+    """
+    Extract a downloaded archive and store its CSVs. Runs on a download worker.
+    Returns (rows stored, CSV paths kept for combining (csv storage only)).
+    """
+    data_type, symbol, period = context
+    if zip_path is None:
+        print(f"No {data_type} archive for {symbol} {period.strftime('%Y-%m-%d')}. Skipping...")
+        return 0, []
+
+    rows = 0
+    kept_csv_files = []
+    # Unzip the file
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        # Define extract path
+        # extract_path = os.path.join("data","futures", symbol.replace("USDT", "_USDT"))
+        extract_path = os.path.join("data","futures")
+        # Ensure the path exists
+        os.makedirs(extract_path, exist_ok=True)
+
+        zip_ref.extractall(extract_path)
+
+        # Since a zip might have multiple files, get the list of files
+        csv_files = [name for name in zip_ref.namelist() if name.endswith('.csv')]
+
+        # Store the contents of each csv in the database
+        for csv_file in csv_files:
+            csv_path = os.path.join(extract_path, csv_file)
+            if os.getenv('tick_cache') == '1' and data_type == 'aggTrades':
+                # Memory-mappable per-day copy for the analytics (tick_cache.py)
+                build_tick_cache(csv_path, symbol)
+            if get_storage().name == 'csv':
+                # Raw archive CSVs are kept and combined per symbol below
+                kept_csv_files.append(csv_path)
+                print('Data saved')
+            elif data_type == 'aggTrades' and (os.getenv('bulk_load') == '1' or get_storage().name == 'parquet'):
+                # Parquet always converts the archive CSV in one pass
+                rows += bulk_load_csv(csv_path, symbol)
+                os.remove(csv_path)
+            else:
+                rows += read_csv_and_store(csv_path, symbol, data_type)
+                os.remove(csv_path)  # If you wish to remove the csv file after processing
+
+    os.remove(zip_path)
+    print(f"Successfully downloaded and extracted {data_type} for {symbol} {period.strftime('%Y-%m-%d')}.")
+    return rows, kept_csv_files
+
+
+def stream_archive(context, archive):
     """
-    Download data from Binance for a given symbol, type, and date range.
+    Store a spooled archive without extracting it (stream_archives=1). Runs
+    on a download worker. Returns (rows stored, CSV paths kept for combining
+    (csv storage only)).
     """
-    current_date = start_date
-    symbol_csv_files = []
-
-    while current_date <= end_date:
-        # Determine if the data is daily or monthly
-        # if current_date.day == 1 and current_date + timedelta(days=28) <= end_date:  # Approximately a month
-        if freq == 'monthly':
-            freq = "monthly"
-            filename = f"{symbol}-{data_type}-{current_date.year}-{str(current_date.month).zfill(2)}.zip"
-            current_date += timedelta(days=30)  # Increment by roughly a month
-        else:
-            freq = "daily"
-            filename = f"{symbol}-{data_type}-{current_date.year}-{str(current_date.month).zfill(2)}-{str(current_date.day).zfill(2)}.zip"
-            current_date += timedelta(days=1)  # Increment by a day
-        
-        # Build URL
-        url = os.path.join(BASE_URL, freq, data_type, symbol, filename)
-        
-        # Download the zip file
-        response = requests.get(url)
-        if response.status_code != 200:
-            print(f"Failed to download data for {current_date.strftime('%Y-%m-%d')}. Skipping...")
-            continue
-        
-        with open(filename, 'wb') as file:
-            file.write(response.content)
-        
-        # Unzip the file
-        with zipfile.ZipFile(filename, 'r') as zip_ref:
-            # Define extract path
-            # extract_path = os.path.join("data","futures", symbol.replace("USDT", "_USDT"))
-            extract_path = os.path.join("data","futures")
-            # Ensure the path exists
-            if not os.path.exists(extract_path):
-                os.makedirs(extract_path)
-
-            zip_ref.extractall(extract_path)
-
-            # Since a zip might have multiple files, get the list of files
-            csv_files = [name for name in zip_ref.namelist() if name.endswith('.csv')]
-            
-            # Store the contents of each csv in the database
-            for csv_file in csv_files:
-                csv_path = os.path.join(extract_path, csv_file)
-                symbol_csv_files.append(csv_path)
-                if os.getenv('storage') == 'csv':
-                    print('Data saved')
+    data_type, symbol, period = context
+    if archive is None:
+        print(f"No {data_type} archive for {symbol} {period.strftime('%Y-%m-%d')}. Skipping...")
+        return 0, []
+
+    total_rows = 0
+    kept_csv_files = []
+    with zipfile.ZipFile(archive, 'r') as zip_ref:
+        for csv_file in [name for name in zip_ref.namelist() if name.endswith('.csv')]:
+            started = time.perf_counter()
+            if os.getenv('tick_cache') == '1' and data_type == 'aggTrades':
+                with zip_ref.open(csv_file) as member:
+                    build_tick_cache(member, symbol)
+            with zip_ref.open(csv_file) as member:
+                if get_storage().name == 'csv':
+                    # The csv backend keeps the raw archive CSVs; copy the member out
+                    csv_path = os.path.join("data", "futures", csv_file)
+                    os.makedirs(os.path.dirname(csv_path), exist_ok=True)
+                    with open(csv_path, 'wb') as out:
+                        shutil.copyfileobj(member, out, CHUNK_SIZE)
+                    kept_csv_files.append(csv_path)
+                    continue
+                if get_storage().name == 'parquet' and data_type == 'aggTrades':
+                    # Arrow's streaming CSV reader; the member name keeps re-runs idempotent
+                    import parquet_store
+                    rows = parquet_store.write_csv(member, "aggregated_trades", symbol,
+                                                   basename=os.path.splitext(os.path.basename(csv_file))[0])
                 else:
-                    read_csv_and_store(csv_path, symbol)
-                    os.remove(csv_path)  # If you wish to remove the csv file after processing
-        
-        os.remove(filename)
-        print(f"Successfully downloaded and extracted data for {current_date.strftime('%Y-%m-%d')}.")
-        
-
-    print(f"List of all csv files {symbol_csv_files} of {symbol}")
-
-    if os.getenv('storage') == 'csv':
-        # ... at the end of your for-loop iterating over the symbols:
-        combined_file_name = os.path.join("data", "futures", f"{symbol}_{os.getenv('frequency')}_combined.csv")
-        combine_csv_files(symbol_csv_files, combined_file_name)
-        print(f"All data for {symbol} combined and saved to {combined_file_name}.")
-        # ... after combining the files:
-        for file_path in symbol_csv_files:
-            os.remove(file_path)
-        # Reset the list for the next symbol
-        symbol_csv_files = []
-
-
-
-load_dotenv()
-# Usage example
-symbol_list = [s.strip() for s in os.getenv("symbols").split(",")]
-lookback = int(os.getenv('lookback'))
-freq = os.getenv('frequency')
-for symbol in symbol_list:
+                    rows = store_csv_stream(member, symbol, data_type)
+            total_rows += rows
+            elapsed = time.perf_counter() - started
+            print(f"Streamed {rows} rows from {csv_file} in {elapsed:.2f}s "
+                  f"({rows / elapsed if elapsed else 0:,.0f} rows/s)")
+
+    print(f"Successfully downloaded and stored {data_type} for {symbol} {period.strftime('%Y-%m-%d')}.")
+    return total_rows, kept_csv_files
+
+
+def cache_member(data_type, member, open_member, symbol):
+    # Memory-mappable per-day copy of the trades for the analytics (tick_cache.py)
+    if data_type != 'aggTrades':
+        return
+    with open_member() as f:
+        build_tick_cache(f, symbol)
+
+
+def run_pipeline(downloader, jobs):
+    """Ingest the jobs through the staged pipeline, with the manifest unless disabled."""
+    storage = get_storage()
+    manifest = Manifest(storage.name) if MANIFEST_ENABLED else None
+    pipeline = IngestPipeline(
+        downloader, read_datatype_chunks, storage.write_frame, storage,
+        manifest=manifest,
+        on_member=cache_member if os.getenv('tick_cache') == '1' else None,
+        verify=VERIFY_CHECKSUMS,
+    )
+    try:
+        return pipeline.run(jobs)
+    finally:
+        if manifest is not None:
+            manifest.close()
+
+
+def download_data(symbols, data_types, start_date, end_date, freq, downloader=None):
+    """
+    Download and store every (symbol, data type, day/month) archive in
+    [start_date, end_date]; data types are archive_csv.DATATYPES entries,
+    ingested alike. Whole past months come as monthly archives unless
+    freq is 'daily' (plan_archives). All symbols share one pool of concurrent
+    downloads (archive_downloader.py), so a backfill is bound by bandwidth
+    rather than by request round trips. Archives already in the ingestion
+    manifest (manifest.py) are skipped.
+    """
+    for data_type in data_types:
+        get_datatype(data_type)
+    done = {}
+    if MANIFEST_ENABLED and get_storage().name != 'csv':
+        # Months partly ingested as daily archives stay daily (plan_archives)
+        manifest = Manifest(get_storage().name)
+        done = manifest.completed()
+        manifest.close()
+    downloader = downloader or Downloader()
+    jobs = plan_archives(data_types, symbols, start_date, end_date, downloader, daily_only=freq == 'daily',
+                         done=done)
+    handle = stream_archive if STREAM_ARCHIVES else process_archive
+
+    if get_storage().name == 'csv':
+        # The combined files are rebuilt from this run's archives, so every
+        # archive is downloaded again and the manifest is not used
+        results = downloader.run(jobs, lambda context, archive, sha256: handle(context, archive),
+                                 spooled=STREAM_ARCHIVES, verify=VERIFY_CHECKSUMS)
+        symbol_csv_files = {}
+        for (data_type, symbol, period), result in results:
+            if isinstance(result, tuple):
+                symbol_csv_files.setdefault((symbol, data_type), []).append((period, result[1]))
+        for (symbol, data_type), files in symbol_csv_files.items():
+            # Downloads finish in any order; combine in date order
+            file_paths = [path for _, kept in sorted(files, key=lambda item: item[0]) for path in kept]
+            print(f"List of all csv files {file_paths} of {symbol}")
+            # aggTrades keeps its original file name
+            name = symbol if data_type == 'aggTrades' else f"{symbol}_{data_type}"
+            combined_file_name = os.path.join("data", "futures", f"{name}_{os.getenv('frequency')}_combined.csv")
+            combine_csv_files(file_paths, combined_file_name)
+            print(f"All data for {symbol} combined and saved to {combined_file_name}.")
+            # ... after combining the files:
+            for file_path in file_paths:
+                os.remove(file_path)
+    elif PIPELINE and os.getenv('bulk_load') != '1':
+        results = run_pipeline(downloader, jobs)
+    else:
+        results = ingest_archives(downloader, jobs, handle, get_storage(), spooled=STREAM_ARCHIVES)
+    if get_storage().name != 'csv':
+        # Archive chunks only mark their days for a profile rebuild; run the rest
+        get_storage().flush()
+    downloader.close()
+    return results
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    bootstrap_schema()
+    # Usage example
+    symbol_list = [s.strip() for s in os.getenv("symbols").split(",")]
     # Set end_date to today's date
     end_date = datetime.today().date()
-    
-    # Set start_date to 29 days before the end_date (to make a range of 30 days including the end date)
+
+    # Set start_date to `lookback` days before the end_date
     start_date = end_date - timedelta(days=int(os.getenv('lookback')))
 
-    for data_type in DATA_TYPES:
-        download_data(data_type, symbol, start_date, end_date,freq=os.getenv('frequency'))
+    download_data(symbol_list, DATA_TYPES, start_date, end_date, freq=os.getenv('frequency'))
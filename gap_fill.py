@@ -0,0 +1,249 @@
+import asyncio
+import os
+import time
+from dotenv import load_dotenv
+from metrics import Histogram, LATENCY_MS_BUCKETS, BATCH_SIZE_BUCKETS
+
+load_dotenv()
+
+# Gap-free live aggTrades.
+#
+# Binance numbers the agg trades of a symbol with consecutive ids, so the
+# last agg_trade_id seen per symbol is enough to notice lost trades: when the
+# next trade does not follow it (a reconnect, or messages dropped by the
+# stream), the missing ids are fetched through the REST aggTrades endpoint
+# (fromId, up to `backfill_page_size` trades per request, at most
+# `backfill_concurrency` requests in flight) and emitted in id order before
+# the live trades of that symbol resume. The other symbols keep streaming
+# while one backfills. Replayed trades (id not above the last one) are
+# dropped.
+#
+# Requests are paced by their request weight (20 for futures aggTrades, 2
+# for spot) so backfills spend at most `backfill_weight_per_min` of the IP's
+# weight budget and leave the rest to the other REST users. A 429 or 418
+# pauses every backfill request for the Retry-After the exchange sends
+# (Binance bans the IP, 418, when 429s are ignored); other failures are
+# retried `backfill_retries` times with exponential backoff.
+#
+# Gaps wider than `backfill_max_ids` are reported but not backfilled; load
+# that range from the archives (download_agg.py) instead.
+#
+# Settings (.env): backfill_concurrency (default 4), backfill_page_size
+# (default 1000), backfill_max_ids (default 5000), backfill_retries
+# (default 3), backfill_weight_per_min (default 600).
+
+CONCURRENCY = int(os.getenv("backfill_concurrency", 4))
+PAGE_SIZE = int(os.getenv("backfill_page_size", 1000))
+MAX_IDS = int(os.getenv("backfill_max_ids", 5000))
+RETRIES = int(os.getenv("backfill_retries", 3))
+WEIGHT_PER_MIN = float(os.getenv("backfill_weight_per_min", 600))
+
+# Request weight of one aggTrades page
+REQUEST_WEIGHT = {"future": 20, "spot": 2}
+RATE_LIMIT_STATUS = {418, 429}
+# Pause when a 429/418 comes without a Retry-After
+DEFAULT_RETRY_AFTER = 60
+
+
+def agg_trade_row(symbol, trade):
+    """Row in the Storage agg trades format from a websocket or REST aggTrade payload."""
+    return (
+        symbol,
+        trade['a'],                 # agg_trade_id
+        float(trade['p']),          # price
+        float(trade['q']),          # quantity
+        trade['f'],                 # first_trade_id
+        trade['l'],                 # last_trade_id
+        trade['T'],                 # transact_time
+        int(trade['m'])             # is_buyer_maker, convert boolean to integer (0 or 1)
+    )
+
+
+def _retry_after(e):
+    """Seconds to back off for a rate limit (429) or IP ban (418) error, else None."""
+    if getattr(e, "status_code", None) not in RATE_LIMIT_STATUS:
+        return None
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    retry_after = headers.get("Retry-After")
+    return float(retry_after) if retry_after and retry_after.isdigit() else DEFAULT_RETRY_AFTER
+
+
+class WeightBudget:
+    """
+    Token bucket of request weight refilled at `per_minute`; acquire() waits
+    until the weight is available and pause() stops everyone for a while.
+    """
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60
+        # Bursts of up to ten seconds' worth of weight
+        self.capacity = max(per_minute / 6, 1)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, weight):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self.tokens >= min(weight, self.capacity):
+                    self.tokens -= weight
+                    return
+                await asyncio.sleep((min(weight, self.capacity) - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class AggTradeGapFiller:
+    """
+    Sits between the socket and the write-behind buffer: on_trade(row) takes
+    every live row and emit_fn(symbol, row) (async, e.g. WriteBehindBuffer.add)
+    receives them in agg_trade_id order per symbol, backfilled rows included.
+    `client` is a python-binance AsyncClient; `market` is "future" or "spot".
+    """
+
+    def __init__(self, client, market, emit_fn, concurrency=CONCURRENCY, page_size=PAGE_SIZE,
+                 max_ids=MAX_IDS, retries=RETRIES, weight_per_min=WEIGHT_PER_MIN):
+        self.client = client
+        self.market = market
+        self.emit_fn = emit_fn
+        self.page_size = page_size
+        self.max_ids = max_ids
+        self.retries = retries
+        self.last_ids = {}
+        self._held = {}
+        self._tasks = set()
+        self._requests = asyncio.Semaphore(concurrency)
+        self._budget = WeightBudget(weight_per_min)
+
+        self.backfill_ms = Histogram(LATENCY_MS_BUCKETS)
+        self.gap_size = Histogram(BATCH_SIZE_BUCKETS)
+        self.gaps = 0
+        self.backfilled = 0
+        self.unfilled = 0
+        self.skipped_gaps = 0
+        self.failed_gaps = 0
+        self.duplicates = 0
+        self.reconnects = 0
+        self.rate_limited = 0
+
+    async def on_trade(self, row):
+        symbol = row[0]
+        if symbol in self._held:
+            # A backfill of this symbol is running; its live rows wait behind it
+            self._held[symbol].append(row)
+            return
+        if not self._follows(row):
+            self._held[symbol] = [row]
+            return
+        await self._accept(row)
+
+    def on_reconnect(self):
+        # Trades missed while disconnected show up as a gap before the next live trade
+        self.reconnects += 1
+
+    def _follows(self, row):
+        """False if trades are missing before `row`; starts their backfill."""
+        symbol, agg_trade_id = row[0], row[1]
+        last = self.last_ids.get(symbol)
+        if last is None or agg_trade_id <= last + 1:
+            return True
+        from_id, to_id = last + 1, agg_trade_id - 1
+        missing = to_id - from_id + 1
+        self.gaps += 1
+        self.gap_size.observe(missing)
+        if missing > self.max_ids:
+            self.skipped_gaps += 1
+            print(f"[aggTrades gaps] {symbol}: {missing} trades missing ({from_id}-{to_id}), "
+                  f"more than backfill_max_ids; load them from the archives")
+            self.last_ids[symbol] = to_id
+            return True
+        task = asyncio.create_task(self._backfill(symbol, from_id, to_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return False
+
+    async def _accept(self, row):
+        symbol, agg_trade_id = row[0], row[1]
+        if agg_trade_id <= self.last_ids.get(symbol, agg_trade_id - 1):
+            self.duplicates += 1
+            return
+        self.last_ids[symbol] = agg_trade_id
+        await self.emit_fn(symbol, row)
+
+    async def _fetch_page(self, symbol, from_id, limit):
+        fetch = self.client.futures_aggregate_trades if self.market == "future" else self.client.get_aggregate_trades
+        weight = REQUEST_WEIGHT.get(self.market, REQUEST_WEIGHT["future"])
+        for attempt in range(self.retries + 1):
+            try:
+                async with self._requests:
+                    await self._budget.acquire(weight)
+                    return await fetch(symbol=symbol, fromId=from_id, limit=limit)
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                delay = _retry_after(e)
+                if delay is not None:
+                    # Every backfill request waits, not only this one
+                    self.rate_limited += 1
+                    self._budget.pause(delay)
+                else:
+                    delay = 2 ** attempt
+                print(f"[aggTrades gaps] {symbol} fromId={from_id} failed ({e}); retrying in {delay:.0f}s")
+                await asyncio.sleep(delay)
+
+    async def _backfill(self, symbol, from_id, to_id):
+        started = time.monotonic()
+        pages = [(start, min(self.page_size, to_id - start + 1))
+                 for start in range(from_id, to_id + 1, self.page_size)]
+        try:
+            results = await asyncio.gather(*(self._fetch_page(symbol, start, limit) for start, limit in pages))
+        except Exception as e:
+            self.failed_gaps += 1
+            print(f"[aggTrades gaps] {symbol}: backfill of {from_id}-{to_id} failed ({e}); "
+                  f"load that range from the archives")
+        else:
+            trades = sorted((trade for page in results for trade in page if from_id <= trade['a'] <= to_id),
+                            key=lambda trade: trade['a'])
+            for trade in trades:
+                await self.emit_fn(symbol, agg_trade_row(symbol, trade))
+            elapsed_ms = (time.monotonic() - started) * 1000
+            self.backfilled += len(trades)
+            self.unfilled += to_id - from_id + 1 - len(trades)
+            self.backfill_ms.observe(elapsed_ms)
+            print(f"[aggTrades gaps] {symbol}: backfilled {len(trades)} of {to_id - from_id + 1} trades "
+                  f"({from_id}-{to_id}) in {elapsed_ms:.0f}ms")
+        self.last_ids[symbol] = to_id
+        await self._release(symbol)
+
+    async def _release(self, symbol):
+        # Resume the live rows held during the backfill, in arrival order;
+        # rows arriving meanwhile queue up behind them
+        held = self._held[symbol]
+        while held:
+            if not self._follows(held[0]):
+                # Another gap; the rest waits behind that backfill
+                return
+            await self._accept(held.pop(0))
+        del self._held[symbol]
+
+    def format_stats(self):
+        return (f"reconnects {self.reconnects} | gaps {self.gaps} (skipped {self.skipped_gaps}, "
+                f"failed {self.failed_gaps}) | gap size {self.gap_size.format()} | "
+                f"backfilled {self.backfilled} trades, unfilled {self.unfilled} | "
+                f"backfill {self.backfill_ms.format('ms')} | rate limited {self.rate_limited} | "
+                f"duplicates {self.duplicates}")
+
+    async def close(self):
+        # Let running backfills finish so their trades reach the buffer
+        while self._tasks:
+            # Releasing held rows can start another backfill
+            await asyncio.gather(*self._tasks, return_exceptions=True)
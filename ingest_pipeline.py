@@ -0,0 +1,310 @@
+import os
+import queue
+import threading
+import time
+import zipfile
+from dotenv import load_dotenv
+from archive_csv import CHUNK_ROWS
+from manifest import archive_unit
+
+load_dotenv()
+
+# Staged archive ingestion: download -> decompress + parse -> write.
+#
+# Each stage has its own worker threads and hands work to the next one over a
+# bounded queue, so the network, the CSV parser and the database keep each
+# other busy instead of taking turns, and a slow stage applies back pressure
+# instead of piling up archives or chunks in memory:
+#
+#   download  `download_workers` threads fetch spooled archives (verified
+#             against .CHECKSUM) into a queue of `pipeline_archive_queue`
+#   parse     `parse_workers` threads stream the CSV members out of the zip
+#             (decompression happens as the parser reads) and cut them into
+#             typed chunks of `csv_chunk_rows` rows, queued up to
+#             `pipeline_chunk_queue`
+#   write     `pipeline_write_workers` threads hand chunks to the storage writer
+#
+# An archive is recorded in the ingestion manifest (manifest.py) once every
+# one of its chunks is written and the backend has flushed. Every
+# `pipeline_report_secs` (and at the end) each stage's throughput and busy
+# share is printed next to the average / peak depth of its input queue: the
+# stage whose input queue stays full is the bottleneck.
+#
+# Settings (.env): parse_workers (default 2), pipeline_write_workers (default
+# 2), pipeline_archive_queue (default 4), pipeline_chunk_queue (default 8),
+# pipeline_report_secs (default 10, 0 only prints the final report).
+
+PARSE_WORKERS = int(os.getenv("parse_workers", 2))
+WRITE_WORKERS = int(os.getenv("pipeline_write_workers", 2))
+ARCHIVE_QUEUE = int(os.getenv("pipeline_archive_queue", 4))
+CHUNK_QUEUE = int(os.getenv("pipeline_chunk_queue", 8))
+REPORT_SECS = float(os.getenv("pipeline_report_secs", 10))
+
+_DONE = object()
+
+
+class StageStats:
+    """Counters of one stage; busy is the summed seconds its workers spent working."""
+
+    def __init__(self, name, workers, unit):
+        self.name = name
+        self.workers = workers
+        self.unit = unit
+        self.items = 0
+        self.rows = 0
+        self.bytes = 0
+        self.busy = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, busy, items=1, rows=0, nbytes=0):
+        with self._lock:
+            self.items += items
+            self.rows += rows
+            self.bytes += nbytes
+            self.busy += busy
+
+    def format(self, elapsed):
+        busy_share = self.busy / (elapsed * self.workers) if elapsed else 0
+        parts = [f"{self.name:>8}: {self.items:,} {self.unit}"]
+        if self.rows:
+            parts.append(f"{self.rows / elapsed if elapsed else 0:,.0f} rows/s")
+        if self.bytes:
+            parts.append(f"{self.bytes / 1e6 / elapsed if elapsed else 0:,.1f} MB/s")
+        parts.append(f"busy {busy_share:.0%} of {self.workers} workers")
+        return " | ".join(parts)
+
+
+class QueueStats:
+    """Depth of a bounded queue, sampled by the monitor thread."""
+
+    def __init__(self, name, q):
+        self.name = name
+        self.queue = q
+        self.samples = 0
+        self.depth_total = 0
+        self.full_samples = 0
+        self.max_depth = 0
+
+    def sample(self):
+        depth = self.queue.qsize()
+        self.samples += 1
+        self.depth_total += depth
+        self.max_depth = max(self.max_depth, depth)
+        if depth >= self.queue.maxsize:
+            self.full_samples += 1
+
+    def format(self):
+        avg = self.depth_total / self.samples if self.samples else 0
+        full = self.full_samples / self.samples if self.samples else 0
+        return f"{self.name:>8} queue: avg {avg:.1f} / peak {self.max_depth} of {self.queue.maxsize}, full {full:.0%}"
+
+
+class _Unit:
+    """One archive moving through the stages."""
+
+    def __init__(self, job):
+        self.job = job
+        self.sha256 = None
+        self.rows = 0
+        self.pending_chunks = 0
+        self.parsed = False
+        self.error = None
+        self.lock = threading.Lock()
+
+
+class IngestPipeline:
+    """
+    Ingest (url, file name, (data_type, symbol, period)) download jobs of
+    any data types: read_chunks(data_type, binary file, chunk_rows) yields
+    DataFrames of a CSV member and write_chunk(data_type, df, symbol,
+    batch_id) stores one (batch_id is `<member>-<n>`, stable across reruns
+    with the same chunk size, see Storage.write_frame and
+    Storage.discard_batches). `on_member(data_type, member_name, open_member,
+    symbol)` is called once per CSV member before it is parsed.
+    """
+
+    def __init__(self, downloader, read_chunks, write_chunk, storage, manifest=None, on_member=None,
+                 verify=True, parse_workers=PARSE_WORKERS, write_workers=WRITE_WORKERS,
+                 archive_queue=ARCHIVE_QUEUE, chunk_queue=CHUNK_QUEUE, report_secs=REPORT_SECS,
+                 chunk_rows=CHUNK_ROWS):
+        self.downloader = downloader
+        self.read_chunks = read_chunks
+        self.write_chunk = write_chunk
+        self.storage = storage
+        self.manifest = manifest
+        self.on_member = on_member
+        self.verify = verify
+        self.parse_workers = parse_workers
+        self.write_workers = write_workers
+        self.report_secs = report_secs
+        self.chunk_rows = chunk_rows
+
+        self._jobs = queue.Queue()
+        self._archives = queue.Queue(maxsize=archive_queue)
+        self._chunks = queue.Queue(maxsize=chunk_queue)
+        self.stages = {
+            "download": StageStats("download", downloader.workers, "archives"),
+            "parse": StageStats("parse", parse_workers, "archives"),
+            "write": StageStats("write", write_workers, "chunks"),
+        }
+        self.queues = [QueueStats("archive", self._archives), QueueStats("chunk", self._chunks)]
+        self._results = []
+        self._results_lock = threading.Lock()
+        self._started = None
+
+    def _finish(self, unit, result):
+        # Missing archives (never parsed) stay pending: they may be published later
+        if not isinstance(result, Exception) and self.manifest is not None and unit.parsed:
+            # Only mark the unit done once its rows are actually stored
+            started = time.perf_counter()
+            self.storage.flush()
+            # Backends that write on their own thread (SQLite) spend their time here
+            self.stages["write"].add(time.perf_counter() - started, items=0)
+            self.manifest.finish(archive_unit(unit.job), unit.rows, unit.sha256)
+        elif isinstance(result, Exception):
+            print(f"{unit.job[2]} failed: {result}")
+        with self._results_lock:
+            self._results.append((unit.job[2], result))
+
+    def _download_worker(self):
+        while True:
+            job = self._jobs.get()
+            if job is _DONE:
+                return
+            unit = _Unit(job)
+            started = time.perf_counter()
+            try:
+                unit.sha256 = self.downloader.checksum(job[0]) if self.verify else None
+                archive = self.downloader.fetch_spooled(job[0], sha256=unit.sha256)
+            except Exception as e:
+                # Whatever the failure, the unit gets its result and the run goes on
+                self._finish(unit, e)
+                continue
+            if archive is None:
+                data_type, symbol, period = job[2]
+                print(f"No {data_type} archive for {symbol} {period.strftime('%Y-%m-%d')}. Skipping...")
+                self._finish(unit, (0, []))
+                continue
+            archive.seek(0, os.SEEK_END)
+            self.stages["download"].add(time.perf_counter() - started, nbytes=archive.tell())
+            archive.seek(0)
+            # Blocks while the parsers are behind
+            self._archives.put((unit, archive))
+
+    def _parse_worker(self):
+        while True:
+            item = self._archives.get()
+            if item is _DONE:
+                return
+            unit, archive = item
+            data_type, symbol, _ = unit.job[2]
+            if self.manifest is not None:
+                self.manifest.start(archive_unit(unit.job), unit.sha256)
+            try:
+                with zipfile.ZipFile(archive) as zip_ref:
+                    for member in [name for name in zip_ref.namelist() if name.endswith('.csv')]:
+                        self._parse_member(unit, zip_ref, member, data_type, symbol)
+            except Exception as e:
+                unit.error = e
+            finally:
+                archive.close()
+            self.stages["parse"].add(0)
+            with unit.lock:
+                unit.parsed = True
+                complete = unit.pending_chunks == 0
+            if complete:
+                self._finish(unit, unit.error or (unit.rows, []))
+
+    def _parse_member(self, unit, zip_ref, member, data_type, symbol):
+        if self.on_member:
+            self.on_member(data_type, member, lambda: zip_ref.open(member), symbol)
+        stem = os.path.splitext(os.path.basename(member))[0]
+        # Batch ids depend on csv_chunk_rows; drop the batches of an earlier
+        # run so a different chunk size leaves no stale ones behind
+        self.storage.discard_batches(data_type, symbol, stem)
+        with zip_ref.open(member) as f:
+            chunks = iter(self.read_chunks(data_type, f, self.chunk_rows))
+            i = 0
+            while True:
+                started = time.perf_counter()
+                chunk = next(chunks, None)
+                if chunk is None:
+                    return
+                self.stages["parse"].add(time.perf_counter() - started, items=0, rows=len(chunk))
+                with unit.lock:
+                    unit.pending_chunks += 1
+                # Blocks while the writers are behind
+                self._chunks.put((unit, chunk, data_type, symbol, f"{stem}-{i}"))
+                i += 1
+
+    def _write_worker(self):
+        while True:
+            item = self._chunks.get()
+            if item is _DONE:
+                return
+            unit, chunk, data_type, symbol, batch_id = item
+            started = time.perf_counter()
+            error = None
+            try:
+                self.write_chunk(data_type, chunk, symbol, batch_id)
+            except Exception as e:
+                error = e
+            self.stages["write"].add(time.perf_counter() - started, rows=len(chunk))
+            with unit.lock:
+                unit.pending_chunks -= 1
+                if error is not None:
+                    unit.error = unit.error or error
+                else:
+                    unit.rows += len(chunk)
+                complete = unit.parsed and unit.pending_chunks == 0
+            if complete:
+                self._finish(unit, unit.error or (unit.rows, []))
+
+    def format_stats(self):
+        elapsed = time.perf_counter() - self._started
+        lines = [f"Ingest pipeline after {elapsed:.1f}s:"]
+        lines += [f"  {stage.format(elapsed)}" for stage in self.stages.values()]
+        lines += [f"  {q.format()}" for q in self.queues]
+        return "\n".join(lines)
+
+    def _monitor(self, stop):
+        last_report = time.monotonic()
+        while not stop.wait(0.2):
+            for q in self.queues:
+                q.sample()
+            if self.report_secs and time.monotonic() - last_report >= self.report_secs:
+                print(self.format_stats())
+                last_report = time.monotonic()
+
+    def _start_threads(self, target, count, name):
+        threads = [threading.Thread(target=target, name=f"{name}-{i}", daemon=True) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def run(self, jobs):
+        """Ingest every job. Returns [(context, (rows, []) or exception)] in completion order."""
+        if self.manifest is not None:
+            jobs = self.manifest.pending(jobs, self.downloader)
+        self._started = time.perf_counter()
+        stop = threading.Event()
+        monitor = threading.Thread(target=self._monitor, args=(stop,), name="pipeline-monitor", daemon=True)
+        monitor.start()
+
+        for job in jobs:
+            self._jobs.put(job)
+        downloaders = self._start_threads(self._download_worker, self.downloader.workers, "download")
+        parsers = self._start_threads(self._parse_worker, self.parse_workers, "parse")
+        writers = self._start_threads(self._write_worker, self.write_workers, "write")
+
+        # Shut the stages down in order, each once its producers are done
+        for stage_threads, q in ((downloaders, self._jobs), (parsers, self._archives), (writers, self._chunks)):
+            for _ in stage_threads:
+                q.put(_DONE)
+            for thread in stage_threads:
+                thread.join()
+
+        stop.set()
+        monitor.join()
+        print(self.format_stats())
+        return self._results
@@ -0,0 +1,142 @@
+import os
+import sqlite3
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Ingestion manifest for the data.binance.vision archives.
+#
+# One row per (storage, data_type, symbol, period) archive, where period is
+# the date part of the archive name ("2024-01" for a monthly archive,
+# "2024-01-05" for a daily one). A unit is marked `started` with the SHA256
+# Binance publishes for the archive before it is stored, and `done` with the
+# row count once the storage backend has flushed it. Reruns skip done units,
+# so a nightly sync only downloads the days it has not seen yet; a unit left
+# `started` by a crash or a failed load is fetched again. Archives whose
+# download does not match its .CHECKSUM are retried by archive_downloader.py
+# and never marked done.
+#
+# With manifest_reverify=1 the checksums of done units are fetched again
+# (one small request each) and units whose archive Binance has since
+# republished are ingested again.
+#
+# The manifest is a local SQLite file for every backend, so it survives the
+# retention jobs: days dropped by partitions.py or compaction.py are not
+# downloaded again. Delete its rows (or the file) to force a re-ingest.
+#
+# Settings (.env): ingest_manifest (default 1), ingest_manifest_db (default
+# ingest_manifest.db), manifest_reverify (default 0), verify_checksums
+# (default 1).
+
+MANIFEST_ENABLED = os.getenv("ingest_manifest", "1") == "1"
+MANIFEST_DB = os.getenv("ingest_manifest_db", "ingest_manifest.db")
+REVERIFY = os.getenv("manifest_reverify") == "1"
+VERIFY_CHECKSUMS = os.getenv("verify_checksums", "1") == "1"
+
+
+def archive_unit(job):
+    """(data_type, symbol, period) of a (url, file name, context) download job."""
+    url, filename, (data_type, symbol, _) = job
+    prefix = f"{symbol}-{data_type}-"
+    return data_type, symbol, os.path.basename(filename)[len(prefix):-len(".zip")]
+
+
+class Manifest:
+    """
+    Manifest rows of one storage backend. Thread safe: download workers
+    share one instance.
+    """
+
+    def __init__(self, storage, db=MANIFEST_DB):
+        self.storage = storage
+        self._conn = sqlite3.connect(db, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS ingest_manifest (
+                storage TEXT NOT NULL,
+                data_type TEXT NOT NULL,
+                symbol TEXT NOT NULL,
+                period TEXT NOT NULL,
+                status TEXT NOT NULL,
+                rows INTEGER,
+                sha256 TEXT,
+                updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (storage, data_type, symbol, period)
+            )
+            """)
+
+    def completed(self):
+        """{(data_type, symbol, period): sha256} of the done units."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data_type, symbol, period, sha256 FROM ingest_manifest WHERE storage = ? AND status = 'done'",
+                (self.storage,)).fetchall()
+        return {(data_type, symbol, period): sha256 for data_type, symbol, period, sha256 in rows}
+
+    def _save(self, unit, status, sha256, rows=None):
+        with self._lock, self._conn:
+            self._conn.execute("""
+            INSERT OR REPLACE INTO ingest_manifest (storage, data_type, symbol, period, status, rows, sha256, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            """, (self.storage, *unit, status, rows, sha256))
+
+    def start(self, unit, sha256):
+        self._save(unit, "started", sha256)
+
+    def finish(self, unit, rows, sha256):
+        self._save(unit, "done", sha256, rows)
+
+    def pending(self, jobs, downloader=None, reverify=REVERIFY):
+        """
+        The jobs that still need to be ingested. With reverify, done units
+        whose published checksum changed are included again.
+        """
+        done = self.completed()
+        pending = [job for job in jobs if archive_unit(job) not in done]
+        if reverify and downloader is not None:
+            done_jobs = [job for job in jobs if archive_unit(job) in done]
+            checksums = downloader.checksums([job[0] for job in done_jobs])
+            for job in done_jobs:
+                published = checksums[job[0]]
+                if published is not None and published != done[archive_unit(job)]:
+                    print(f"{os.path.basename(job[1])} was republished; ingesting it again")
+                    pending.append(job)
+        skipped = len(jobs) - len(pending)
+        if skipped:
+            print(f"Skipping {skipped} archives already in the manifest")
+        return pending
+
+    def close(self):
+        self._conn.close()
+
+
+def ingest_archives(downloader, jobs, handle, storage, spooled=False):
+    """
+    Run download jobs through handle(context, archive) -> (rows, kept files),
+    skipping and recording units in the manifest of `storage` (a Storage).
+    Returns downloader.run()'s results.
+    """
+    if not MANIFEST_ENABLED:
+        return downloader.run(jobs, lambda context, archive, sha256: handle(context, archive),
+                              spooled=spooled, verify=VERIFY_CHECKSUMS)
+
+    manifest = Manifest(storage.name)
+    units = {job[2]: archive_unit(job) for job in jobs}
+
+    def ingest(context, archive, sha256):
+        if archive is None:
+            return handle(context, archive)
+        unit = units[context]
+        manifest.start(unit, sha256)
+        rows, kept = handle(context, archive)
+        # Only mark the unit done once its rows are actually stored
+        storage.flush()
+        manifest.finish(unit, rows, sha256)
+        return rows, kept
+
+    try:
+        return downloader.run(manifest.pending(jobs, downloader), ingest, spooled=spooled, verify=VERIFY_CHECKSUMS)
+    finally:
+        manifest.close()
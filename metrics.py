@@ -0,0 +1,64 @@
+import bisect
+import threading
+
+# Minimal in-process metrics used by the ingesters' periodic reports.
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram. `buckets` are inclusive upper bounds; values
+    above the last bound land in an overflow bucket. Percentiles are
+    estimated as the upper bound of the bucket they fall in.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = None
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.total += value
+            self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, p):
+        with self._lock:
+            if not self.count:
+                return None
+            rank = p / 100 * self.count
+            seen = 0
+            for i, n in enumerate(self.counts):
+                seen += n
+                if seen >= rank:
+                    return self.buckets[i] if i < len(self.buckets) else self.max
+            return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.mean(),
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+    def format(self, unit=""):
+        s = self.summary()
+        if not s["count"]:
+            return "n=0"
+        return (f"n={s['count']} mean={s['mean']:.1f}{unit} p50<={s['p50']}{unit} "
+                f"p90<={s['p90']}{unit} p99<={s['p99']}{unit} max={s['max']:.1f}{unit}")
+
+
+# Bucket sets shared by the ingesters
+LATENCY_MS_BUCKETS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000]
+BATCH_SIZE_BUCKETS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
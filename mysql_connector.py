@@ -2,6 +2,9 @@ import mysql.connector
 from mysql.connector import Error
 from dotenv import load_dotenv
 import os
+import queue
+import threading
+import time
 
 
 
@@ -16,12 +19,190 @@ DB_CONFIG = {
     "database": os.getenv("db_name")
 }
 
+# Connection pool settings (all optional in .env)
+POOL_SIZE = int(os.getenv("db_pool_size", 5))              # max open connections per process
+POOL_TIMEOUT = float(os.getenv("db_pool_timeout", 30))     # seconds to wait for a free connection
+POOL_IDLE_TIMEOUT = float(os.getenv("db_pool_idle_timeout", 300))  # evict connections idle longer than this
+POOL_PING_INTERVAL = float(os.getenv("db_pool_ping_interval", 30))  # health check idle connections older than this
+
+
+class PooledConnection:
+    """
+    Thin wrapper around a MySQL connection checked out from the pool.
+
+    Behaves like the underlying connection, except that close() hands the
+    connection back to the pool instead of closing the socket.
+    """
+
+    def __init__(self, pool, connection):
+        self._pool = pool
+        self._connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        if self._connection is not None:
+            self._pool.release(self._connection)
+            self._connection = None
+
+
+class ConnectionPool:
+    """
+    Process-wide pool of MySQL connections.
+
+    Idle connections are kept in a LIFO queue so the hottest connection is
+    reused first and the rest age out. On checkout a connection that has been
+    idle longer than `idle_timeout` is closed, and one idle longer than
+    `ping_interval` is pinged (with reconnect) before being handed out.
+    """
+
+    def __init__(self, config, size=POOL_SIZE, timeout=POOL_TIMEOUT,
+                 idle_timeout=POOL_IDLE_TIMEOUT, ping_interval=POOL_PING_INTERVAL):
+        self.config = config
+        self.size = size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.ping_interval = ping_interval
+
+        self._idle = queue.LifoQueue()     # (connection, released_at)
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,               # checkouts that had to wait for a free slot
+            "wait_time_total": 0.0,   # seconds spent waiting for a slot
+            "wait_time_max": 0.0,
+            "timeouts": 0,
+            "created": 0,
+            "reconnects": 0,
+            "evicted_idle": 0,
+            "discarded": 0,
+            "in_use": 0,
+        }
+
+    def _count(self, key, value=1):
+        with self._lock:
+            self._stats[key] += value
+
+    def _open(self):
+        connection = mysql.connector.connect(**self.config)
+        self._count("created")
+        return connection
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except Error:
+            pass
+
+    def _take_idle(self):
+        """Pop idle connections until a healthy one is found (or none are left)."""
+        while True:
+            try:
+                connection, released_at = self._idle.get_nowait()
+            except queue.Empty:
+                return None
+
+            idle_for = time.monotonic() - released_at
+            if idle_for > self.idle_timeout:
+                self._discard(connection)
+                self._count("evicted_idle")
+                continue
+
+            if idle_for > self.ping_interval:
+                try:
+                    connection.ping(reconnect=True, attempts=1, delay=0)
+                except Error:
+                    self._discard(connection)
+                    self._count("discarded")
+                    continue
+            return connection
+
+    def acquire(self):
+        started = time.monotonic()
+        if not self._slots.acquire(blocking=False):
+            if not self._slots.acquire(timeout=self.timeout):
+                self._count("timeouts")
+                raise Error(msg=f"Timed out after {self.timeout}s waiting for a MySQL connection "
+                                f"(pool size {self.size})")
+            waited = time.monotonic() - started
+            with self._lock:
+                self._stats["waits"] += 1
+                self._stats["wait_time_total"] += waited
+                self._stats["wait_time_max"] = max(self._stats["wait_time_max"], waited)
+
+        try:
+            connection = self._take_idle()
+            if connection is None:
+                connection = self._open()
+            elif not connection.is_connected():
+                # Server closed the socket since the last ping; reconnect in place
+                connection.reconnect(attempts=2, delay=0)
+                self._count("reconnects")
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["in_use"] += 1
+        return PooledConnection(self, connection)
+
+    def release(self, connection):
+        try:
+            # Never hand out a connection with an open transaction
+            if connection.in_transaction:
+                connection.rollback()
+            self._idle.put((connection, time.monotonic()))
+        except Error:
+            self._discard(connection)
+            self._count("discarded")
+        finally:
+            with self._lock:
+                self._stats["in_use"] -= 1
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["size"] = self.size
+        stats["idle"] = self._idle.qsize()
+        stats["wait_time_avg"] = stats["wait_time_total"] / stats["waits"] if stats["waits"] else 0.0
+        return stats
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_CONFIG)
+    return _pool
+
+
+def pool_stats():
+    return get_pool().stats()
+
+
 def query_mysql(query, args=(), one=False):
-    conn = mysql.connector.connect(**DB_CONFIG)  # <-- Changed connection logic
-    cur = conn.cursor()
-    cur.execute(query, args)
-    rv = cur.fetchall()
-    conn.close()
+    with get_pool().acquire() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(query, args)
+            rv = cur.fetchall()
+        finally:
+            cur.close()
     return (rv[0] if rv else None) if one else rv
 
 # def query_mysql(query, args=(), one=False):
@@ -31,32 +212,12 @@ def query_mysql(query, args=(), one=False):
 #     rv = cur.fetchall()
 #     conn.close()
 #     return (rv[0] if rv else None) if one else rv
-# CREATE TABLE financial_data (
-#     id INT AUTO_INCREMENT PRIMARY KEY,
-#     Ticker VARCHAR(50),
-#     Bar INT,
-#     Timestamp DATETIME,
-#     LastTradeTime DATETIME,
-#     Open FLOAT,
-#     High FLOAT,
-#     Low FLOAT,
-#     Close FLOAT,
-#     Volume FLOAT,
-#     Delta FLOAT,
-#     Bid FLOAT,
-#     Ask FLOAT,
-#     Ticks INT,
-#     MaxDelta FLOAT,
-#     MinDelta FLOAT,
-#     MaxOI FLOAT,
-#     MinOI FLOAT
-# );
+# Table definitions live in schema.py (bootstrapped once at startup)
 
 def create_connection():
     try:
-        connection = mysql.connector.connect(**DB_CONFIG)
-        if connection.is_connected():
-            return connection
+        # Returns a pooled connection; close() hands it back to the pool
+        return get_pool().acquire()
     except Error as e:
         print("Error while connecting to MySQL", e)
         return None
@@ -68,28 +229,6 @@ def store_klines_to_mysql(klines_data, timeframe, symbol):
 
     cursor = connection.cursor()
 
-    # Create tables if they don't exist
-    create_klines_table_query = """
-    CREATE TABLE IF NOT EXISTS klines (
-        id INT AUTO_INCREMENT PRIMARY KEY,
-        symbol VARCHAR(10) NOT NULL,
-        timeframe VARCHAR(10) NOT NULL,
-        open_time BIGINT NOT NULL,
-        open DOUBLE NOT NULL,
-        high DOUBLE NOT NULL,
-        low DOUBLE NOT NULL,
-        close DOUBLE NOT NULL,
-        volume DOUBLE NOT NULL,
-        close_time BIGINT NOT NULL,
-        quote_asset_volume DOUBLE NOT NULL,
-        trades BIGINT NOT NULL,
-        taker_buy_base_asset_volume DOUBLE NOT NULL,
-        taker_buy_quote_asset_volume DOUBLE NOT NULL,
-        ignore_column DOUBLE NOT NULL,
-        UNIQUE KEY idx_klines_symbol_timeframe_open_time (symbol, timeframe, open_time,close_time)
-    ) ENGINE=MyISAM;
-    """
-    cursor.execute(create_klines_table_query)
 
     klines_with_timeframe_and_symbol = [(symbol, timeframe, *kline) for kline in klines_data]
 
@@ -129,30 +268,22 @@ def store_klines_to_mysql(klines_data, timeframe, symbol):
 
 
 def store_aggregated_trades_to_mysql(aggregated_trades_data, symbol):
+    aggregated_trades_with_symbol = [(trade[1], symbol, *trade[2:]) for trade in aggregated_trades_data]
+    insert_aggregated_trades_to_mysql(aggregated_trades_with_symbol)
+
+
+def insert_aggregated_trades_to_mysql(rows):
+    """
+    INSERT IGNORE rows already in table column order (agg_trade_id, symbol,
+    price, quantity, first_trade_id, last_trade_id, transact_time,
+    is_buyer_maker).
+    """
     connection = create_connection()
     if not connection:
         return
 
     cursor = connection.cursor()
 
-    create_aggregated_trades_table_query = """
-    CREATE TABLE IF NOT EXISTS aggregated_trades (
-        agg_trade_id BIGINT PRIMARY KEY,
-        symbol VARCHAR(10) NOT NULL,
-        price DOUBLE NOT NULL,
-        quantity DOUBLE NOT NULL,
-        first_trade_id BIGINT NOT NULL,
-        last_trade_id BIGINT NOT NULL,
-        transact_time BIGINT NOT NULL,
-        is_buyer_maker BOOLEAN NOT NULL,
-        UNIQUE KEY idx_symbol_transact_time (symbol, transact_time)
-
-    ) ENGINE=MyISAM;
-    """
-    cursor.execute(create_aggregated_trades_table_query)
-    
-    aggregated_trades_with_symbol = [(trade[1], symbol, *trade[2:]) for trade in aggregated_trades_data]
-
     # insert_aggregated_trades_query = """
     # INSERT INTO aggregated_trades 
     # (agg_trade_id, symbol, price, quantity, first_trade_id, last_trade_id, transact_time, is_buyer_maker)
@@ -176,8 +307,8 @@ def store_aggregated_trades_to_mysql(aggregated_trades_data, symbol):
     chunk_size = 1000
     connection.start_transaction()
     try:
-        for i in range(0, len(aggregated_trades_with_symbol), chunk_size):
-            chunk = aggregated_trades_with_symbol[i:i+chunk_size]
+        for i in range(0, len(rows), chunk_size):
+            chunk = rows[i:i+chunk_size]
             cursor.executemany(insert_aggregated_trades_query, chunk)
         connection.commit()
     except:
@@ -187,27 +318,46 @@ def store_aggregated_trades_to_mysql(aggregated_trades_data, symbol):
         cursor.close()
         connection.close()
 
-def store_bookticker_to_mysql(bookticker_data, symbol):
+def insert_rows_to_mysql(table, columns, rows):
+    """
+    INSERT IGNORE rows in `columns` order into `table`. The table's primary /
+    unique key decides which replayed rows are dropped.
+    """
     connection = create_connection()
     if not connection:
         return
 
     cursor = connection.cursor()
 
-    create_bookticker_table_query = """
-    CREATE TABLE IF NOT EXISTS bookticker (
-        update_id BIGINT PRIMARY KEY,
-        symbol VARCHAR(255) NOT NULL,
-        best_bid_price DOUBLE NOT NULL,
-        best_bid_qty DOUBLE NOT NULL,
-        best_ask_price DOUBLE NOT NULL,
-        best_ask_qty DOUBLE NOT NULL,
-        transaction_time BIGINT NOT NULL,
-        event_time BIGINT NOT NULL,
-        UNIQUE KEY idx_symbol_transaction_time (symbol, transaction_time)
-    )
+    insert_query = f"""
+    INSERT IGNORE INTO {table}
+    ({', '.join(columns)})
+    VALUES ({', '.join(['%s'] * len(columns))})
     """
-    cursor.execute(create_bookticker_table_query)
+
+    # Break data into chunks and use transactions
+    chunk_size = 1000
+    connection.start_transaction()
+    try:
+        for i in range(0, len(rows), chunk_size):
+            chunk = rows[i:i+chunk_size]
+            cursor.executemany(insert_query, chunk)
+        connection.commit()
+    except:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def store_bookticker_to_mysql(bookticker_data, symbol):
+    connection = create_connection()
+    if not connection:
+        return
+
+    cursor = connection.cursor()
+
     
     bookticker_with_symbol = [(data[0], symbol, *data[1:]) for data in bookticker_data]
 
@@ -234,3 +384,52 @@ def store_bookticker_to_mysql(bookticker_data, symbol):
         cursor.close()
         connection.close()
 
+
+
+def _csv_has_header(file_name):
+    # Older Binance archives have no header row; newer ones start with the column names
+    with open(file_name, 'r') as f:
+        first_line = f.readline()
+    return bool(first_line) and not first_line[0].isdigit()
+
+
+def bulk_load_aggregated_trades_to_mysql(file_name, symbol):
+    """
+    Stream a Binance aggTrades CSV straight into `aggregated_trades` with
+    LOAD DATA LOCAL INFILE. The symbol column and the 'true'/'false'
+    is_buyer_maker conversion are done server-side, so no rows pass through
+    Python. Duplicate keys are skipped, like INSERT IGNORE.
+
+    Returns the number of rows inserted.
+    """
+    file_name = os.path.abspath(file_name)
+
+    # Bulk loads use a dedicated connection: local infile is only allowed for
+    # the directory holding this file, and pooled connections stay locked down.
+    connection = mysql.connector.connect(
+        **DB_CONFIG,
+        allow_local_infile_in_path=os.path.dirname(file_name),
+    )
+    cursor = connection.cursor()
+
+    load_query = f"""
+    LOAD DATA LOCAL INFILE %s IGNORE INTO TABLE aggregated_trades
+    FIELDS TERMINATED BY ','
+    LINES TERMINATED BY '\\n'
+    {"IGNORE 1 LINES" if _csv_has_header(file_name) else ""}
+    (agg_trade_id, price, quantity, first_trade_id, last_trade_id, transact_time, @is_buyer_maker)
+    SET symbol = %s,
+        is_buyer_maker = (LOWER(TRIM(@is_buyer_maker)) = 'true')
+    """
+
+    try:
+        cursor.execute(load_query, (file_name, symbol))
+        rows = cursor.rowcount
+        connection.commit()
+    except:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+        connection.close()
+    return rows
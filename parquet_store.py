@@ -0,0 +1,256 @@
+import os
+import re
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.dataset as ds
+from dotenv import load_dotenv
+from archive_csv import DATATYPES, stored_dtypes
+from time_ranges import date_range_bounds_ms, ms_to_date, to_date
+
+load_dotenv()
+
+# Columnar tick store.
+#
+# Layout: <parquet_dir>/<table>/symbol=<SYMBOL>/date=<YYYY-MM-DD>/<part>.parquet
+#
+# Archive CSVs are converted with the streaming Arrow CSV reader (typed
+# columns, no Python rows) and split into one directory per UTC day. Readers
+# only open the symbol/day directories inside the requested range and only
+# decode the requested columns.
+
+PARQUET_DIR = os.getenv("parquet_dir", os.path.join("data", "parquet"))
+
+# Bytes of CSV decoded per block when converting archives
+CSV_BLOCK_SIZE = 16 * 1024 * 1024
+
+TABLES = {
+    "aggregated_trades": {
+        "time_column": "transact_time",
+        "schema": pa.schema([
+            ("agg_trade_id", pa.int64()),
+            ("price", pa.float64()),
+            ("quantity", pa.float64()),
+            ("first_trade_id", pa.int64()),
+            ("last_trade_id", pa.int64()),
+            ("transact_time", pa.int64()),
+            ("is_buyer_maker", pa.bool_()),
+        ]),
+    },
+    "klines": {
+        "time_column": "open_time",
+        "schema": pa.schema([
+            ("timeframe", pa.string()),
+            ("open_time", pa.int64()),
+            ("open", pa.float64()),
+            ("high", pa.float64()),
+            ("low", pa.float64()),
+            ("close", pa.float64()),
+            ("volume", pa.float64()),
+            ("close_time", pa.int64()),
+            ("quote_asset_volume", pa.float64()),
+            ("trades", pa.int64()),
+            ("taker_buy_base_asset_volume", pa.float64()),
+            ("taker_buy_quote_asset_volume", pa.float64()),
+            ("ignore_column", pa.float64()),
+        ]),
+    },
+    "bookticker": {
+        "time_column": "transaction_time",
+        "schema": pa.schema([
+            ("update_id", pa.int64()),
+            ("best_bid_price", pa.float64()),
+            ("best_bid_qty", pa.float64()),
+            ("best_ask_price", pa.float64()),
+            ("best_ask_qty", pa.float64()),
+            ("transaction_time", pa.int64()),
+            ("event_time", pa.int64()),
+        ]),
+    },
+}
+
+_ARROW_TYPES = {"int64": pa.int64(), "float64": pa.float64(), "bool": pa.bool_(), "str": pa.string()}
+
+# Archive data types without a table above get one from their registry dtypes
+for _data_type, _datatype in DATATYPES.items():
+    TABLES.setdefault(_datatype["table"], {
+        "time_column": _datatype["time_column"],
+        "schema": pa.schema([(column, _ARROW_TYPES[dtype]) for column, dtype in stored_dtypes(_data_type).items()]),
+    })
+
+_DATE_PARTITIONING = ds.partitioning(pa.schema([("date", pa.string())]), flavor="hive")
+
+
+def symbol_dir(table, symbol, base_dir=PARQUET_DIR):
+    return os.path.join(base_dir, table, f"symbol={symbol}")
+
+
+def _with_date_column(arrow_table, time_column):
+    # UTC day of each row as 'YYYY-MM-DD', used as the hive partition value
+    timestamps = pc.cast(arrow_table[time_column], pa.timestamp("ms", tz="UTC"))
+    return arrow_table.append_column("date", pc.strftime(timestamps, format="%Y-%m-%d"))
+
+
+def remove_basename(table, symbol, basename, base_dir=PARQUET_DIR):
+    """Delete every file written with `basename` (`<basename>-<i>.parquet` in any day)."""
+    _remove_files(table, symbol, re.compile(rf"{re.escape(basename)}-\d+\.parquet"), base_dir)
+
+
+def write_table(arrow_table, table, symbol, basename, base_dir=PARQUET_DIR, replace=True):
+    """
+    Write an Arrow table into the store, one file per UTC day.
+
+    `basename` names the files. With `replace`, the files of an earlier write
+    with the same basename (e.g. re-running a day's archive) are deleted
+    first, so rows are neither duplicated nor left behind in stale parts.
+    """
+    if arrow_table.num_rows == 0:
+        return
+    time_column = TABLES[table]["time_column"]
+    if replace:
+        remove_basename(table, symbol, basename, base_dir)
+    ds.write_dataset(
+        _with_date_column(arrow_table, time_column),
+        symbol_dir(table, symbol, base_dir),
+        format="parquet",
+        partitioning=_DATE_PARTITIONING,
+        basename_template=f"{basename}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+    )
+
+
+def _remove_files(table, symbol, pattern, base_dir=PARQUET_DIR):
+    # Files of one symbol, in every day directory, whose name matches `pattern`
+    directory = symbol_dir(table, symbol, base_dir)
+    if not os.path.isdir(directory):
+        return
+    for day_dir in os.scandir(directory):
+        if day_dir.is_dir():
+            for entry in os.scandir(day_dir.path):
+                if pattern.fullmatch(entry.name):
+                    os.remove(entry.path)
+
+
+def remove_batches(table, symbol, source, base_dir=PARQUET_DIR):
+    """
+    Delete the files of every batch `<source>-<n>` (written with basename
+    `<source>-<n>`). A longer source, e.g. a day inside a month, does not match.
+    """
+    _remove_files(table, symbol, re.compile(rf"{re.escape(source)}-\d+-\d+\.parquet"), base_dir)
+
+
+def write_frame(df, table, symbol, basename, base_dir=PARQUET_DIR, replace=True):
+    """
+    Write a DataFrame with the table's columns (a `symbol` column, if any, is
+    ignored) into the store, casting to the table schema. Same file naming
+    rules as write_table().
+    """
+    if df.empty:
+        return
+    schema = TABLES[table]["schema"]
+    df = df[schema.names]
+    if "is_buyer_maker" in df:
+        df = df.assign(is_buyer_maker=df["is_buyer_maker"].astype(int).astype(bool))
+    arrow_table = pa.Table.from_pandas(df.astype({field.name: field.type.to_pandas_dtype() for field in schema}),
+                                       schema=schema, preserve_index=False)
+    write_table(arrow_table, table, symbol, basename, base_dir, replace)
+
+
+def write_csv(source, table, symbol, basename=None, base_dir=PARQUET_DIR):
+    """
+    Convert a Binance archive CSV straight into the store. `source` is a
+    file name or a binary file object (e.g. a zip member; then `basename` is
+    required). The CSV is read block by block, so memory stays flat however
+    big the archive is. Returns the number of rows written.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        basename = basename or os.path.splitext(os.path.basename(source))[0]
+        with open(source, "rb") as f:
+            return write_csv(f, table, symbol, basename, base_dir)
+
+    schema = TABLES[table]["schema"]
+    time_column = TABLES[table]["time_column"]
+    has_header = not source.readline()[:1].isdigit()
+    source.seek(0)
+
+    reader = pv.open_csv(
+        source,
+        read_options=pv.ReadOptions(column_names=schema.names, skip_rows=1 if has_header else 0,
+                                    block_size=CSV_BLOCK_SIZE),
+        convert_options=pv.ConvertOptions(
+            column_types=schema,
+            true_values=["true", "True", "TRUE"],
+            false_values=["false", "False", "FALSE"],
+        ),
+    )
+    rows = 0
+
+    def batches():
+        nonlocal rows
+        for batch in reader:
+            rows += batch.num_rows
+            yield from _with_date_column(pa.Table.from_batches([batch]), time_column).to_batches()
+
+    # A rerun may split into other parts; none of the earlier ones may stay
+    remove_basename(table, symbol, basename, base_dir)
+    ds.write_dataset(
+        batches(),
+        symbol_dir(table, symbol, base_dir),
+        schema=schema.append(pa.field("date", pa.string())),
+        format="parquet",
+        partitioning=_DATE_PARTITIONING,
+        basename_template=f"{basename}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+    )
+    return rows
+
+
+def read(table, symbol, start_date=None, end_date=None, columns=None, start_ms=None, end_ms=None,
+         base_dir=PARQUET_DIR):
+    """
+    Read one symbol's ticks as an Arrow table.
+
+    start_date/end_date (inclusive UTC days) prune whole day directories;
+    start_ms/end_ms further bound the time column. `columns` limits which
+    columns are decoded.
+    """
+    directory = symbol_dir(table, symbol, base_dir)
+    time_column = TABLES[table]["time_column"]
+    if not os.path.isdir(directory):
+        schema = TABLES[table]["schema"]
+        return schema.empty_table().select(columns) if columns else schema.empty_table()
+
+    dataset = ds.dataset(directory, format="parquet", partitioning=_DATE_PARTITIONING)
+
+    filters = []
+    if start_date is not None:
+        filters.append(ds.field("date") >= to_date(start_date).isoformat())
+        if start_ms is None:
+            start_ms = date_range_bounds_ms(start_date)[0]
+    if end_date is not None:
+        filters.append(ds.field("date") <= to_date(end_date).isoformat())
+        if end_ms is None:
+            end_ms = date_range_bounds_ms(end_date)[1]
+    if start_ms is not None:
+        if start_date is None:
+            filters.append(ds.field("date") >= ms_to_date(start_ms).isoformat())
+        filters.append(ds.field(time_column) >= start_ms)
+    if end_ms is not None:
+        if end_date is None:
+            filters.append(ds.field("date") <= ms_to_date(end_ms - 1).isoformat())
+        filters.append(ds.field(time_column) < end_ms)
+
+    expression = None
+    for f in filters:
+        expression = f if expression is None else expression & f
+
+    if columns is None:
+        columns = [name for name in dataset.schema.names if name != "date"]
+    arrow_table = dataset.to_table(columns=columns, filter=expression)
+    return arrow_table.sort_by(time_column) if time_column in columns else arrow_table
+
+
+def read_frame(table, symbol, start_date=None, end_date=None, columns=None, start_ms=None, end_ms=None,
+               base_dir=PARQUET_DIR):
+    """Same as read(), as a pandas DataFrame."""
+    return read(table, symbol, start_date, end_date, columns, start_ms, end_ms, base_dir).to_pandas()
@@ -0,0 +1,131 @@
+import os
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+from mysql_connector import create_connection
+from time_ranges import DAY_MS, date_to_ms, ms_to_date, iter_days
+
+load_dotenv()
+
+# Daily RANGE partitions for the high-volume tick tables (MySQL only).
+#
+# Schema migration 3 partitions each table with a single catch-all `pmax`
+# partition. This module splits `pmax` into one partition per UTC day ahead of
+# time and drops whole days for retention, which is a metadata operation
+# instead of a row-by-row DELETE. Run it from cron, e.g. hourly:
+#
+#   python partitions.py
+#
+# Settings (.env): partition_days_ahead (default 7), retention_days (unset keeps
+# everything).
+
+PARTITIONED_TABLES = {
+    "aggregated_trades": "transact_time",
+    "bookticker": "transaction_time",
+}
+
+DAYS_AHEAD = int(os.getenv("partition_days_ahead", 7))
+
+
+def partition_name(day):
+    return f"p{day:%Y%m%d}"
+
+
+def list_partitions(cursor, table):
+    """Return [(name, upper_bound_ms or None for MAXVALUE)] in partition order."""
+    cursor.execute("""
+        SELECT PARTITION_NAME, PARTITION_DESCRIPTION
+        FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL
+        ORDER BY PARTITION_ORDINAL_POSITION
+    """, (table,))
+    return [(name, None if bound == "MAXVALUE" else int(bound)) for name, bound in cursor.fetchall()]
+
+
+def ensure_future_partitions(days_ahead=DAYS_AHEAD):
+    """
+    Make sure every partitioned table has a daily partition up to today +
+    days_ahead. New days are carved out of `pmax`; on the first run the
+    partitions start at the oldest day already in the table so existing rows
+    are spread over their own days.
+    """
+    connection = create_connection()
+    if not connection:
+        return
+
+    cursor = connection.cursor()
+    today = datetime.now(timezone.utc).date()
+    last_day = today + timedelta(days=days_ahead)
+    try:
+        for table, column in PARTITIONED_TABLES.items():
+            partitions = list_partitions(cursor, table)
+            bounds = [bound for _, bound in partitions if bound is not None]
+            if not partitions:
+                print(f"{table} is not partitioned yet; run the schema migrations first.")
+                continue
+
+            if bounds:
+                first_day = ms_to_date(max(bounds))
+            else:
+                cursor.execute(f"SELECT MIN({column}) FROM {table}")
+                oldest = cursor.fetchone()[0]
+                first_day = ms_to_date(oldest) if oldest is not None else today
+
+            new_days = list(iter_days(first_day, last_day)) if first_day <= last_day else []
+            if not new_days:
+                continue
+
+            definitions = ",\n".join(
+                f"PARTITION {partition_name(day)} VALUES LESS THAN ({date_to_ms(day) + DAY_MS})"
+                for day in new_days
+            )
+            cursor.execute(f"""
+                ALTER TABLE {table} REORGANIZE PARTITION pmax INTO (
+                    {definitions},
+                    PARTITION pmax VALUES LESS THAN MAXVALUE
+                )
+            """)
+            print(f"Added {len(new_days)} daily partitions to {table} "
+                  f"({new_days[0]} .. {new_days[-1]})")
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def drop_partitions_before(cutoff_day):
+    """
+    Drop every daily partition whose days are all before cutoff_day.
+    Returns {table: [dropped partition names]}.
+    """
+    cutoff_ms = date_to_ms(cutoff_day)
+    connection = create_connection()
+    if not connection:
+        return {}
+
+    cursor = connection.cursor()
+    dropped = {}
+    try:
+        for table in PARTITIONED_TABLES:
+            expired = [name for name, bound in list_partitions(cursor, table)
+                       if bound is not None and bound <= cutoff_ms]
+            if expired:
+                cursor.execute(f"ALTER TABLE {table} DROP PARTITION {', '.join(expired)}")
+                print(f"Dropped {len(expired)} partitions from {table} older than {cutoff_day}")
+            dropped[table] = expired
+    finally:
+        cursor.close()
+        connection.close()
+    return dropped
+
+
+def apply_retention(retention_days=None):
+    """Drop partitions older than `retention_days` (env retention_days)."""
+    retention_days = retention_days or os.getenv("retention_days")
+    if not retention_days:
+        return {}
+    cutoff_day = datetime.now(timezone.utc).date() - timedelta(days=int(retention_days))
+    return drop_partitions_before(cutoff_day)
+
+
+if __name__ == "__main__":
+    ensure_future_partitions()
+    apply_retention()
@@ -6,26 +6,14 @@ from polygon import RESTClient
 import pandas as pd  # Import pandas library
 from utils import calculate_volume_profile_fromklines,store_to_file,print_in_chunks
 from datetime import datetime, timedelta
+from schema import migrate_sqlite
 
 
 def create_db_connection(db_name):
     return sqlite3.connect(db_name)
 
 def create_table(conn):
-    cursor = conn.cursor()
-    cursor.execute('''CREATE TABLE IF NOT EXISTS aggs (
-        ticker TEXT,
-        open REAL,
-        high REAL,
-        low REAL,
-        close REAL,
-        volume REAL,
-        vwap REAL,
-        timestamp INTEGER PRIMARY KEY,
-        transactions INTEGER,
-        otc TEXT
-    )''')
-    conn.commit()
+    migrate_sqlite(conn)
 
 def insert_data(conn, data):
     cursor = conn.cursor()
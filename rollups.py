@@ -0,0 +1,202 @@
+import os
+import sys
+import pandas as pd
+from dotenv import load_dotenv
+from time_ranges import MINUTE_MS, date_range_bounds_ms, interval_open_ms
+
+load_dotenv()
+
+# 1-minute rollups of aggregated trades (table agg_trades_1m).
+#
+# One row per (symbol, minute_time) with OHLC, volume split into taker buy /
+# taker sell, the number of underlying trades and the agg trade id range.
+#
+# Rows are never incremented in place: after a batch or an archive lands, the
+# minutes it touched are recomputed from the raw aggregated_trades rows and
+# upserted. Replaying a batch, loading an archive twice or writing overlapping
+# batches from several workers therefore always converges to the same rows.
+#
+# Storage backends call refresh_* after their writes (env `rollups`, default
+# on). Existing history can be backfilled with:
+#
+#   python rollups.py SYMBOL START_DATE [END_DATE]
+
+ROLLUPS_ENABLED = os.getenv("rollups", "1") == "1"
+
+# Minutes recomputed per statement, keeps each upsert transaction short
+REFRESH_CHUNK_MS = 60 * MINUTE_MS
+
+MINUTE_COLUMNS = ["minute_time", "open", "high", "low", "close", "volume", "buy_volume",
+                  "sell_volume", "trades", "first_agg_trade_id", "last_agg_trade_id"]
+
+BAR_COLUMNS = ["open_time", "open", "high", "low", "close", "volume", "buy_volume",
+               "sell_volume", "trades"]
+
+# Window functions need MySQL 8 / SQLite 3.25. {p} is the driver's placeholder
+# and {mod} the modulo operator, which has to be escaped for mysql.connector.
+_REFRESH_SELECT = """
+SELECT symbol, minute_time,
+       MAX(open_price), MAX(price), MIN(price), MAX(close_price),
+       SUM(quantity),
+       SUM(CASE WHEN is_buyer_maker THEN 0 ELSE quantity END),
+       SUM(CASE WHEN is_buyer_maker THEN quantity ELSE 0 END),
+       SUM(last_trade_id - first_trade_id + 1),
+       MIN(agg_trade_id), MAX(agg_trade_id)
+FROM (
+    SELECT symbol, agg_trade_id, price, quantity, first_trade_id, last_trade_id, is_buyer_maker,
+           transact_time - transact_time {mod} 60000 AS minute_time,
+           FIRST_VALUE(price) OVER (PARTITION BY transact_time - transact_time {mod} 60000
+                                    ORDER BY agg_trade_id) AS open_price,
+           FIRST_VALUE(price) OVER (PARTITION BY transact_time - transact_time {mod} 60000
+                                    ORDER BY agg_trade_id DESC) AS close_price
+    FROM aggregated_trades
+    WHERE symbol = {p} AND transact_time >= {p} AND transact_time < {p}
+) minute_trades
+GROUP BY symbol, minute_time
+"""
+
+_INSERT_COLUMNS = f"(symbol, {', '.join(MINUTE_COLUMNS)})"
+
+MYSQL_REFRESH_QUERY = f"""
+INSERT INTO agg_trades_1m {_INSERT_COLUMNS}
+{_REFRESH_SELECT.format(p="%s", mod="%%")}
+ON DUPLICATE KEY UPDATE
+{", ".join(f"{c} = VALUES({c})" for c in MINUTE_COLUMNS[1:])}
+"""
+
+SQLITE_REFRESH_QUERY = f"""
+INSERT OR REPLACE INTO agg_trades_1m {_INSERT_COLUMNS}
+{_REFRESH_SELECT.format(p="?", mod="%")}
+"""
+
+
+def minute_bounds(start_ms, end_ms):
+    """Widen [start_ms, end_ms) to whole minutes."""
+    start = start_ms - start_ms % MINUTE_MS
+    end = end_ms + (-end_ms % MINUTE_MS)
+    return start, end
+
+
+def _chunks(start_ms, end_ms):
+    start_ms, end_ms = minute_bounds(start_ms, end_ms)
+    for chunk_start in range(start_ms, end_ms, REFRESH_CHUNK_MS):
+        yield chunk_start, min(chunk_start + REFRESH_CHUNK_MS, end_ms)
+
+
+def touched_range(aggregated_trades_data):
+    """[start_ms, end_ms) spanned by agg trade rows in the storage write format."""
+    times = [int(trade[6]) for trade in aggregated_trades_data]
+    if not times:
+        return None
+    return min(times), max(times) + 1
+
+
+def csv_time_range(file_name):
+    """
+    [start_ms, end_ms) of an extracted aggTrades archive, read from its first
+    and last rows (archives are in trade order) without parsing the file.
+    """
+    with open(file_name, 'rb') as f:
+        first = f.readline()
+        if first and not first[:1].isdigit():
+            first = f.readline()  # header
+        if not first.strip():
+            return None
+        f.seek(0, os.SEEK_END)
+        f.seek(max(f.tell() - 4096, 0))
+        last = f.read().strip().splitlines()[-1]
+    return int(first.split(b",")[5]), int(last.split(b",")[5]) + 1
+
+
+def refresh_mysql(symbol, start_ms, end_ms):
+    """Recompute the MySQL rollup minutes overlapping [start_ms, end_ms)."""
+    from mysql_connector import create_connection
+
+    connection = create_connection()
+    if not connection:
+        return
+    cursor = connection.cursor()
+    try:
+        for chunk_start, chunk_end in _chunks(start_ms, end_ms):
+            cursor.execute(MYSQL_REFRESH_QUERY, (symbol, chunk_start, chunk_end))
+            connection.commit()
+    except:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def refresh_sqlite(conn, symbol, start_ms, end_ms):
+    """
+    Recompute the SQLite rollup minutes overlapping [start_ms, end_ms).
+    Meant to run as a job on the database's writer thread.
+    """
+    cursor = conn.cursor()
+    for chunk_start, chunk_end in _chunks(start_ms, end_ms):
+        cursor.execute(SQLITE_REFRESH_QUERY, (symbol, chunk_start, chunk_end))
+    cursor.close()
+
+
+def _empty_bars():
+    return pd.DataFrame({c: pd.Series(dtype="int64" if c in ("open_time", "trades") else "float64")
+                         for c in BAR_COLUMNS})
+
+
+def resample_minutes(minutes, interval_ms):
+    """Combine 1-minute rollup rows (sorted by minute_time) into interval_ms bars."""
+    if minutes.empty:
+        return _empty_bars()
+    open_time = interval_open_ms(minutes["minute_time"], interval_ms)
+    bars = minutes.assign(open_time=open_time).groupby("open_time", sort=True).agg(
+        open=("open", "first"),
+        high=("high", "max"),
+        low=("low", "min"),
+        close=("close", "last"),
+        volume=("volume", "sum"),
+        buy_volume=("buy_volume", "sum"),
+        sell_volume=("sell_volume", "sum"),
+        trades=("trades", "sum"),
+    )
+    return bars.reset_index()[BAR_COLUMNS]
+
+
+def bars_from_trades(trades, interval_ms):
+    """Same bars as resample_minutes(), computed straight from raw agg trades."""
+    if trades.empty:
+        return _empty_bars()
+    trades = trades.sort_values(["transact_time", "agg_trade_id"], kind="stable")
+    sell = trades["quantity"].where(trades["is_buyer_maker"].astype(bool), 0.0)
+    bars = trades.assign(
+        open_time=interval_open_ms(trades["transact_time"], interval_ms),
+        buy_volume=trades["quantity"] - sell,
+        sell_volume=sell,
+        trades=trades["last_trade_id"] - trades["first_trade_id"] + 1,
+    ).groupby("open_time", sort=True).agg(
+        open=("price", "first"),
+        high=("price", "max"),
+        low=("price", "min"),
+        close=("price", "last"),
+        volume=("quantity", "sum"),
+        buy_volume=("buy_volume", "sum"),
+        sell_volume=("sell_volume", "sum"),
+        trades=("trades", "sum"),
+    )
+    return bars.reset_index()[BAR_COLUMNS]
+
+
+if __name__ == "__main__":
+    from schema import bootstrap_schema
+    from storage import get_storage
+
+    if len(sys.argv) < 3:
+        print("usage: python rollups.py SYMBOL START_DATE [END_DATE]")
+        sys.exit(1)
+    bootstrap_schema()
+    symbol = sys.argv[1].upper()
+    start_ms, end_ms = date_range_bounds_ms(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+    storage = get_storage()
+    storage.refresh_rollups(symbol, start_ms, end_ms)
+    storage.close()
+    print(f"Rebuilt 1m rollups for {symbol} from {sys.argv[2]}")
@@ -0,0 +1,593 @@
+import os
+import re
+import sqlite3
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Schema bootstrap and forward migrations.
+#
+# Each migration is (version, description, [statements]) and is applied exactly
+# once, in order, inside the target database. The applied versions are kept in
+# a `schema_version` table, so running the bootstrap again is a no-op. Add new
+# migrations to the end of the list; never edit one that has been released.
+#
+# Entry points call ensure_mysql_schema() / ensure_sqlite_schema() once at
+# startup, so the store_* functions only ever issue inserts.
+
+
+MYSQL_MIGRATIONS = [
+    (1, "initial tables", [
+        """
+        CREATE TABLE IF NOT EXISTS klines (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            symbol VARCHAR(10) NOT NULL,
+            timeframe VARCHAR(10) NOT NULL,
+            open_time BIGINT NOT NULL,
+            open DOUBLE NOT NULL,
+            high DOUBLE NOT NULL,
+            low DOUBLE NOT NULL,
+            close DOUBLE NOT NULL,
+            volume DOUBLE NOT NULL,
+            close_time BIGINT NOT NULL,
+            quote_asset_volume DOUBLE NOT NULL,
+            trades BIGINT NOT NULL,
+            taker_buy_base_asset_volume DOUBLE NOT NULL,
+            taker_buy_quote_asset_volume DOUBLE NOT NULL,
+            ignore_column DOUBLE NOT NULL,
+            UNIQUE KEY idx_klines_symbol_timeframe_open_time (symbol, timeframe, open_time,close_time)
+        ) ENGINE=MyISAM
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS aggregated_trades (
+            agg_trade_id BIGINT PRIMARY KEY,
+            symbol VARCHAR(10) NOT NULL,
+            price DOUBLE NOT NULL,
+            quantity DOUBLE NOT NULL,
+            first_trade_id BIGINT NOT NULL,
+            last_trade_id BIGINT NOT NULL,
+            transact_time BIGINT NOT NULL,
+            is_buyer_maker BOOLEAN NOT NULL,
+            UNIQUE KEY idx_symbol_transact_time (symbol, transact_time)
+        ) ENGINE=MyISAM
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS bookticker (
+            update_id BIGINT PRIMARY KEY,
+            symbol VARCHAR(255) NOT NULL,
+            best_bid_price DOUBLE NOT NULL,
+            best_bid_qty DOUBLE NOT NULL,
+            best_ask_price DOUBLE NOT NULL,
+            best_ask_qty DOUBLE NOT NULL,
+            transaction_time BIGINT NOT NULL,
+            event_time BIGINT NOT NULL,
+            UNIQUE KEY idx_symbol_transaction_time (symbol, transaction_time)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS financial_data (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            TimeFrame VARCHAR(10),
+            Ticker VARCHAR(50),
+            Bar INT,
+            Timestamp DATETIME,
+            LastTradeTime DATETIME,
+            Open FLOAT,
+            High FLOAT,
+            Low FLOAT,
+            Close FLOAT,
+            Volume FLOAT,
+            Delta FLOAT,
+            Bid FLOAT,
+            Ask FLOAT,
+            Ticks INT,
+            MaxDelta FLOAT,
+            MinDelta FLOAT,
+            MaxOI FLOAT,
+            MinOI FLOAT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS aggs (
+            ticker VARCHAR(50),
+            open DOUBLE,
+            high DOUBLE,
+            low DOUBLE,
+            close DOUBLE,
+            volume DOUBLE,
+            vwap DOUBLE,
+            timestamp BIGINT PRIMARY KEY,
+            transactions INT,
+            otc VARCHAR(10)
+        )
+        """,
+    ]),
+    (2, "covering indexes for time-range queries", [
+        # Serves the vp_data / POC queries entirely from the index
+        """
+        ALTER TABLE aggregated_trades
+        ADD INDEX idx_symbol_time_price_qty (symbol, transact_time, price, quantity, is_buyer_maker)
+        """,
+        """
+        ALTER TABLE klines
+        ADD INDEX idx_klines_symbol_open_time (symbol, open_time, open, close)
+        """,
+    ]),
+    (3, "daily range partitioning of tick tables", [
+        # MySQL 8 only partitions InnoDB, and every unique key must contain the
+        # partition column. agg_trade_id / update_id are per-symbol sequences,
+        # so the symbol belongs in the key anyway.
+        """
+        ALTER TABLE aggregated_trades
+        ENGINE=InnoDB,
+        DROP PRIMARY KEY,
+        ADD PRIMARY KEY (symbol, agg_trade_id, transact_time)
+        """,
+        """
+        ALTER TABLE aggregated_trades
+        PARTITION BY RANGE (transact_time) (PARTITION pmax VALUES LESS THAN MAXVALUE)
+        """,
+        """
+        ALTER TABLE bookticker
+        ENGINE=InnoDB,
+        DROP PRIMARY KEY,
+        ADD PRIMARY KEY (symbol, update_id, transaction_time)
+        """,
+        """
+        ALTER TABLE bookticker
+        PARTITION BY RANGE (transaction_time) (PARTITION pmax VALUES LESS THAN MAXVALUE)
+        """,
+    ]),
+    (4, "1-minute agg trade rollups", [
+        # Maintained by rollups.py; backfill history with `python rollups.py`
+        """
+        CREATE TABLE IF NOT EXISTS agg_trades_1m (
+            symbol VARCHAR(10) NOT NULL,
+            minute_time BIGINT NOT NULL,
+            open DOUBLE NOT NULL,
+            high DOUBLE NOT NULL,
+            low DOUBLE NOT NULL,
+            close DOUBLE NOT NULL,
+            volume DOUBLE NOT NULL,
+            buy_volume DOUBLE NOT NULL,
+            sell_volume DOUBLE NOT NULL,
+            trades BIGINT NOT NULL,
+            first_agg_trade_id BIGINT NOT NULL,
+            last_agg_trade_id BIGINT NOT NULL,
+            PRIMARY KEY (symbol, minute_time)
+        ) ENGINE=InnoDB
+        """,
+    ]),
+    (5, "daily volume at price", [
+        # Maintained by volume_at_price.py; backfill with `python volume_at_price.py`
+        """
+        CREATE TABLE IF NOT EXISTS volume_at_price (
+            symbol VARCHAR(10) NOT NULL,
+            day DATE NOT NULL,
+            bin_size DOUBLE NOT NULL,
+            bin_start DOUBLE NOT NULL,
+            buy_volume DOUBLE NOT NULL,
+            sell_volume DOUBLE NOT NULL,
+            trades BIGINT NOT NULL,
+            PRIMARY KEY (symbol, day, bin_size, bin_start)
+        ) ENGINE=InnoDB
+        """,
+    ]),
+    (6, "compaction checkpoints", [
+        # Progress of compaction.py per (table, symbol, day), so runs can resume
+        """
+        CREATE TABLE IF NOT EXISTS compaction_checkpoint (
+            table_name VARCHAR(64) NOT NULL,
+            symbol VARCHAR(10) NOT NULL,
+            day DATE NOT NULL,
+            stage VARCHAR(16) NOT NULL,
+            rows_deleted BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            PRIMARY KEY (table_name, symbol, day)
+        ) ENGINE=InnoDB
+        """,
+    ]),
+    (7, "metrics and liquidation snapshot archives", [
+        # Tables of the archive_csv.DATATYPES entries; the primary key is the dedupe key
+        """
+        CREATE TABLE IF NOT EXISTS metrics (
+            create_time BIGINT NOT NULL,
+            symbol VARCHAR(20) NOT NULL,
+            sum_open_interest DOUBLE,
+            sum_open_interest_value DOUBLE,
+            count_toptrader_long_short_ratio DOUBLE,
+            sum_toptrader_long_short_ratio DOUBLE,
+            count_long_short_ratio DOUBLE,
+            sum_taker_long_short_vol_ratio DOUBLE,
+            PRIMARY KEY (symbol, create_time)
+        ) ENGINE=InnoDB
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS liquidation_snapshot (
+            time BIGINT NOT NULL,
+            symbol VARCHAR(20) NOT NULL,
+            side VARCHAR(8) NOT NULL,
+            order_type VARCHAR(16) NOT NULL,
+            time_in_force VARCHAR(8) NOT NULL,
+            original_quantity DOUBLE NOT NULL,
+            price DOUBLE NOT NULL,
+            average_price DOUBLE NOT NULL,
+            order_status VARCHAR(16) NOT NULL,
+            last_fill_quantity DOUBLE NOT NULL,
+            accumulated_fill_quantity DOUBLE NOT NULL,
+            PRIMARY KEY (symbol, time, side, price, original_quantity)
+        ) ENGINE=InnoDB
+        """,
+    ]),
+    (8, "agg trades keyed by agg_trade_id only", [
+        # Several agg trades of a symbol can share a millisecond (one taker
+        # order sweeping price levels); the (symbol, transact_time) unique key
+        # made INSERT IGNORE drop all but the first of them.
+        """
+        ALTER TABLE aggregated_trades DROP INDEX idx_symbol_transact_time
+        """,
+    ]),    (9, "bookticker keyed by update_id", [
+        # Several bookTicker updates of a symbol share a millisecond; the
+        # (symbol, transaction_time) unique key made INSERT IGNORE drop them.
+        # The primary key (symbol, update_id, transaction_time) keeps replays
+        # out; the time index becomes a plain one for range reads.
+        """
+        ALTER TABLE bookticker DROP INDEX idx_symbol_transaction_time
+        """,
+        """
+        ALTER TABLE bookticker ADD INDEX idx_bookticker_symbol_time (symbol, transaction_time)
+        """,
+    ]),
+]
+
+
+SQLITE_MIGRATIONS = [
+    (1, "initial tables", [
+        """
+        CREATE TABLE IF NOT EXISTS klines (
+            id INTEGER PRIMARY KEY,
+            symbol TEXT NOT NULL,
+            interval TEXT NOT NULL,
+            open_time INTEGER NOT NULL,
+            open REAL NOT NULL,
+            high REAL NOT NULL,
+            low REAL NOT NULL,
+            close REAL NOT NULL,
+            volume REAL NOT NULL,
+            close_time INTEGER NOT NULL,
+            quote_asset_volume REAL NOT NULL,
+            trades INTEGER NOT NULL,
+            taker_buy_base_asset_volume REAL NOT NULL,
+            taker_buy_quote_asset_volume REAL NOT NULL,
+            ignore_column REAL NOT NULL
+        )
+        """,
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_klines_symbol_interval_open_time
+        ON klines (symbol, interval, open_time)
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS aggregated_trades (
+            agg_trade_id INTEGER PRIMARY KEY,
+            symbol TEXT NOT NULL,
+            price REAL NOT NULL,
+            quantity REAL NOT NULL,
+            first_trade_id INTEGER NOT NULL,
+            last_trade_id INTEGER NOT NULL,
+            transact_time INTEGER NOT NULL,
+            is_buyer_maker BOOLEAN NOT NULL
+        )
+        """,
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_symbol_transact_time
+        ON aggregated_trades (symbol, transact_time)
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS bookticker (
+            update_id INTEGER PRIMARY KEY,
+            symbol TEXT NOT NULL,
+            best_bid_price REAL NOT NULL,
+            best_bid_qty REAL NOT NULL,
+            best_ask_price REAL NOT NULL,
+            best_ask_qty REAL NOT NULL,
+            transaction_time INTEGER NOT NULL,
+            event_time INTEGER NOT NULL
+        )
+        """,
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_symbol_transaction_time
+        ON bookticker (symbol, transaction_time)
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS aggs (
+            ticker TEXT,
+            open REAL,
+            high REAL,
+            low REAL,
+            close REAL,
+            volume REAL,
+            vwap REAL,
+            timestamp INTEGER PRIMARY KEY,
+            transactions INTEGER,
+            otc TEXT
+        )
+        """,
+    ]),
+    (2, "covering indexes for time-range queries", [
+        """
+        CREATE INDEX IF NOT EXISTS idx_symbol_time_price_qty
+        ON aggregated_trades (symbol, transact_time, price, quantity, is_buyer_maker)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_klines_symbol_open_time
+        ON klines (symbol, open_time, open, close)
+        """,
+    ]),
+    (3, "1-minute agg trade rollups", [
+        """
+        CREATE TABLE IF NOT EXISTS agg_trades_1m (
+            symbol TEXT NOT NULL,
+            minute_time INTEGER NOT NULL,
+            open REAL NOT NULL,
+            high REAL NOT NULL,
+            low REAL NOT NULL,
+            close REAL NOT NULL,
+            volume REAL NOT NULL,
+            buy_volume REAL NOT NULL,
+            sell_volume REAL NOT NULL,
+            trades INTEGER NOT NULL,
+            first_agg_trade_id INTEGER NOT NULL,
+            last_agg_trade_id INTEGER NOT NULL,
+            PRIMARY KEY (symbol, minute_time)
+        )
+        """,
+    ]),
+    (4, "daily volume at price", [
+        """
+        CREATE TABLE IF NOT EXISTS volume_at_price (
+            symbol TEXT NOT NULL,
+            day TEXT NOT NULL,
+            bin_size REAL NOT NULL,
+            bin_start REAL NOT NULL,
+            buy_volume REAL NOT NULL,
+            sell_volume REAL NOT NULL,
+            trades INTEGER NOT NULL,
+            PRIMARY KEY (symbol, day, bin_size, bin_start)
+        )
+        """,
+    ]),
+    (5, "metrics and liquidation snapshot archives", [
+        """
+        CREATE TABLE IF NOT EXISTS metrics (
+            create_time INTEGER NOT NULL,
+            symbol TEXT NOT NULL,
+            sum_open_interest REAL,
+            sum_open_interest_value REAL,
+            count_toptrader_long_short_ratio REAL,
+            sum_toptrader_long_short_ratio REAL,
+            count_long_short_ratio REAL,
+            sum_taker_long_short_vol_ratio REAL,
+            PRIMARY KEY (symbol, create_time)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS liquidation_snapshot (
+            time INTEGER NOT NULL,
+            symbol TEXT NOT NULL,
+            side TEXT NOT NULL,
+            order_type TEXT NOT NULL,
+            time_in_force TEXT NOT NULL,
+            original_quantity REAL NOT NULL,
+            price REAL NOT NULL,
+            average_price REAL NOT NULL,
+            order_status TEXT NOT NULL,
+            last_fill_quantity REAL NOT NULL,
+            accumulated_fill_quantity REAL NOT NULL,
+            PRIMARY KEY (symbol, time, side, price, original_quantity)
+        )
+        """,
+    ]),
+    (6, "agg trades keyed by (symbol, agg_trade_id)", [
+        # agg_trade_id is a per-symbol sequence, so alone it let one symbol's
+        # trades displace another's, and the (symbol, transact_time) unique
+        # index dropped agg trades sharing a millisecond. SQLite cannot alter
+        # a primary key: rebuild the table.
+        """
+        CREATE TABLE aggregated_trades_new (
+            agg_trade_id INTEGER NOT NULL,
+            symbol TEXT NOT NULL,
+            price REAL NOT NULL,
+            quantity REAL NOT NULL,
+            first_trade_id INTEGER NOT NULL,
+            last_trade_id INTEGER NOT NULL,
+            transact_time INTEGER NOT NULL,
+            is_buyer_maker BOOLEAN NOT NULL,
+            PRIMARY KEY (symbol, agg_trade_id)
+        )
+        """,
+        """
+        INSERT INTO aggregated_trades_new
+        SELECT agg_trade_id, symbol, price, quantity, first_trade_id, last_trade_id, transact_time, is_buyer_maker
+        FROM aggregated_trades
+        """,
+        "DROP TABLE aggregated_trades",
+        "ALTER TABLE aggregated_trades_new RENAME TO aggregated_trades",
+        """
+        CREATE INDEX IF NOT EXISTS idx_symbol_time_price_qty
+        ON aggregated_trades (symbol, transact_time, price, quantity, is_buyer_maker)
+        """,
+    ]),    (7, "bookticker keyed by (symbol, update_id)", [
+        # Same fix as migration 6: update ids are per symbol, and the
+        # (symbol, transaction_time) unique index dropped updates sharing a
+        # millisecond
+        """
+        CREATE TABLE bookticker_new (
+            update_id INTEGER NOT NULL,
+            symbol TEXT NOT NULL,
+            best_bid_price REAL NOT NULL,
+            best_bid_qty REAL NOT NULL,
+            best_ask_price REAL NOT NULL,
+            best_ask_qty REAL NOT NULL,
+            transaction_time INTEGER NOT NULL,
+            event_time INTEGER NOT NULL,
+            PRIMARY KEY (symbol, update_id)
+        )
+        """,
+        """
+        INSERT INTO bookticker_new
+        SELECT update_id, symbol, best_bid_price, best_bid_qty, best_ask_price, best_ask_qty,
+               transaction_time, event_time
+        FROM bookticker
+        """,
+        "DROP TABLE bookticker",
+        "ALTER TABLE bookticker_new RENAME TO bookticker",
+        """
+        CREATE INDEX IF NOT EXISTS idx_bookticker_symbol_time
+        ON bookticker (symbol, transaction_time)
+        """,
+    ]),
+]
+
+
+_bootstrapped = set()
+_bootstrap_lock = threading.Lock()
+
+
+def _pending(migrations, applied):
+    return [m for m in migrations if m[0] not in applied]
+
+
+# A statement that only adds or drops one index
+_MYSQL_INDEX_DDL = re.compile(r"ALTER\s+TABLE\s+(\w+)\s+(ADD|DROP)\s+INDEX\s+(\w+)(?:\s*\([^()]*\))?",
+                              re.IGNORECASE)
+
+
+def _mysql_index_applied(cursor, statement):
+    """True if `statement` only adds (drops) an index that already exists (is gone)."""
+    match = _MYSQL_INDEX_DDL.fullmatch(statement.strip())
+    if not match:
+        return False
+    table, action, index = match.groups()
+    cursor.execute("""
+    SELECT 1 FROM information_schema.statistics
+    WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+    LIMIT 1
+    """, (table, index))
+    exists = cursor.fetchone() is not None
+    return exists if action.upper() == "ADD" else not exists
+
+
+def migrate_mysql(connection=None):
+    """
+    Apply any pending MySQL migrations. Returns the list of versions applied.
+    """
+    from mysql_connector import create_connection
+
+    own_connection = connection is None
+    if own_connection:
+        connection = create_connection()
+        if not connection:
+            return []
+
+    cursor = connection.cursor()
+    applied_now = []
+    try:
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INT PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+        cursor.execute("SELECT version FROM schema_version")
+        applied = {row[0] for row in cursor.fetchall()}
+
+        for version, description, statements in _pending(MYSQL_MIGRATIONS, applied):
+            print(f"Applying MySQL migration {version}: {description}")
+            # MySQL DDL auto-commits, so each statement is its own unit; the
+            # version row is only written once every statement succeeded. A
+            # migration cut short is rerun, so index changes that already
+            # took effect are skipped rather than failing on a duplicate.
+            for statement in statements:
+                if _mysql_index_applied(cursor, statement):
+                    continue
+                cursor.execute(statement)
+            cursor.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                           (version, description))
+            connection.commit()
+            applied_now.append(version)
+    finally:
+        cursor.close()
+        if own_connection:
+            connection.close()
+    return applied_now
+
+
+def migrate_sqlite(db="klines_data.db"):
+    """
+    Apply any pending SQLite migrations to `db` (a file name or an open
+    sqlite3 connection). Returns the list of versions applied.
+    """
+    own_connection = not isinstance(db, sqlite3.Connection)
+    conn = sqlite3.connect(db) if own_connection else db
+    cursor = conn.cursor()
+    applied_now = []
+    try:
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+        applied = {row[0] for row in cursor.execute("SELECT version FROM schema_version")}
+
+        for version, description, statements in _pending(SQLITE_MIGRATIONS, applied):
+            print(f"Applying SQLite migration {version}: {description}")
+            # Python's sqlite3 opens no transaction before DDL on its own; BEGIN
+            # explicitly so a migration applies fully or not at all
+            with conn:
+                cursor.execute("BEGIN")
+                for statement in statements:
+                    cursor.execute(statement)
+                cursor.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                               (version, description))
+            applied_now.append(version)
+    finally:
+        cursor.close()
+        if own_connection:
+            conn.close()
+    return applied_now
+
+
+def ensure_mysql_schema():
+    """Run the MySQL migrations once per process."""
+    with _bootstrap_lock:
+        if "mysql" not in _bootstrapped:
+            migrate_mysql()
+            _bootstrapped.add("mysql")
+
+
+def ensure_sqlite_schema(dbname="klines_data.db"):
+    """Run the SQLite migrations once per process for `dbname`."""
+    key = ("sqlite3", os.path.abspath(dbname))
+    with _bootstrap_lock:
+        if key not in _bootstrapped:
+            migrate_sqlite(dbname)
+            _bootstrapped.add(key)
+
+
+def bootstrap_schema(storage=None):
+    """Bootstrap the schema for the configured storage backend (env `storage`)."""
+    storage = storage or os.getenv('storage')
+    if storage == 'mysql':
+        ensure_mysql_schema()
+        from partitions import ensure_future_partitions
+        ensure_future_partitions()
+    elif storage == 'sqlite3':
+        ensure_sqlite_schema()
+
+
+if __name__ == "__main__":
+    bootstrap_schema()
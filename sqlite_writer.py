@@ -0,0 +1,147 @@
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+from dotenv import load_dotenv
+from schema import ensure_sqlite_schema
+
+load_dotenv()
+
+# Single long-lived SQLite writer per database file.
+#
+# SQLite allows one writer at a time, so instead of every store_* call opening
+# its own connection and fighting over the lock, all writes are queued to one
+# dedicated thread that owns a WAL-mode connection. The thread drains whatever
+# is queued and commits it as one transaction (group commit), with a savepoint
+# per job so one bad batch does not roll back its neighbours. Readers keep
+# using their own connections and are not blocked under WAL.
+#
+# Settings (.env): sqlite_synchronous (default NORMAL), sqlite_cache_mb
+# (default 64), sqlite_queue_size (default 1000 jobs).
+
+SYNCHRONOUS = os.getenv("sqlite_synchronous", "NORMAL")
+CACHE_MB = int(os.getenv("sqlite_cache_mb", 64))
+QUEUE_SIZE = int(os.getenv("sqlite_queue_size", 1000))
+MAX_JOBS_PER_COMMIT = 100
+
+_STOP = object()
+
+
+class SQLiteWriter:
+    def __init__(self, dbname, queue_size=QUEUE_SIZE):
+        self.dbname = dbname
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name=f"sqlite-writer-{os.path.basename(dbname)}",
+                                        daemon=True)
+        self._started = threading.Event()
+        self._thread.start()
+        self._started.wait()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.dbname, isolation_level=None)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute(f"PRAGMA synchronous = {SYNCHRONOUS}")
+        conn.execute(f"PRAGMA cache_size = {-CACHE_MB * 1024}")  # negative = KiB
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+
+    def _run(self):
+        conn = self._connect()
+        self._started.set()
+        stopping = False
+        while not stopping:
+            jobs = [self._queue.get()]
+            while len(jobs) < MAX_JOBS_PER_COMMIT:
+                try:
+                    jobs.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if _STOP in jobs:
+                stopping = True
+                jobs = [job for job in jobs if job is not _STOP]
+
+            results = self._commit(conn, jobs)
+
+            for future, result, error in results:
+                if error is not None:
+                    print(f"SQLite write to {self.dbname} failed: {error}")
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+            for _ in range(len(jobs) + (1 if stopping else 0)):
+                self._queue.task_done()
+        conn.close()
+
+    def _commit(self, conn, jobs):
+        """
+        Run the jobs in one transaction. Returns [(future, result, error)]; if
+        the transaction itself fails it is rolled back and every job of the
+        batch gets that error, while the writer carries on with the next one.
+        """
+        results = []
+        try:
+            conn.execute("BEGIN")
+            for fn, future in jobs:
+                conn.execute("SAVEPOINT job")
+                try:
+                    results.append((future, fn(conn), None))
+                    conn.execute("RELEASE job")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO job")
+                    conn.execute("RELEASE job")
+                    results.append((future, None, e))
+            conn.execute("COMMIT")
+            return results
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            return [(future, None, e) for _, future in jobs]
+
+    def submit(self, fn):
+        """
+        Queue fn(connection) to run on the writer thread. Blocks while the
+        queue is full. Returns a Future with fn's result.
+        """
+        future = Future()
+        self._queue.put((fn, future))
+        return future
+
+    def executemany(self, sql, rows):
+        """Queue a prepared bulk insert; the Future resolves to the row count."""
+        rows = list(rows)
+        return self.submit(lambda conn: conn.executemany(sql, rows).rowcount)
+
+    def flush(self):
+        """Block until everything queued so far is committed."""
+        self._queue.join()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_sqlite_writer(dbname="klines_data.db"):
+    """Return the process-wide writer for `dbname`, starting it on first use."""
+    key = os.path.abspath(dbname)
+    with _writers_lock:
+        if key not in _writers:
+            ensure_sqlite_schema(dbname)
+            _writers[key] = SQLiteWriter(dbname)
+        return _writers[key]
+
+
+@atexit.register
+def close_sqlite_writers():
+    # Drain the queues so short-lived scripts don't exit with unwritten batches
+    with _writers_lock:
+        writers = list(_writers.values())
+    for writer in writers:
+        writer.close()
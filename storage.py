@@ -0,0 +1,553 @@
+import csv
+import itertools
+import os
+import threading
+import time
+import uuid
+import pandas as pd
+from dotenv import load_dotenv
+from mysql_connector import (
+    query_mysql,
+    store_klines_to_mysql,
+    store_aggregated_trades_to_mysql,
+    insert_rows_to_mysql,
+    store_bookticker_to_mysql,
+    bulk_load_aggregated_trades_to_mysql,
+)
+from utils import (
+    store_klines_to_db,
+    store_aggregated_trades_to_db,
+    insert_rows_to_db,
+    store_bookticker_to_db,
+    bulk_load_aggregated_trades_to_db,
+)
+from sqlite_writer import get_sqlite_writer
+from rollups import (
+    ROLLUPS_ENABLED,
+    MINUTE_COLUMNS,
+    touched_range,
+    csv_time_range,
+    refresh_mysql,
+    refresh_sqlite,
+    resample_minutes,
+    bars_from_trades,
+)
+from volume_at_price import (
+    VAP_ENABLED,
+    RefreshThrottle,
+    days_in_range,
+    rebuild_mysql,
+    rebuild_sqlite,
+)
+from archive_csv import get_datatype, read_agg_trades_chunks
+from time_ranges import interval_to_ms
+
+load_dotenv()
+
+# Pluggable storage backends.
+#
+# Every ingester gets its backend from get_storage() (env `storage`) and only
+# talks to the Storage interface, so adding a backend or benchmarking them
+# against each other needs no changes in the ingesters.
+#
+# Row formats accepted by the write_* methods:
+#   klines        Binance kline lists: open_time, open, high, low, close, volume,
+#                 close_time, quote_asset_volume, trades, taker_buy_base_asset_volume,
+#                 taker_buy_quote_asset_volume, ignore
+#   agg trades    (symbol, agg_trade_id, price, quantity, first_trade_id,
+#                  last_trade_id, transact_time, is_buyer_maker)
+#   bookticker    (update_id, best_bid_price, best_bid_qty, best_ask_price,
+#                  best_ask_qty, transaction_time, event_time)
+#
+# write_frame() takes a DataFrame of typed columns of any archive data type in
+# the archive_csv.DATATYPES registry (write_agg_trades_frame() for aggTrades)
+# and stores it in the registry's table, skipping the per-row tuples; the
+# database backends drop rows already stored by the table's dedupe key.
+# read_frame() reads those tables back.
+#
+# The read_* methods return DataFrames with the column names below, limited to
+# [start_ms, end_ms) on the table's time column when bounds are given.
+#
+# Database backends keep 1-minute rollups of the agg trades (rollups.py) and
+# refresh the touched minutes after every write; read_trade_bars() serves
+# OHLCV bars from them instead of scanning ticks. They also keep the daily
+# volume_at_price profile (volume_at_price.py) current.
+
+KLINE_COLUMNS = ["symbol", "timeframe", "open_time", "open", "high", "low", "close", "volume",
+                 "close_time", "quote_asset_volume", "trades", "taker_buy_base_asset_volume",
+                 "taker_buy_quote_asset_volume", "ignore_column"]
+
+AGG_TRADE_COLUMNS = ["agg_trade_id", "symbol", "price", "quantity", "first_trade_id",
+                     "last_trade_id", "transact_time", "is_buyer_maker"]
+
+BOOKTICKER_COLUMNS = ["update_id", "symbol", "best_bid_price", "best_bid_qty", "best_ask_price",
+                      "best_ask_qty", "transaction_time", "event_time"]
+
+
+def _kline_rows(klines_data, interval, symbol):
+    return [(symbol, interval, *kline) for kline in klines_data]
+
+
+def _agg_trade_rows(aggregated_trades_data, symbol):
+    return [(trade[1], symbol, *trade[2:]) for trade in aggregated_trades_data]
+
+
+def _frame_rows(df, columns, symbol):
+    # tolist() converts a whole column to native ints/floats in one C pass
+    values = []
+    for column in columns:
+        if column == "symbol":
+            values.append(itertools.repeat(symbol, len(df)))
+            continue
+        series = df[column]
+        if series.dtype == bool:
+            series = series.astype("int8")
+        column_values = series.tolist()
+        if series.hasnans:
+            # Empty CSV fields are NULL, not NaN
+            column_values = [None if pd.isna(value) else value for value in column_values]
+        values.append(column_values)
+    return list(zip(*values))
+
+
+def _frame_time_range(df, time_column="transact_time"):
+    if df.empty:
+        return None
+    return int(df[time_column].min()), int(df[time_column].max()) + 1
+
+
+def _bookticker_rows(bookticker_data, symbol):
+    return [(data[0], symbol, *data[1:]) for data in bookticker_data]
+
+
+def _time_filter(df, column, start_ms, end_ms):
+    if start_ms is not None:
+        df = df[df[column] >= start_ms]
+    if end_ms is not None:
+        df = df[df[column] < end_ms]
+    return df.reset_index(drop=True)
+
+
+class Storage:
+    """Base class: batched writers and range readers for one backend."""
+
+    name = None
+
+    def __init__(self):
+        self._vap_throttle = RefreshThrottle()
+
+    def write_klines(self, klines_data, interval, symbol):
+        raise NotImplementedError
+
+    def write_agg_trades(self, aggregated_trades_data, symbol):
+        raise NotImplementedError
+
+    def write_bookticker(self, bookticker_data, symbol):
+        raise NotImplementedError
+
+    def write_frame(self, data_type, df, symbol, batch_id=None):
+        """
+        Store a typed DataFrame of an archive data type (archive_csv.DATATYPES)
+        in its table. Writing the same `batch_id` again replaces that batch
+        instead of adding rows (Parquet; the database backends ignore rows
+        already stored anyway).
+        """
+        raise NotImplementedError
+
+    def discard_batches(self, data_type, symbol, source):
+        """
+        Drop the batches written from `source` (batch ids `<source>-<n>`)
+        before it is written again, so other chunk boundaries leave no stale
+        batch behind. Only Parquet keeps batches; the other backends have
+        nothing to drop.
+        """
+
+    def write_agg_trades_frame(self, df, symbol, batch_id=None):
+        self.write_frame("aggTrades", df, symbol, batch_id)
+
+    def read_klines(self, symbol, interval=None, start_ms=None, end_ms=None):
+        raise NotImplementedError
+
+    def read_agg_trades(self, symbol, start_ms=None, end_ms=None):
+        raise NotImplementedError
+
+    def read_bookticker(self, symbol, start_ms=None, end_ms=None):
+        raise NotImplementedError
+
+    def read_frame(self, data_type, symbol, start_ms=None, end_ms=None):
+        """Rows of an archive data type, with the registry's table columns."""
+        raise NotImplementedError
+
+    def load_agg_trades_csv(self, file_name, symbol):
+        """
+        Ingest an extracted Binance aggTrades CSV. Backends with a native bulk
+        path override this; the default parses it in vectorized chunks and
+        uses write_agg_trades_frame. Returns the number of rows read.
+        """
+        rows = 0
+        for chunk in read_agg_trades_chunks(file_name):
+            self.write_agg_trades_frame(chunk, symbol)
+            rows += len(chunk)
+        return rows
+
+    def refresh_rollups(self, symbol, start_ms, end_ms):
+        """Recompute the 1-minute rollups in [start_ms, end_ms); no-op without rollup tables."""
+        pass
+
+    def read_trade_bars(self, symbol, interval, start_ms=None, end_ms=None):
+        """
+        OHLCV + buy/sell volume bars of `interval` built from agg trades
+        (columns rollups.BAR_COLUMNS). The default aggregates raw ticks.
+        """
+        return bars_from_trades(self.read_agg_trades(symbol, start_ms, end_ms), interval_to_ms(interval))
+
+    def refresh_volume_at_price(self, symbol, day):
+        """Rebuild one UTC day of the volume_at_price table; no-op without it."""
+        pass
+
+    def _refresh_after_write(self, symbol, time_range, force=False):
+        """
+        Bring the derived tables up to date after agg trades in `time_range`
+        were written. Live batches and archive chunks pass force=False, so
+        volume profiles are rebuilt at most every vap_refresh_secs (flush()
+        rebuilds the rest once an archive is stored); whole-file loads pass True.
+        """
+        if not time_range:
+            return
+        if ROLLUPS_ENABLED:
+            self.refresh_rollups(symbol, *time_range)
+        if VAP_ENABLED:
+            self._vap_throttle.mark(symbol, days_in_range(*time_range))
+            self._refresh_volume_at_price(force)
+
+    def _refresh_volume_at_price(self, force=False):
+        for symbol, day in self._vap_throttle.due(force):
+            self.refresh_volume_at_price(symbol, day)
+
+    def flush(self):
+        """
+        Block until everything written so far is stored, including the volume
+        profiles of the days it touched; writes are synchronous by default.
+        """
+        self._refresh_volume_at_price(force=True)
+
+    def close(self):
+        self._refresh_volume_at_price(force=True)
+
+
+class MySQLStorage(Storage):
+    name = "mysql"
+
+    def write_klines(self, klines_data, interval, symbol):
+        store_klines_to_mysql(klines_data, interval, symbol)
+
+    def write_agg_trades(self, aggregated_trades_data, symbol):
+        store_aggregated_trades_to_mysql(aggregated_trades_data, symbol)
+        self._refresh_after_write(symbol, touched_range(aggregated_trades_data))
+
+    def write_frame(self, data_type, df, symbol, batch_id=None):
+        datatype = get_datatype(data_type)
+        insert_rows_to_mysql(datatype["table"], datatype["columns"], _frame_rows(df, datatype["columns"], symbol))
+        if datatype["table"] == "aggregated_trades":
+            self._refresh_after_write(symbol, _frame_time_range(df))
+
+    def write_bookticker(self, bookticker_data, symbol):
+        store_bookticker_to_mysql(bookticker_data, symbol)
+
+    def load_agg_trades_csv(self, file_name, symbol):
+        rows = bulk_load_aggregated_trades_to_mysql(file_name, symbol)
+        self._refresh_after_write(symbol, csv_time_range(file_name), force=True)
+        return rows
+
+    def refresh_rollups(self, symbol, start_ms, end_ms):
+        refresh_mysql(symbol, start_ms, end_ms)
+
+    def refresh_volume_at_price(self, symbol, day):
+        rebuild_mysql(symbol, day)
+
+    def _read(self, table, columns, time_column, where, params, start_ms, end_ms):
+        if start_ms is not None:
+            where.append(f"{time_column} >= %s")
+            params.append(start_ms)
+        if end_ms is not None:
+            where.append(f"{time_column} < %s")
+            params.append(end_ms)
+        rows = query_mysql(f"SELECT {', '.join(columns)} FROM {table} WHERE {' AND '.join(where)} "
+                           f"ORDER BY {time_column}", tuple(params))
+        return pd.DataFrame(rows, columns=columns)
+
+    def read_klines(self, symbol, interval=None, start_ms=None, end_ms=None):
+        where, params = ["symbol = %s"], [symbol]
+        if interval:
+            where.append("timeframe = %s")
+            params.append(interval)
+        return self._read("klines", KLINE_COLUMNS, "open_time", where, params, start_ms, end_ms)
+
+    def read_agg_trades(self, symbol, start_ms=None, end_ms=None):
+        return self._read("aggregated_trades", AGG_TRADE_COLUMNS, "transact_time",
+                          ["symbol = %s"], [symbol], start_ms, end_ms)
+
+    def read_bookticker(self, symbol, start_ms=None, end_ms=None):
+        return self._read("bookticker", BOOKTICKER_COLUMNS, "transaction_time",
+                          ["symbol = %s"], [symbol], start_ms, end_ms)
+
+    def read_frame(self, data_type, symbol, start_ms=None, end_ms=None):
+        datatype = get_datatype(data_type)
+        return self._read(datatype["table"], datatype["columns"], datatype["time_column"],
+                          ["symbol = %s"], [symbol], start_ms, end_ms)
+
+    def read_trade_bars(self, symbol, interval, start_ms=None, end_ms=None):
+        minutes = self._read("agg_trades_1m", MINUTE_COLUMNS, "minute_time",
+                             ["symbol = %s"], [symbol], start_ms, end_ms)
+        return resample_minutes(minutes, interval_to_ms(interval))
+
+
+class SQLiteStorage(Storage):
+    name = "sqlite3"
+
+    def __init__(self, dbname="klines_data.db"):
+        super().__init__()
+        self.dbname = dbname
+
+    def write_klines(self, klines_data, interval, symbol):
+        store_klines_to_db(klines_data, interval, symbol, self.dbname)
+
+    def write_agg_trades(self, aggregated_trades_data, symbol):
+        store_aggregated_trades_to_db(aggregated_trades_data, symbol, self.dbname)
+        # Queued behind the insert on the same writer thread, so it sees the new rows
+        self._refresh_after_write(symbol, touched_range(aggregated_trades_data))
+
+    def write_frame(self, data_type, df, symbol, batch_id=None):
+        datatype = get_datatype(data_type)
+        insert_rows_to_db(datatype["table"], datatype["columns"], _frame_rows(df, datatype["columns"], symbol),
+                          self.dbname)
+        if datatype["table"] == "aggregated_trades":
+            self._refresh_after_write(symbol, _frame_time_range(df))
+
+    def write_bookticker(self, bookticker_data, symbol):
+        store_bookticker_to_db(bookticker_data, symbol, self.dbname)
+
+    def load_agg_trades_csv(self, file_name, symbol):
+        rows = bulk_load_aggregated_trades_to_db(file_name, symbol, self.dbname)
+        self._refresh_after_write(symbol, csv_time_range(file_name), force=True)
+        return rows
+
+    def refresh_rollups(self, symbol, start_ms, end_ms):
+        return get_sqlite_writer(self.dbname).submit(
+            lambda conn: refresh_sqlite(conn, symbol, start_ms, end_ms))
+
+    def refresh_volume_at_price(self, symbol, day):
+        return get_sqlite_writer(self.dbname).submit(lambda conn: rebuild_sqlite(conn, symbol, day))
+
+    def flush(self):
+        # Queue the pending profile rebuilds, then wait until the writer thread
+        # has committed everything queued so far
+        super().flush()
+        get_sqlite_writer(self.dbname).flush()
+
+    def close(self):
+        super().close()
+        self.flush()
+
+    def _read(self, table, columns, time_column, where, params, start_ms, end_ms):
+        import sqlite3
+
+        if start_ms is not None:
+            where.append(f"{time_column} >= ?")
+            params.append(start_ms)
+        if end_ms is not None:
+            where.append(f"{time_column} < ?")
+            params.append(end_ms)
+        conn = sqlite3.connect(self.dbname)
+        try:
+            return pd.read_sql_query(f"SELECT {', '.join(columns)} FROM {table} WHERE {' AND '.join(where)} "
+                                     f"ORDER BY {time_column}", conn, params=params)
+        finally:
+            conn.close()
+
+    def read_klines(self, symbol, interval=None, start_ms=None, end_ms=None):
+        # The SQLite klines table calls the timeframe column `interval`
+        columns = [c if c != "timeframe" else "interval AS timeframe" for c in KLINE_COLUMNS]
+        where, params = ["symbol = ?"], [symbol]
+        if interval:
+            where.append("interval = ?")
+            params.append(interval)
+        return self._read("klines", columns, "open_time", where, params, start_ms, end_ms)
+
+    def read_agg_trades(self, symbol, start_ms=None, end_ms=None):
+        return self._read("aggregated_trades", AGG_TRADE_COLUMNS, "transact_time",
+                          ["symbol = ?"], [symbol], start_ms, end_ms)
+
+    def read_bookticker(self, symbol, start_ms=None, end_ms=None):
+        return self._read("bookticker", BOOKTICKER_COLUMNS, "transaction_time",
+                          ["symbol = ?"], [symbol], start_ms, end_ms)
+
+    def read_frame(self, data_type, symbol, start_ms=None, end_ms=None):
+        datatype = get_datatype(data_type)
+        return self._read(datatype["table"], datatype["columns"], datatype["time_column"],
+                          ["symbol = ?"], [symbol], start_ms, end_ms)
+
+    def read_trade_bars(self, symbol, interval, start_ms=None, end_ms=None):
+        minutes = self._read("agg_trades_1m", MINUTE_COLUMNS, "minute_time",
+                             ["symbol = ?"], [symbol], start_ms, end_ms)
+        return resample_minutes(minutes, interval_to_ms(interval))
+
+
+class CSVStorage(Storage):
+    """Appends rows to one CSV per symbol (and interval) under base_dir/<table>/."""
+
+    name = "csv"
+
+    def __init__(self, base_dir=os.path.join("data", "csv")):
+        super().__init__()
+        self.base_dir = base_dir
+        # Writers may run on several threads; keep appended rows from interleaving
+        self._lock = threading.Lock()
+
+    def _path(self, table, key):
+        directory = os.path.join(self.base_dir, table)
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f"{key}.csv")
+
+    def _append(self, path, columns, rows):
+        with self._lock:
+            new_file = not os.path.exists(path)
+            with open(path, 'a', newline='') as f:
+                writer = csv.writer(f)
+                if new_file:
+                    writer.writerow(columns)
+                writer.writerows(rows)
+
+    def write_klines(self, klines_data, interval, symbol):
+        self._append(self._path("klines", f"{symbol}_{interval}"), KLINE_COLUMNS,
+                     _kline_rows(klines_data, interval, symbol))
+
+    def write_agg_trades(self, aggregated_trades_data, symbol):
+        self._append(self._path("aggregated_trades", symbol), AGG_TRADE_COLUMNS,
+                     _agg_trade_rows(aggregated_trades_data, symbol))
+
+    def write_bookticker(self, bookticker_data, symbol):
+        self._append(self._path("bookticker", symbol), BOOKTICKER_COLUMNS,
+                     _bookticker_rows(bookticker_data, symbol))
+
+    def write_frame(self, data_type, df, symbol, batch_id=None):
+        datatype = get_datatype(data_type)
+        df = df.assign(symbol=symbol)[datatype["columns"]]
+        df = df.astype({column: "int8" for column in df.columns if df[column].dtype == bool})
+        path = self._path(datatype["table"], symbol)
+        with self._lock:
+            df.to_csv(path, mode='a', header=not os.path.exists(path), index=False)
+
+    def _read(self, path, time_column, start_ms, end_ms):
+        if not os.path.exists(path):
+            return pd.DataFrame()
+        return _time_filter(pd.read_csv(path), time_column, start_ms, end_ms)
+
+    def read_klines(self, symbol, interval=None, start_ms=None, end_ms=None):
+        return self._read(self._path("klines", f"{symbol}_{interval}"), "open_time", start_ms, end_ms)
+
+    def read_agg_trades(self, symbol, start_ms=None, end_ms=None):
+        return self._read(self._path("aggregated_trades", symbol), "transact_time", start_ms, end_ms)
+
+    def read_bookticker(self, symbol, start_ms=None, end_ms=None):
+        return self._read(self._path("bookticker", symbol), "transaction_time", start_ms, end_ms)
+
+    def read_frame(self, data_type, symbol, start_ms=None, end_ms=None):
+        datatype = get_datatype(data_type)
+        return self._read(self._path(datatype["table"], symbol), datatype["time_column"], start_ms, end_ms)
+
+
+class ParquetStorage(Storage):
+    """
+    Columnar tick store (see parquet_store.py): one directory per symbol and
+    UTC day, so reads only open the days they need. Requires pyarrow.
+    """
+
+    name = "parquet"
+
+    def _write_frame(self, table, df, symbol, batch_id=None):
+        import parquet_store
+
+        # Unique name per live batch: they append, they never overwrite, so
+        # there are no earlier files of that batch to replace
+        replace = batch_id is not None
+        batch_id = batch_id or f"batch-{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+        parquet_store.write_frame(df, table, symbol, batch_id, replace=replace)
+
+    def _write(self, table, rows, columns, symbol):
+        if rows:
+            self._write_frame(table, pd.DataFrame(rows, columns=columns), symbol)
+
+    def write_klines(self, klines_data, interval, symbol):
+        self._write("klines", _kline_rows(klines_data, interval, symbol), KLINE_COLUMNS, symbol)
+
+    def write_agg_trades(self, aggregated_trades_data, symbol):
+        self._write("aggregated_trades", _agg_trade_rows(aggregated_trades_data, symbol), AGG_TRADE_COLUMNS, symbol)
+
+    def write_bookticker(self, bookticker_data, symbol):
+        self._write("bookticker", _bookticker_rows(bookticker_data, symbol), BOOKTICKER_COLUMNS, symbol)
+
+    def write_frame(self, data_type, df, symbol, batch_id=None):
+        self._write_frame(get_datatype(data_type)["table"], df, symbol, batch_id)
+
+    def discard_batches(self, data_type, symbol, source):
+        import parquet_store
+
+        parquet_store.remove_batches(get_datatype(data_type)["table"], symbol, source)
+
+    def load_agg_trades_csv(self, file_name, symbol):
+        import parquet_store
+
+        return parquet_store.write_csv(file_name, "aggregated_trades", symbol)
+
+    def _read(self, table, symbol, start_ms, end_ms):
+        import parquet_store
+
+        df = parquet_store.read_frame(table, symbol, start_ms=start_ms, end_ms=end_ms)
+        df.insert(1 if table != "klines" else 0, "symbol", symbol)
+        return df
+
+    def read_klines(self, symbol, interval=None, start_ms=None, end_ms=None):
+        df = self._read("klines", symbol, start_ms, end_ms)
+        if interval:
+            df = df[df["timeframe"] == interval]
+        # A candle fetched more than once lives in several batch files; keep the latest
+        return df.drop_duplicates(["timeframe", "open_time"], keep="last").reset_index(drop=True)
+
+    def read_agg_trades(self, symbol, start_ms=None, end_ms=None):
+        df = self._read("aggregated_trades", symbol, start_ms, end_ms)[AGG_TRADE_COLUMNS]
+        # The same trades can come from a live batch, a daily and a monthly archive
+        return df.drop_duplicates(["agg_trade_id"]).reset_index(drop=True)
+
+    def read_bookticker(self, symbol, start_ms=None, end_ms=None):
+        df = self._read("bookticker", symbol, start_ms, end_ms)[BOOKTICKER_COLUMNS]
+        return df.drop_duplicates(get_datatype("bookTicker")["key"]).reset_index(drop=True)
+
+    def read_frame(self, data_type, symbol, start_ms=None, end_ms=None):
+        import parquet_store
+
+        datatype = get_datatype(data_type)
+        df = parquet_store.read_frame(datatype["table"], symbol, start_ms=start_ms, end_ms=end_ms)
+        df["symbol"] = symbol
+        # Batches written more than once (live appends) share rows; the dedupe key drops them
+        return df[datatype["columns"]].drop_duplicates(datatype["key"]).reset_index(drop=True)
+
+
+STORAGE_BACKENDS = {
+    "mysql": MySQLStorage,
+    "sqlite3": SQLiteStorage,
+    "csv": CSVStorage,
+    "parquet": ParquetStorage,
+}
+
+_storages = {}
+
+
+def get_storage(name=None):
+    """Return the (per-process) storage backend named by `name` or env `storage`."""
+    name = name or os.getenv('storage') or "csv"
+    if name not in STORAGE_BACKENDS:
+        raise ValueError(f"Unknown storage backend {name!r}; expected one of {sorted(STORAGE_BACKENDS)}")
+    if name not in _storages:
+        _storages[name] = STORAGE_BACKENDS[name]()
+    return _storages[name]
@@ -0,0 +1,26 @@
+import os
+from archive_csv import get_datatype, read_datatype_chunks
+from storage import _frame_rows
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def test_liquidation_snapshot_columns_line_up_with_the_archive():
+    # Header and rows as in the data.binance.vision archives: no symbol column
+    path = os.path.join(FIXTURES, "BTCUSD_PERP-liquidationSnapshot-2023-06-01.csv")
+    (chunk,) = read_datatype_chunks("liquidationSnapshot", path)
+
+    first = chunk.iloc[0]
+    assert first["time"] == 1685577652391
+    assert first["side"] == "SELL"
+    assert first["order_type"] == "LIMIT"
+    assert first["time_in_force"] == "IOC"
+    assert first["original_quantity"] == 3
+    assert first["price"] == 27018.3
+    assert first["average_price"] == 27074.7
+    assert first["order_status"] == "FILLED"
+    assert first["accumulated_fill_quantity"] == 3
+
+    # The symbol comes from the archive, in the table's column position
+    rows = _frame_rows(chunk, get_datatype("liquidationSnapshot")["columns"], "BTCUSD_PERP")
+    assert rows[1] == (1685578212730, "BTCUSD_PERP", "BUY", "LIMIT", "IOC", 1.0, 27210.9, 27150.0, "FILLED", 1.0, 1.0)
@@ -0,0 +1,195 @@
+import os
+import shutil
+import struct
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from archive_csv import CHUNK_ROWS, read_agg_trades_chunks
+from time_ranges import DAY_MS, iter_days, to_date
+
+load_dotenv()
+
+# Memory-mapped binary tick cache, one file per symbol and UTC day:
+#
+#   <tick_cache_dir>/<SYMBOL>/<YYYY-MM-DD>.ticks
+#
+# File layout (little endian, columnar so every column is one contiguous array):
+#
+#   header  64 bytes: magic b"GPTTICK1", uint32 version, uint64 row count, padding
+#   transact_time   int64   x rows
+#   price           float64 x rows
+#   quantity        float32 x rows
+#   is_buyer_maker  uint8   x rows
+#
+# load_day() maps the file and wraps the columns in a DataFrame without copying,
+# so several analysis processes reading the same day share it through the page
+# cache and a cold load costs a few page faults instead of a CSV parse.
+
+TICK_CACHE_DIR = os.getenv("tick_cache_dir", os.path.join("data", "tickcache"))
+
+MAGIC = b"GPTTICK1"
+VERSION = 1
+HEADER = struct.Struct("<8sIQ")
+HEADER_SIZE = 64
+
+COPY_BUFFER = 1024 * 1024
+
+COLUMNS = [
+    ("transact_time", np.dtype("<i8")),
+    ("price", np.dtype("<f8")),
+    ("quantity", np.dtype("<f4")),
+    ("is_buyer_maker", np.dtype("u1")),
+]
+
+
+def day_path(symbol, day, cache_dir=TICK_CACHE_DIR):
+    return os.path.join(cache_dir, symbol, f"{to_date(day).isoformat()}.ticks")
+
+
+def _offsets(rows):
+    offset = HEADER_SIZE
+    for name, dtype in COLUMNS:
+        yield name, dtype, offset
+        offset += dtype.itemsize * rows
+
+
+def write_day(symbol, day, transact_time, price, quantity, is_buyer_maker, cache_dir=TICK_CACHE_DIR):
+    """Write one day's ticks; the file is replaced atomically."""
+    path = day_path(symbol, day, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    arrays = {
+        "transact_time": transact_time,
+        "price": price,
+        "quantity": quantity,
+        "is_buyer_maker": is_buyer_maker,
+    }
+    rows = len(transact_time)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, rows).ljust(HEADER_SIZE, b"\0"))
+        for name, dtype, _ in _offsets(rows):
+            f.write(np.ascontiguousarray(arrays[name], dtype=dtype).tobytes())
+    os.replace(tmp_path, path)
+    return path
+
+
+def write_frame(symbol, df, cache_dir=TICK_CACHE_DIR):
+    """
+    Split an aggTrades DataFrame (millisecond transact_time) by UTC day and
+    write one cache file per day. Returns the written paths.
+    """
+    df = df.sort_values("transact_time", kind="stable")
+    days = df["transact_time"].to_numpy(dtype="int64") // DAY_MS
+    paths = []
+    for day_number in np.unique(days):
+        day_df = df[days == day_number]
+        day = pd.Timestamp(int(day_number) * DAY_MS, unit="ms").date()
+        paths.append(write_day(symbol, day,
+                               day_df["transact_time"].to_numpy(),
+                               day_df["price"].to_numpy(),
+                               day_df["quantity"].to_numpy(),
+                               day_df["is_buyer_maker"].to_numpy(),
+                               cache_dir))
+    return paths
+
+
+class _DayAppender:
+    """
+    Builds one day's file chunk by chunk: each column is appended to its own
+    part file and the parts are joined behind the header once the row count
+    is known, so only one chunk is ever in memory.
+    """
+
+    def __init__(self, symbol, day, cache_dir):
+        self.path = day_path(symbol, day, cache_dir)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.rows = 0
+        self._parts = {name: open(f"{self.path}.{name}.part", "wb") for name, _ in COLUMNS}
+
+    def append(self, df):
+        for name, dtype in COLUMNS:
+            self._parts[name].write(np.ascontiguousarray(df[name].to_numpy(), dtype=dtype).tobytes())
+        self.rows += len(df)
+
+    def finish(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, self.rows).ljust(HEADER_SIZE, b"\0"))
+            for name, _ in COLUMNS:
+                part = self._parts[name]
+                part.close()
+                with open(part.name, "rb") as src:
+                    shutil.copyfileobj(src, f, COPY_BUFFER)
+                os.remove(part.name)
+        os.replace(tmp_path, self.path)
+        return self.path
+
+    def discard(self):
+        for part in self._parts.values():
+            if not part.closed:
+                part.close()
+                os.remove(part.name)
+
+
+def build_from_csv(file_name, symbol, cache_dir=TICK_CACHE_DIR, chunk_rows=CHUNK_ROWS):
+    """
+    Build cache files from a Binance aggTrades archive CSV, given as a file
+    name or as a seekable binary file object (e.g. a zip member). The CSV is
+    parsed `chunk_rows` rows at a time and each chunk appended to its days,
+    so memory stays flat for monthly archives. Archives are in trade order;
+    rows keep that order within a day.
+    """
+    days = {}
+    try:
+        for chunk in read_agg_trades_chunks(file_name, chunk_rows):
+            chunk = chunk.sort_values("transact_time", kind="stable")
+            day_numbers = chunk["transact_time"].to_numpy(dtype="int64") // DAY_MS
+            for day_number in np.unique(day_numbers):
+                if day_number not in days:
+                    day = pd.Timestamp(int(day_number) * DAY_MS, unit="ms").date()
+                    days[day_number] = _DayAppender(symbol, day, cache_dir)
+                days[day_number].append(chunk[day_numbers == day_number])
+        return [days[day_number].finish() for day_number in sorted(days)]
+    finally:
+        # Parts of days left unfinished by an error
+        for appender in days.values():
+            appender.discard()
+
+
+def load_day(symbol, day, cache_dir=TICK_CACHE_DIR):
+    """
+    Memory-map one day's ticks. The returned DataFrame's columns are read-only
+    views of the file (transact_time stays in milliseconds); assign new
+    columns rather than modifying these in place.
+    """
+    path = day_path(symbol, day, cache_dir)
+    with open(path, "rb") as f:
+        magic, version, rows = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a version {VERSION} tick cache file")
+
+    data = {}
+    if rows:
+        mapped = np.memmap(path, mode="r", dtype=np.uint8)
+        for name, dtype, offset in _offsets(rows):
+            data[name] = mapped[offset:offset + dtype.itemsize * rows].view(dtype)
+    else:
+        data = {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS}
+    # uint8 0/1 reinterpreted as bool, still without a copy
+    data["is_buyer_maker"] = data["is_buyer_maker"].view(np.bool_)
+    return pd.DataFrame(data, copy=False)
+
+
+def load_range(symbol, start_date, end_date, cache_dir=TICK_CACHE_DIR):
+    """Concatenate the cached days in [start_date, end_date]; missing days are skipped."""
+    frames = [load_day(symbol, day, cache_dir) for day in iter_days(start_date, end_date)
+              if os.path.exists(day_path(symbol, day, cache_dir))]
+    if not frames:
+        return pd.DataFrame({name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS}).astype(
+            {"is_buyer_maker": bool})
+    return pd.concat(frames, ignore_index=True)
+
+
+def has_day(symbol, day, cache_dir=TICK_CACHE_DIR):
+    return os.path.exists(day_path(symbol, day, cache_dir))
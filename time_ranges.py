@@ -0,0 +1,91 @@
+import calendar
+from datetime import date, datetime, timedelta, timezone
+
+# Helpers that turn calendar dates into [start_ms, end_ms) bounds on the raw
+# millisecond columns (transact_time, open_time, transaction_time, ...).
+#
+# Filtering with `col >= start AND col < end` keeps the predicate sargable, so
+# MySQL/SQLite can range-scan (symbol, transact_time, ...) indexes instead of
+# evaluating DATE(FROM_UNIXTIME(col/1000)) for every row. Days are UTC days,
+# matching the Binance archives.
+
+MINUTE_MS = 60 * 1000
+DAY_MS = 24 * 60 * MINUTE_MS
+WEEK_MS = 7 * DAY_MS
+# The epoch is a Thursday; Binance weeks start on Monday 00:00 UTC
+_WEEK_OFFSET_MS = 3 * DAY_MS
+
+_INTERVAL_UNITS_MS = {"m": MINUTE_MS, "h": 60 * MINUTE_MS, "d": DAY_MS, "w": WEEK_MS}
+
+
+def to_date(value):
+    """Accept a date, a datetime or a 'YYYY-MM-DD' string."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def date_to_ms(value):
+    """Milliseconds since epoch of 00:00 UTC on the given day."""
+    d = to_date(value)
+    return int(datetime(d.year, d.month, d.day, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def ms_to_date(ms):
+    """UTC calendar day that contains the given millisecond timestamp."""
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc).date()
+
+
+def day_bounds_ms(day):
+    """[start_ms, end_ms) covering one UTC day."""
+    start_ms = date_to_ms(day)
+    return start_ms, start_ms + DAY_MS
+
+
+def date_range_bounds_ms(start_day, end_day=None):
+    """
+    [start_ms, end_ms) covering every UTC day from start_day to end_day,
+    both inclusive. With no end_day this is a single day.
+    """
+    end_day = end_day or start_day
+    start_ms = date_to_ms(start_day)
+    end_ms = date_to_ms(end_day) + DAY_MS
+    if end_ms <= start_ms:
+        raise ValueError(f"end date {end_day} is before start date {start_day}")
+    return start_ms, end_ms
+
+
+def iter_days(start_day, end_day):
+    """Yield every UTC day from start_day to end_day, both inclusive."""
+    current, end_day = to_date(start_day), to_date(end_day)
+    while current <= end_day:
+        yield current
+        current += timedelta(days=1)
+
+
+def month_end(day):
+    """Last day of the calendar month containing `day`."""
+    d = to_date(day)
+    return d.replace(day=calendar.monthrange(d.year, d.month)[1])
+
+
+def interval_to_ms(interval):
+    """
+    Length of a Binance kline interval ('1m', '15m', '4h', '1d', '1w') in
+    milliseconds. Calendar months ('1M') have no fixed length and raise.
+    """
+    unit = interval[-1:]
+    if unit not in _INTERVAL_UNITS_MS or not interval[:-1].isdigit():
+        raise ValueError(f"Unsupported interval {interval!r}")
+    return int(interval[:-1]) * _INTERVAL_UNITS_MS[unit]
+
+
+def interval_open_ms(time_ms, interval_ms):
+    """
+    Open time of the interval_ms bar containing time_ms (an int or a pandas
+    Series), with weekly bars starting on Monday like the Binance klines.
+    """
+    offset = _WEEK_OFFSET_MS if interval_ms % WEEK_MS == 0 else 0
+    return time_ms - (time_ms + offset) % interval_ms
@@ -532,14 +532,39 @@ def calculate_tpo_agg(df):
 # print("Delta:", delta)
 
 
-def read_data(filename):
-    df = pd.read_csv(filename)
-    df['transact_time'] = pd.to_datetime(df['transact_time'], unit='ms')
+def _read_parquet_unique(table, key, symbol, start_date, end_date, columns):
+    """
+    parquet_store.read_frame() without the rows stored twice: live batches and
+    archives of the same day overlap, so rows are deduplicated on `key`
+    (read even when not among `columns`).
+    """
+    import parquet_store
+    read_columns = None if columns is None else list(dict.fromkeys([*columns, *key]))
+    df = parquet_store.read_frame(table, symbol, start_date, end_date, read_columns).drop_duplicates(key)
+    return (df if columns is None else df[columns]).reset_index(drop=True)
+
+def read_data(filename=None, symbol=None, start_date=None, end_date=None, columns=None):
+    """
+    Load aggTrades from a CSV file, or, when `symbol` is given, from the
+    Parquet tick store (parquet_store.py) limited to [start_date, end_date]
+    and to `columns`.
+    """
+    if symbol is not None:
+        df = _read_parquet_unique("aggregated_trades", ["agg_trade_id"], symbol, start_date, end_date, columns)
+    else:
+        df = pd.read_csv(filename, usecols=columns)
+    if 'transact_time' in df:
+        df['transact_time'] = pd.to_datetime(df['transact_time'], unit='ms')
     return df
 
-def read_bookticker_data(filename):
-    df = pd.read_csv(filename)
-    df['transaction_time'] = pd.to_datetime(df['transaction_time'], unit='ms')
+def read_bookticker_data(filename=None, symbol=None, start_date=None, end_date=None, columns=None):
+    """Same as read_data(), for bookTicker data."""
+    if symbol is not None:
+        df = _read_parquet_unique("bookticker", ["update_id"], symbol, start_date, end_date, columns)
+    else:
+        df = pd.read_csv(filename, usecols=columns)
+    if 'transaction_time' in df:
+        df['transaction_time'] = pd.to_datetime(df['transaction_time'], unit='ms')
     return df
 
 # generate footprint candle from aggregated data
@@ -800,51 +825,13 @@ def calculate_volume_profile(df):
     return pd.DataFrame(results)
 
 import sqlite3
+from sqlite_writer import get_sqlite_writer
 
-def store_klines_to_db(klines_data, interval, symbol, dbname="klines_data.db"):
-    # Establish a connection to the SQLite database
-    conn = sqlite3.connect(dbname)
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS klines (
-        id INTEGER PRIMARY KEY,
-        symbol TEXT NOT NULL,
-        interval TEXT NOT NULL,
-        open_time INTEGER NOT NULL,
-        open REAL NOT NULL,
-        high REAL NOT NULL,
-        low REAL NOT NULL,
-        close REAL NOT NULL,
-        volume REAL NOT NULL,
-        close_time INTEGER NOT NULL,
-        quote_asset_volume REAL NOT NULL,
-        trades INTEGER NOT NULL,
-        taker_buy_base_asset_volume REAL NOT NULL,
-        taker_buy_quote_asset_volume REAL NOT NULL,
-        ignore_column REAL NOT NULL
-    )
-    """)
-
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS aggregated_trades (
-        agg_trade_id INTEGER PRIMARY KEY,
-        symbol TEXT NOT NULL,
-        price REAL NOT NULL,
-        quantity REAL NOT NULL,
-        first_trade_id INTEGER NOT NULL,
-        last_trade_id INTEGER NOT NULL,
-        transact_time INTEGER NOT NULL,
-        is_buyer_maker BOOLEAN NOT NULL
-    )
-    """)
-
-    # Ensure the UNIQUE constraint is set for symbol, interval, and open_time
-    cursor.execute("""
-    CREATE UNIQUE INDEX IF NOT EXISTS idx_klines_symbol_interval_open_time 
-    ON klines (symbol, interval, open_time)
-    """)
+# The SQLite store_* functions queue their batch on the per-database writer
+# thread (see sqlite_writer.py) and return a Future for the inserted row count;
+# call .result() to wait for the commit.
 
+def store_klines_to_db(klines_data, interval, symbol, dbname="klines_data.db"):
     # Convert the klines data by adding interval and symbol information
     klines_with_interval_and_symbol = [
         (
@@ -866,61 +853,130 @@ def store_klines_to_db(klines_data, interval, symbol, dbname="klines_data.db"):
         for kline in klines_data
     ]
 
-    # Insert klines data into the table
-    cursor.executemany("""
-    INSERT OR REPLACE INTO klines (symbol, interval, open_time, open, high, low, close, volume, close_time, 
+    # Upsert so a re-fetched candle updates in place and keeps its id
+    return get_sqlite_writer(dbname).executemany("""
+    INSERT INTO klines (symbol, interval, open_time, open, high, low, close, volume, close_time, 
                        quote_asset_volume, trades, taker_buy_base_asset_volume, 
                        taker_buy_quote_asset_volume, ignore_column)
     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (symbol, interval, open_time) DO UPDATE SET
+        open = excluded.open,
+        high = excluded.high,
+        low = excluded.low,
+        close = excluded.close,
+        volume = excluded.volume,
+        close_time = excluded.close_time,
+        quote_asset_volume = excluded.quote_asset_volume,
+        trades = excluded.trades,
+        taker_buy_base_asset_volume = excluded.taker_buy_base_asset_volume,
+        taker_buy_quote_asset_volume = excluded.taker_buy_quote_asset_volume,
+        ignore_column = excluded.ignore_column
     """, klines_with_interval_and_symbol)
 
-    # Commit the changes and close the connection
-    conn.commit()
-    conn.close()
-
 
 def store_aggregated_trades_to_db(aggregated_trades_data, symbol, dbname="klines_data.db"):
-    conn = sqlite3.connect(dbname)
-    cursor = conn.cursor()
-    
-    # Ensure the UNIQUE constraint is set for symbol and transact_time
-    cursor.execute("""
-    CREATE UNIQUE INDEX IF NOT EXISTS idx_symbol_transact_time 
-    ON aggregated_trades (symbol, transact_time)
-    """)
-
     # Convert the aggregated_trades data by adding symbol information
     aggregated_trades_with_symbol = [
         (
-            float(trade[1]),  # agg_trade_id
-            trade[0],     # symbol
+            int(trade[1]),    # agg_trade_id
+            symbol,           # symbol
             float(trade[2]),  # price
             float(trade[3]),  # quantity
-            trade[4],     # first_trade_id
-            trade[5],     # last_trade_id
-            trade[6],     # transact_time
-            int(trade[7])      # is_buyer_maker (ensure it's an integer)
+            int(trade[4]),    # first_trade_id
+            int(trade[5]),    # last_trade_id
+            int(trade[6]),    # transact_time
+            int(trade[7])     # is_buyer_maker (ensure it's an integer)
         ) 
         for trade in aggregated_trades_data
     ]
+    return insert_aggregated_trades_to_db(aggregated_trades_with_symbol, dbname)
 
 
+def insert_aggregated_trades_to_db(rows, dbname="klines_data.db"):
+    """Queue rows already in table column order and with native types."""
+    # Same semantics as the MySQL INSERT IGNORE: replays of a batch are no-ops
+    return get_sqlite_writer(dbname).executemany("""
+    INSERT OR IGNORE INTO aggregated_trades 
+    (agg_trade_id, symbol, price, quantity, first_trade_id, 
+     last_trade_id, transact_time, is_buyer_maker)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, rows)
 
-    for trade in aggregated_trades_with_symbol[:10]:  # printing the first 10 for inspection
-        print(trade)
 
+def insert_rows_to_db(table, columns, rows, dbname="klines_data.db"):
+    """Queue rows in `columns` order for `table`; rows hitting its primary / unique key are ignored."""
+    return get_sqlite_writer(dbname).executemany(f"""
+    INSERT OR IGNORE INTO {table}
+    ({', '.join(columns)})
+    VALUES ({', '.join(['?'] * len(columns))})
+    """, rows)
 
-    # Insert or replace aggregated_trades data into the table
-    cursor.executemany("""
-    INSERT OR REPLACE INTO aggregated_trades 
-    (agg_trade_id, symbol, price, quantity, first_trade_id, 
-     last_trade_id, transact_time, is_buyer_maker)
+
+def store_bookticker_to_db(bookticker_data, symbol, dbname="klines_data.db"):
+    bookticker_with_symbol = [
+        (
+            int(data[0]),     # update_id
+            symbol,           # symbol
+            float(data[1]),   # best_bid_price
+            float(data[2]),   # best_bid_qty
+            float(data[3]),   # best_ask_price
+            float(data[4]),   # best_ask_qty
+            int(data[5]),     # transaction_time
+            int(data[6])      # event_time
+        )
+        for data in bookticker_data
+    ]
+
+    return get_sqlite_writer(dbname).executemany("""
+    INSERT OR IGNORE INTO bookticker
+    (update_id, symbol, best_bid_price, best_bid_qty, best_ask_price,
+     best_ask_qty, transaction_time, event_time)
     VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    """, aggregated_trades_with_symbol)
+    """, bookticker_with_symbol)
+
 
-    # Commit the changes and close the connection
-    conn.commit()
-    conn.close()
+def bulk_load_aggregated_trades_to_db(file_name, symbol, dbname="klines_data.db"):
+    """
+    SQLite counterpart of LOAD DATA: csv.reader rows go untouched into a typed
+    TEMP staging table, then a single INSERT ... SELECT adds the symbol and
+    converts is_buyer_maker inside SQLite. Runs as one job on the writer
+    thread, so it shares the database with live writers without lock errors.
+
+    Returns the number of rows inserted.
+    """
+    def load(conn):
+        cursor = conn.cursor()
+        cursor.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS agg_trades_staging (
+            agg_trade_id INTEGER,
+            price REAL,
+            quantity REAL,
+            first_trade_id INTEGER,
+            last_trade_id INTEGER,
+            transact_time INTEGER,
+            is_buyer_maker TEXT
+        )
+        """)
+        with open(file_name, 'r', newline='') as csv_file:
+            reader = csv.reader(csv_file)
+            first_row = next(reader, None)
+            if first_row and first_row[0].isdigit():
+                cursor.execute("INSERT INTO agg_trades_staging VALUES (?, ?, ?, ?, ?, ?, ?)", first_row)
+            cursor.executemany("INSERT INTO agg_trades_staging VALUES (?, ?, ?, ?, ?, ?, ?)", reader)
+        cursor.execute("""
+        INSERT OR IGNORE INTO aggregated_trades
+        (agg_trade_id, symbol, price, quantity, first_trade_id,
+         last_trade_id, transact_time, is_buyer_maker)
+        SELECT agg_trade_id, ?, price, quantity, first_trade_id,
+               last_trade_id, transact_time, lower(trim(is_buyer_maker)) = 'true'
+        FROM agg_trades_staging
+        """, (symbol,))
+        rows = cursor.rowcount
+        cursor.execute("DELETE FROM agg_trades_staging")
+        cursor.close()
+        return rows
+
+    return get_sqlite_writer(dbname).submit(load).result()
 
 
 # def store_aggregated_trades_to_db(aggregated_trades_data, symbol, dbname="klines_data.db"):
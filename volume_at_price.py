@@ -0,0 +1,185 @@
+import os
+import sys
+import threading
+import time
+from dotenv import load_dotenv
+from time_ranges import day_bounds_ms, iter_days, ms_to_date, to_date
+
+load_dotenv()
+
+# Materialized volume profile (table volume_at_price).
+#
+# One row per (symbol, day, bin_size, bin_start) with taker buy / sell volume
+# and the number of trades whose price fell in [bin_start, bin_start + bin_size)
+# on that UTC day, for every bin size in `vap_bin_sizes`. With
+# `vap_exact_prices` the day also gets rows of bin_size 0 whose bin_start is
+# the traded price itself, so the point of control is read from here exactly.
+#
+# A day is always rebuilt as a whole from the raw aggregated_trades rows
+# (delete + insert in one transaction), so it is idempotent and stays right
+# no matter in which order concurrent writers commit. Days without raw rows
+# (e.g. compacted by compaction.py) are left untouched. Archive loads rebuild
+# their day straight away; live writes only mark the day dirty and it is
+# rebuilt at most every `vap_refresh_secs` (and once more on close), which
+# bounds the cost of a full-day scan under a continuous stream.
+#
+# Settings (.env): volume_at_price (default 1), vap_bin_sizes (default 1,5),
+# vap_exact_prices (default 1), vap_refresh_secs (default 60). Backfill history with:
+#
+#   python volume_at_price.py SYMBOL START_DATE [END_DATE]
+
+VAP_ENABLED = os.getenv("volume_at_price", "1") == "1"
+BIN_SIZES = [float(b) for b in os.getenv("vap_bin_sizes", "1,5").split(",") if b.strip()]
+EXACT_PRICES = os.getenv("vap_exact_prices", "1") == "1"
+REFRESH_SECS = float(os.getenv("vap_refresh_secs", 60))
+
+# bin_size of the exact-price rows
+EXACT_BIN = 0.0
+MATERIALIZED_BIN_SIZES = BIN_SIZES + ([EXACT_BIN] if EXACT_PRICES else [])
+
+# {p} is the driver's placeholder, {floor} the bin expression (SQLite has no
+# FLOOR() without the math extension; prices are positive, so CAST truncates
+# the same way).
+_REBUILD_INSERT = """
+INSERT INTO volume_at_price
+(symbol, day, bin_size, bin_start, buy_volume, sell_volume, trades)
+SELECT symbol, {p}, {p}, bin * {p},
+       SUM(CASE WHEN is_buyer_maker THEN 0 ELSE quantity END),
+       SUM(CASE WHEN is_buyer_maker THEN quantity ELSE 0 END),
+       SUM(last_trade_id - first_trade_id + 1)
+FROM (
+    SELECT symbol, {floor} AS bin, quantity, is_buyer_maker, first_trade_id, last_trade_id
+    FROM aggregated_trades
+    WHERE symbol = {p} AND transact_time >= {p} AND transact_time < {p}
+) binned_trades
+GROUP BY symbol, bin
+"""
+
+# Exact prices: one row per traded price, bin_size 0
+_EXACT_INSERT = """
+INSERT INTO volume_at_price
+(symbol, day, bin_size, bin_start, buy_volume, sell_volume, trades)
+SELECT symbol, {p}, {p}, price,
+       SUM(CASE WHEN is_buyer_maker THEN 0 ELSE quantity END),
+       SUM(CASE WHEN is_buyer_maker THEN quantity ELSE 0 END),
+       SUM(last_trade_id - first_trade_id + 1)
+FROM aggregated_trades
+WHERE symbol = {p} AND transact_time >= {p} AND transact_time < {p}
+GROUP BY symbol, price
+"""
+
+MYSQL_HAS_TRADES_QUERY = """
+SELECT 1 FROM aggregated_trades WHERE symbol = %s AND transact_time >= %s AND transact_time < %s LIMIT 1
+"""
+MYSQL_DELETE_QUERY = "DELETE FROM volume_at_price WHERE symbol = %s AND day = %s AND bin_size = %s"
+MYSQL_REBUILD_QUERY = _REBUILD_INSERT.format(p="%s", floor="FLOOR(price / %s)")
+MYSQL_EXACT_QUERY = _EXACT_INSERT.format(p="%s")
+
+SQLITE_HAS_TRADES_QUERY = MYSQL_HAS_TRADES_QUERY.replace("%s", "?")
+SQLITE_DELETE_QUERY = "DELETE FROM volume_at_price WHERE symbol = ? AND day = ? AND bin_size = ?"
+SQLITE_REBUILD_QUERY = _REBUILD_INSERT.format(p="?", floor="CAST(price / ? AS INTEGER)")
+SQLITE_EXACT_QUERY = _EXACT_INSERT.format(p="?")
+
+
+def days_in_range(start_ms, end_ms):
+    """UTC days overlapping [start_ms, end_ms)."""
+    return list(iter_days(ms_to_date(start_ms), ms_to_date(end_ms - 1)))
+
+
+def _rebuild(cursor, symbol, day, bin_size, rebuild_query, exact_query):
+    start_ms, end_ms = day_bounds_ms(day)
+    if bin_size == EXACT_BIN:
+        cursor.execute(exact_query, (to_date(day).isoformat(), bin_size, symbol, start_ms, end_ms))
+    else:
+        cursor.execute(rebuild_query, (to_date(day).isoformat(), bin_size, bin_size, bin_size, symbol,
+                                       start_ms, end_ms))
+
+
+def rebuild_mysql(symbol, day, bin_sizes=MATERIALIZED_BIN_SIZES):
+    """Rebuild one symbol's MySQL volume profile for one UTC day."""
+    from mysql_connector import create_connection
+
+    connection = create_connection()
+    if not connection:
+        return
+    cursor = connection.cursor()
+    connection.start_transaction()
+    try:
+        cursor.execute(MYSQL_HAS_TRADES_QUERY, (symbol, *day_bounds_ms(day)))
+        if not cursor.fetchall():
+            connection.rollback()
+            return
+        for bin_size in bin_sizes:
+            cursor.execute(MYSQL_DELETE_QUERY, (symbol, to_date(day).isoformat(), bin_size))
+            _rebuild(cursor, symbol, day, bin_size, MYSQL_REBUILD_QUERY, MYSQL_EXACT_QUERY)
+        connection.commit()
+    except:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def rebuild_sqlite(conn, symbol, day, bin_sizes=MATERIALIZED_BIN_SIZES):
+    """
+    Rebuild one symbol's SQLite volume profile for one UTC day. Meant to run
+    as a job on the database's writer thread.
+    """
+    cursor = conn.cursor()
+    if cursor.execute(SQLITE_HAS_TRADES_QUERY, (symbol, *day_bounds_ms(day))).fetchone() is None:
+        cursor.close()
+        return
+    for bin_size in bin_sizes:
+        cursor.execute(SQLITE_DELETE_QUERY, (symbol, to_date(day).isoformat(), bin_size))
+        _rebuild(cursor, symbol, day, bin_size, SQLITE_REBUILD_QUERY, SQLITE_EXACT_QUERY)
+    cursor.close()
+
+
+class RefreshThrottle:
+    """
+    Dirty (symbol, day) set for live writes. due() hands out the pairs whose
+    last rebuild is at least `min_interval` seconds old (all of them with
+    force=True) and clears them. Thread safe: write workers share one instance.
+    """
+
+    def __init__(self, min_interval=REFRESH_SECS):
+        self.min_interval = min_interval
+        self._dirty = set()
+        self._last_rebuild = {}
+        self._lock = threading.Lock()
+
+    def mark(self, symbol, days):
+        with self._lock:
+            self._dirty.update((symbol, day) for day in days)
+
+    def due(self, force=False):
+        now = time.monotonic()
+        with self._lock:
+            ready = [key for key in self._dirty
+                     if force or now - self._last_rebuild.get(key, float("-inf")) >= self.min_interval]
+            for key in ready:
+                self._dirty.discard(key)
+                self._last_rebuild[key] = now
+            # Days that are long finished won't be written again
+            cutoff = now - max(self.min_interval, 1) * 10
+            for key in [k for k, t in self._last_rebuild.items() if t < cutoff and k not in self._dirty]:
+                del self._last_rebuild[key]
+        return sorted(ready)
+
+
+if __name__ == "__main__":
+    from schema import bootstrap_schema
+    from storage import get_storage
+
+    if len(sys.argv) < 3:
+        print("usage: python volume_at_price.py SYMBOL START_DATE [END_DATE]")
+        sys.exit(1)
+    bootstrap_schema()
+    symbol = sys.argv[1].upper()
+    end_day = sys.argv[3] if len(sys.argv) > 3 else sys.argv[2]
+    storage = get_storage()
+    for day in iter_days(sys.argv[2], end_day):
+        storage.refresh_volume_at_price(symbol, day)
+        print(f"Rebuilt volume at price for {symbol} {day}")
+    storage.close()
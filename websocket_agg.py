@@ -4,9 +4,17 @@ import asyncio
 from typing import List
 from binance import AsyncClient, BinanceSocketManager
 from dotenv import load_dotenv
-from utils import store_aggregated_trades_to_db
 from datetime import datetime
-from mysql_connector import store_aggregated_trades_to_mysql
+from schema import bootstrap_schema
+from storage import get_storage
+from write_queue import AsyncWriteQueue
+from write_behind import WriteBehindBuffer
+from gap_fill import AggTradeGapFiller, agg_trade_row
+
+# Seconds to wait before reopening a dropped socket (`reconnect_secs`), doubled
+# per failed attempt up to `reconnect_max_secs` (.env)
+RECONNECT_SECS = float(os.getenv("reconnect_secs", 1))
+RECONNECT_MAX_SECS = float(os.getenv("reconnect_max_secs", 60))
 
 # Define thresholds
 iceberg_threshold = 100  # Example: Trades below this size might be iceberg orders
@@ -18,7 +26,7 @@ def detect_orders(trade_data):
         return  # Not enough data to detect orders
     print(f"Trade data: {trade_data[0]}")
     # Calculate total trade volume and average trade size
-    total_volume = sum(quantity for _, quantity, _ in trade_data)
+    total_volume = sum(trade[3] for trade in trade_data)
     avg_trade_size = total_volume / len(trade_data)
     
     # Check for potential iceberg orders
@@ -34,18 +42,24 @@ def detect_orders(trade_data):
 
 
 def process_message(msg: dict):
-    # Extract data in the correct order
-    data = (
-        # msg['data']['s'],           # symbol
-        # msg['data']['a'],           # agg_trade_id
-        float(msg['data']['p']),    # price
-        float(msg['data']['q']),    # quantity
-        # msg['data']['f'],           # first_trade_id
-        # msg['data']['l'],           # last_trade_id
-        msg['data']['T'],           # transact_time
-        # int(msg['data']['m'])       # is_buyer_maker, convert boolean to integer (0 or 1)
-    )
-    return data
+    # (symbol, agg_trade_id, price, quantity, first_trade_id, last_trade_id, transact_time, is_buyer_maker)
+    return agg_trade_row(msg['data']['s'], msg['data'])
+
+
+async def receive_trades(socket, gaps):
+    """
+    Receive coroutine: parse messages and pass them through the gap filler
+    to the per-symbol write-behind buffer. It never waits on the database,
+    so the socket buffer keeps draining. Returns when the socket reports an
+    error (python-binance gives up reconnecting on its own).
+    """
+    while True:
+        res = await socket.recv()
+        # print(res)
+        if res.get('e') == 'error':
+            print(f"Socket error: {res.get('m')}")
+            return
+        await gaps.on_trade(process_message(res))
 
 
 async def main(symbols: List[str], market: str):
@@ -55,53 +69,51 @@ async def main(symbols: List[str], market: str):
     bsm = BinanceSocketManager(client)
     agg_symbol = [f"{s}@aggTrade" for s in symbols]
 
-    aggregated_trades = []
-
-    if market == "future":
-        async with bsm.futures_multiplex_socket(agg_symbol) as socket:
-            while True:
-                res = await socket.recv()
-                # print(res)
-                trade_data = process_message(res)
-                # print(trade_data)
-                aggregated_trades.append(trade_data)
-                
-                # You can set a condition to store data after accumulating, say, 100 trades.
-                if len(aggregated_trades) > 10:
-                    if os.getenv('storage') == 'sqlite3':
-                        store_aggregated_trades_to_db(aggregated_trades,trade_data[0])
-                        aggregated_trades = []
-
-                    if os.getenv('storage') == 'mysql':
-                        store_aggregated_trades_to_mysql(aggregated_trades,trade_data[0])
-                        aggregated_trades = []
-                    else:
-                        print("save to csv")
-                        # print(aggregated_trades)
-                        detect_orders(aggregated_trades)
-    else:
-        async with bsm.multiplex_socket(symbols) as socket:
-            while True:
-                res = await socket.recv()
-                trade_data = process_message(res)
-                print(trade_data)
-                aggregated_trades.append(trade_data)
-                
-                # You can set a condition to store data after accumulating, say, 100 trades.
-                if len(aggregated_trades) > 10:
-                    if os.getenv('storage') == 'sqlite3':
-                        store_aggregated_trades_to_db(aggregated_trades,trade_data[0])
-                        aggregated_trades = []
-
-                    if os.getenv('storage') == 'mysql':
-                        store_aggregated_trades_to_mysql(aggregated_trades,trade_data[0])
-                        aggregated_trades = []
-                    else:
-                        print("save to csv")
+    storage = get_storage()
+    # Storage writes run on worker threads behind a bounded queue (write_queue.py)
+    write_queue = await AsyncWriteQueue(
+        lambda symbol, rows: storage.write_agg_trades(rows, symbol), name="aggTrades").start()
+
+    async def flush(symbol, rows, on_done):
+        if storage.name == 'csv':
+            detect_orders(rows)
+        await write_queue.put(symbol, rows, on_done)
+
+    # Batches per symbol, flushed at flush_rows trades or flush_ms (write_behind.py)
+    buffer = WriteBehindBuffer(flush, name="aggTrades buffer").start()
+    # Trades lost to a reconnect are backfilled over REST before the live ones (gap_fill.py)
+    gaps = AggTradeGapFiller(client, market, buffer.add)
+
+    delay = RECONNECT_SECS
+    try:
+        while True:
+            if market == "future":
+                socket_manager = bsm.futures_multiplex_socket(agg_symbol)
+            else:
+                socket_manager = bsm.multiplex_socket(agg_symbol)
+            try:
+                async with socket_manager as socket:
+                    delay = RECONNECT_SECS
+                    await receive_trades(socket, gaps)
+            except (OSError, asyncio.TimeoutError) as e:
+                print(f"Socket dropped: {e}")
+            gaps.on_reconnect()
+            print(f"Reconnecting in {delay:.0f}s... [aggTrades gaps] {gaps.format_stats()}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_SECS)
+    finally:
+        await gaps.close()
+        print(f"[aggTrades gaps] {gaps.format_stats()}")
+        await buffer.close()
+        print(f"[aggTrades buffer] {buffer.format_stats()}")
+        await write_queue.close()
+        print(f"[aggTrades] {write_queue.format_stats()}")
+        await client.close_connection()
 
 
 if __name__ == "__main__":
     load_dotenv()
+    bootstrap_schema()
 
     symbol_list = [s.lower().strip() for s in os.getenv("symbols").split(",")]
     market_type = os.getenv("market").lower().strip()
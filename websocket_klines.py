@@ -1,19 +1,48 @@
 import os
 import pathlib
 import asyncio
+import time
 from typing import List
 from binance import AsyncClient, BinanceSocketManager
 from dotenv import load_dotenv
 from collections import defaultdict
 import pandas as pd
-from utils import store_klines_to_db
 from datetime import datetime
-from mysql_connector import store_klines_to_mysql
+from schema import bootstrap_schema
+from storage import get_storage
+from time_ranges import interval_to_ms
+from write_queue import AsyncWriteQueue
 # from vp import calculate_vp
 import pandas as pd
 from utils import calculate_advanced_volume_profile as cavp
 # from open_ai import *
 
+# `kline_stream=1` keeps the klines current from the `<symbol>@kline_<interval>`
+# multiplex streams instead of polling REST: the history is seeded over REST
+# once per (symbol, interval) (`kline_seed_concurrency` requests in flight on
+# one shared client), then every in-progress and closed candle update is
+# upserted. Updates are coalesced to the latest per candle and flushed every
+# `kline_flush_ms` through the write queue (write_queue.py). Streams are
+# spread over sockets of at most `kline_streams_per_socket` (Binance caps
+# streams per connection); a dropped socket is reopened and its streams
+# re-seeded over REST from their last seen candle.
+#
+# CSV and Parquet append instead of upserting, so with those backends only
+# closed candles are written (k['x'] on the stream, close time passed for the
+# REST seeds), each once: the in-progress candle lands when it closes.
+#
+# Settings (.env): kline_stream (default 0), market (default future),
+# kline_streams_per_socket (default 200), kline_seed_concurrency (default 4),
+# kline_flush_ms (default 1000), reconnect_secs (default 1),
+# reconnect_max_secs (default 60).
+
+KLINE_STREAM = os.getenv("kline_stream") == "1"
+STREAMS_PER_SOCKET = int(os.getenv("kline_streams_per_socket", 200))
+SEED_CONCURRENCY = int(os.getenv("kline_seed_concurrency", 4))
+FLUSH_MS = float(os.getenv("kline_flush_ms", 1000))
+RECONNECT_SECS = float(os.getenv("reconnect_secs", 1))
+RECONNECT_MAX_SECS = float(os.getenv("reconnect_max_secs", 60))
+
 def calculate_volume_profile(df):
     # Convert the epoch timestamp to human-readable datetime format
     POCs, VAHs, VALs, HVNs, LVNs, Volumes = [], [], [], [], [], []
@@ -146,20 +175,25 @@ def print_in_chunks(df, chunk_size=50):
 #     await client.close_connection()
 #     return klines
 
-async def fetch_historical_data(symbol: str, interval: str, desired_limit: int = 1000):
-    client = await AsyncClient.create()
+async def fetch_historical_data(symbol: str, interval: str, desired_limit: int = 1000, client=None,
+                                market: str = "future"):
+    """REST klines; uses `client` when given, otherwise opens and closes its own."""
+    own_client = client is None
+    if own_client:
+        client = await AsyncClient.create()
+    fetch_klines = client.futures_klines if market == "future" else client.get_klines
     max_api_limit = 1000  # This is the typical limit for many endpoints
     klines = []
 
     if desired_limit <= max_api_limit:
-        klines = await client.futures_klines(symbol=symbol, interval=interval, limit=desired_limit)
+        klines = await fetch_klines(symbol=symbol, interval=interval, limit=desired_limit)
     else:
         loops_required = int(desired_limit / max_api_limit)
         remaining_data = desired_limit
 
         for _ in range(loops_required):
             current_limit = min(max_api_limit, remaining_data)  # Fetch only the remaining data if less than max_api_limit
-            current_klines = await client.futures_klines(symbol=symbol, interval=interval, limit=current_limit)
+            current_klines = await fetch_klines(symbol=symbol, interval=interval, limit=current_limit)
             klines.extend(current_klines)
             
             if len(current_klines) < current_limit:  # This means we've fetched all available data
@@ -168,30 +202,193 @@ async def fetch_historical_data(symbol: str, interval: str, desired_limit: int =
             remaining_data -= len(current_klines)
             await asyncio.sleep(1)  # Add a delay to avoid hitting rate limits
     
-    await client.close_connection()
+    if own_client:
+        await client.close_connection()
     return klines
 
 
+def kline_row(k: dict):
+    # Stream kline payload in the REST kline list layout
+    return [k['t'], k['o'], k['h'], k['l'], k['c'], k['v'], k['T'], k['q'], k['n'], k['V'], k['Q'], k['B']]
+
+
+class KlineStream:
+    """
+    Streaming kline ingestion for every (symbol, interval) pair on one
+    AsyncClient. run() seeds, streams and flushes until cancelled; close()
+    flushes what is left.
+    """
+
+    def __init__(self, client, symbols, intervals, market="future", streams_per_socket=STREAMS_PER_SOCKET,
+                 seed_concurrency=SEED_CONCURRENCY, flush_ms=FLUSH_MS):
+        self.client = client
+        self.market = market
+        self.pairs = [(symbol, interval) for interval in intervals for symbol in symbols]
+        self.streams_per_socket = streams_per_socket
+        self.flush_ms = flush_ms
+        self.storage = get_storage()
+        self.write_queue = None
+        self._seeds = asyncio.Semaphore(seed_concurrency)
+        # (symbol, interval) -> {open_time: latest kline}
+        self._pending = {}
+        self._last_open = {}
+        # Append-only backends: (symbol, interval) -> open time of the last candle written
+        self.closed_only = self.storage.name in ("csv", "parquet")
+        self._last_written = {}
+        self.updates = 0
+        self.closed = 0
+        self.written = 0
+        self.reconnects = 0
+
+    async def _write(self, symbol, interval, klines):
+        if self.closed_only:
+            klines = self._unwritten(symbol, interval, klines)
+        if klines:
+            self.written += len(klines)
+            await self.write_queue.put((symbol, interval), klines)
+
+    def _unwritten(self, symbol, interval, klines):
+        # Re-seeds overlap candles already appended
+        last = self._last_written.get((symbol, interval), -1)
+        klines = [kline for kline in klines if kline[0] > last]
+        if klines:
+            self._last_written[(symbol, interval)] = klines[-1][0]
+        return klines
+
+    async def seed(self, symbol, interval, limit):
+        async with self._seeds:
+            klines = await fetch_historical_data(symbol, interval, limit, client=self.client, market=self.market)
+        if klines and self.closed_only:
+            # The last REST candle is usually still in progress
+            now = int(time.time() * 1000)
+            klines = [kline for kline in klines if kline[6] < now]
+        if klines:
+            self._last_open[(symbol, interval)] = max(self._last_open.get((symbol, interval), 0), klines[-1][0])
+        await self._write(symbol, interval, klines)
+
+    def _catch_up_limit(self, symbol, interval):
+        # Candles since the last one seen, plus the one it was still building
+        last_open = self._last_open.get((symbol, interval))
+        if last_open is None:
+            return get_limit_from_interval(interval)
+        try:
+            missed = (int(time.time() * 1000) - last_open) // interval_to_ms(interval)
+        except ValueError:
+            missed = 1
+        return int(min(missed + 2, 1000))
+
+    def on_message(self, msg: dict):
+        k = msg['data']['k']
+        key = (k['s'], k['i'])
+        if k['x'] or not self.closed_only:
+            self._pending.setdefault(key, {})[k['t']] = kline_row(k)
+        self._last_open[key] = max(self._last_open.get(key, 0), k['t'])
+        self.updates += 1
+        if k['x']:
+            self.closed += 1
+
+    async def flush(self):
+        pending, self._pending = self._pending, {}
+        for (symbol, interval), klines in pending.items():
+            await self._write(symbol, interval, [klines[t] for t in sorted(klines)])
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_ms / 1000)
+            await self.flush()
+
+    async def _stream(self, pairs):
+        bsm = BinanceSocketManager(self.client)
+        streams = [f"{symbol.lower()}@kline_{interval}" for symbol, interval in pairs]
+        delay = RECONNECT_SECS
+        while True:
+            if self.market == "future":
+                socket_manager = bsm.futures_multiplex_socket(streams)
+            else:
+                socket_manager = bsm.multiplex_socket(streams)
+            try:
+                async with socket_manager as socket:
+                    delay = RECONNECT_SECS
+                    while True:
+                        msg = await socket.recv()
+                        if msg.get('e') == 'error':
+                            print(f"Socket error: {msg.get('m')}")
+                            break
+                        self.on_message(msg)
+            except (OSError, asyncio.TimeoutError) as e:
+                print(f"Socket dropped: {e}")
+            self.reconnects += 1
+            print(f"Reconnecting {len(streams)} kline streams in {delay:.0f}s...")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_SECS)
+            # Candles that closed while disconnected come from REST
+            await asyncio.gather(*(self.seed(symbol, interval, self._catch_up_limit(symbol, interval))
+                                   for symbol, interval in pairs))
+
+    def format_stats(self):
+        return (f"{len(self.pairs)} streams | updates {self.updates} (closed {self.closed}) | "
+                f"klines written {self.written} | reconnects {self.reconnects}")
+
+    async def run(self):
+        # One writer, so a candle's later flush never lands before an earlier one
+        self.write_queue = await AsyncWriteQueue(
+            lambda key, rows: self.storage.write_klines(rows, key[1], key[0]), name="klines", workers=1).start()
+        print(f"Seeding {len(self.pairs)} (symbol, interval) pairs over REST...")
+        await asyncio.gather(*(self.seed(symbol, interval, get_limit_from_interval(interval))
+                               for symbol, interval in self.pairs))
+        groups = [self.pairs[i:i + self.streams_per_socket]
+                  for i in range(0, len(self.pairs), self.streams_per_socket)]
+        print(f"Streaming {len(self.pairs)} kline streams on {len(groups)} sockets")
+        await asyncio.gather(self._flush_loop(), *(self._stream(group) for group in groups))
+
+    async def close(self):
+        await self.flush()
+        print(f"[klines stream] {self.format_stats()}")
+        if self.write_queue is not None:
+            await self.write_queue.close()
+            print(f"[klines] {self.write_queue.format_stats()}")
+
+
+async def stream_klines(symbols: List[str], intervals_list: List[str], market: str = "future"):
+    client = await AsyncClient.create()
+    stream = KlineStream(client, symbols, intervals_list, market)
+    try:
+        await stream.run()
+    finally:
+        await stream.close()
+        await client.close_connection()
+
 
 async def main(symbols: List[str],intervals_list: List[str]):
     print(f'Started Collecting Tick Data of {symbols}...')
+    if KLINE_STREAM:
+        await stream_klines(symbols, intervals_list, os.getenv("market", "future").lower().strip())
+        return
+
+    # One client for every request instead of one per (interval, symbol)
+    client = await AsyncClient.create()
+    try:
+        await fetch_all(client, symbols, intervals_list)
+    finally:
+        await client.close_connection()
+
+
+async def fetch_all(client, symbols: List[str], intervals_list: List[str]):
     for interval in intervals_list:
         limit = get_limit_from_interval(interval)
 
         # Fetch historical data (M=month,w=week,d=day,h=hour,m=minute)
         for symbol in symbols:
             print(f"Fetching historical data for {symbol} with interval {interval} and limit {limit}")
-            klines = await fetch_historical_data(symbol, interval=interval, desired_limit=limit)
+            klines = await fetch_historical_data(symbol, interval=interval, desired_limit=limit, client=client)
 
             # Create a DataFrame
             columns = ["Open_Time", "Open", "High", "Low", "Close", "Volume", "Close_Time", "Quote_Asset_Volume", "Number_of_Trades", "Taker_Buy_Base_Asset_Volume", "Taker_Buy_Quote_Asset_Volume", "Ignore"]
             df = pd.DataFrame(klines, columns=columns)
             df[['Open', 'High', 'Low', 'Close', 'Volume']] = df[['Open', 'High', 'Low', 'Close', 'Volume']].apply(pd.to_numeric)
-            if os.getenv('storage') == 'sqlite3':
-                store_klines_to_db(klines,interval,symbol)
-            if os.getenv('storage') == 'mysql':
-                store_klines_to_mysql(klines,interval,symbol)
-            else:
+            storage = get_storage()
+            storage.write_klines(klines,interval,symbol)
+            if storage.name == 'csv':
                 volume_profile = calculate_volume_profile(df)
 
                 # Renaming columns for clarity
@@ -207,6 +404,7 @@ async def main(symbols: List[str],intervals_list: List[str]):
 
 if __name__ == "__main__":
     load_dotenv()
+    bootstrap_schema()
     # logger.remove()
 
     # Load symbol from .env
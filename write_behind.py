@@ -0,0 +1,115 @@
+import asyncio
+import os
+import time
+from dotenv import load_dotenv
+from metrics import Histogram, LATENCY_MS_BUCKETS, BATCH_SIZE_BUCKETS
+
+load_dotenv()
+
+# Per-symbol write-behind buffer for live ticks.
+#
+# Rows are buffered per key (symbol) and flushed on whichever comes first:
+# the key has `flush_rows` rows, or its oldest row is `flush_ms` old. Bigger
+# values mean fewer, larger writes; smaller values mean fresher data. The
+# histograms show where a given setting lands:
+#
+#   staleness   age of the oldest row when its batch was flushed (ms)
+#   flush       time from the flush until the batch was written (ms); batches
+#               dropped, spilled or failed by the write queue are not counted
+#   batch size  rows per flush
+#
+# Settings (.env): flush_rows (default 500), flush_ms (default 1000),
+# write_behind_report_secs (default 30, 0 disables the periodic report).
+
+FLUSH_ROWS = int(os.getenv("flush_rows", 500))
+FLUSH_MS = float(os.getenv("flush_ms", 1000))
+REPORT_SECS = float(os.getenv("write_behind_report_secs", 30))
+
+
+class WriteBehindBuffer:
+    """
+    flush_fn(key, rows, on_done) is an async callable, e.g. AsyncWriteQueue.put,
+    that calls on_done(written) once the batch is stored (or given up on).
+    Call start() once the event loop is running and close() on shutdown.
+    """
+
+    def __init__(self, flush_fn, name="buffer", max_rows=FLUSH_ROWS, max_delay_ms=FLUSH_MS,
+                 report_secs=REPORT_SECS):
+        self.flush_fn = flush_fn
+        self.name = name
+        self.max_rows = max_rows
+        self.max_delay_ms = max_delay_ms
+        self.report_secs = report_secs
+        self._rows = {}
+        self._first_at = {}
+        self._tasks = []
+
+        self.staleness_ms = Histogram(LATENCY_MS_BUCKETS)
+        self.flush_ms = Histogram(LATENCY_MS_BUCKETS)
+        self.batch_size = Histogram(BATCH_SIZE_BUCKETS)
+        self.flushes_by_size = 0
+        self.flushes_by_time = 0
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._flush_expired())]
+        if self.report_secs:
+            self._tasks.append(asyncio.create_task(self._report()))
+        return self
+
+    async def add(self, key, row):
+        rows = self._rows.get(key)
+        if rows is None:
+            rows = self._rows[key] = []
+            self._first_at[key] = time.monotonic()
+        rows.append(row)
+        if len(rows) >= self.max_rows:
+            self.flushes_by_size += 1
+            await self.flush(key)
+
+    async def flush(self, key):
+        rows = self._rows.pop(key, None)
+        first_at = self._first_at.pop(key, None)
+        if not rows:
+            return
+        started = time.monotonic()
+        self.staleness_ms.observe((started - first_at) * 1000)
+        self.batch_size.observe(len(rows))
+        await self.flush_fn(key, rows, lambda written: self._written(started, written))
+
+    def _written(self, started, written):
+        if written:
+            self.flush_ms.observe((time.monotonic() - started) * 1000)
+
+    async def flush_all(self):
+        for key in list(self._rows):
+            await self.flush(key)
+
+    async def _flush_expired(self):
+        # Check a few times per flush interval so staleness stays close to max_delay_ms
+        interval = max(self.max_delay_ms / 4, 10) / 1000
+        while True:
+            await asyncio.sleep(interval)
+            deadline = time.monotonic() - self.max_delay_ms / 1000
+            for key in [k for k, first_at in self._first_at.items() if first_at <= deadline]:
+                self.flushes_by_time += 1
+                await self.flush(key)
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.report_secs)
+            print(f"[{self.name}] {self.format_stats()}")
+
+    def buffered_rows(self):
+        return sum(len(rows) for rows in self._rows.values())
+
+    def format_stats(self):
+        return (f"buffered {self.buffered_rows()} rows in {len(self._rows)} symbols | "
+                f"flushes size/time {self.flushes_by_size}/{self.flushes_by_time} | "
+                f"batch size {self.batch_size.format()} | "
+                f"staleness {self.staleness_ms.format('ms')} | flush {self.flush_ms.format('ms')}")
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.flush_all()
@@ -0,0 +1,209 @@
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Bounded queue between a websocket receive coroutine and the storage writers.
+#
+# The receive loop only enqueues batches; worker coroutines hand each batch to
+# a thread pool, so a slow commit never stops the socket from being read. When
+# the queue is full the configured policy decides what happens:
+#
+#   block        the receive loop waits for space (lossless, may lag the socket)
+#   drop_oldest  the oldest queued batch is discarded to make room
+#   spill        the batch is appended to a JSON-lines file on disk and
+#                replayed into the queue once it has drained below half
+#
+# Spilled batches are replayed from `<name>.jsonl.replay`, which is only
+# deleted once all of its batches went through the writers; one left behind
+# by a crash is replayed again before the next spill file (at least once).
+# Unreadable lines (a spill cut short) are skipped and reported; their file
+# is then kept as `<name>.jsonl.corrupt-<time>` instead of being deleted.
+#
+# Settings (.env): write_queue_size (batches, default 1000), write_queue_policy
+# (default block), write_workers (default 2), write_queue_report_secs (default
+# 30, 0 disables the periodic report), spill_dir (default data/spill).
+
+QUEUE_SIZE = int(os.getenv("write_queue_size", 1000))
+POLICY = os.getenv("write_queue_policy", "block")
+WORKERS = int(os.getenv("write_workers", 2))
+REPORT_SECS = float(os.getenv("write_queue_report_secs", 30))
+SPILL_DIR = os.getenv("spill_dir", os.path.join("data", "spill"))
+
+POLICIES = ("block", "drop_oldest", "spill")
+
+
+class AsyncWriteQueue:
+    """
+    write_fn(key, rows) is called on a worker thread for every batch; batches
+    are (key, rows) pairs where rows must be JSON serialisable for `spill`.
+    put(key, rows, on_done) calls on_done(written) on the event loop once the
+    batch is written (True) or failed / was dropped (False); a spilled batch
+    is not tracked any further.
+    """
+
+    def __init__(self, write_fn, name="writes", maxsize=QUEUE_SIZE, policy=POLICY,
+                 workers=WORKERS, report_secs=REPORT_SECS, spill_dir=SPILL_DIR):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown write_queue_policy {policy!r}; expected one of {POLICIES}")
+        self.write_fn = write_fn
+        self.name = name
+        self.maxsize = maxsize
+        self.policy = policy
+        self.workers = workers
+        self.report_secs = report_secs
+        self.spill_path = os.path.join(spill_dir, f"{name}.jsonl")
+
+        self._queue = None
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{name}-writer")
+        self._tasks = []
+        self.metrics = {
+            "enqueued_batches": 0,
+            "written_batches": 0,
+            "written_rows": 0,
+            "dropped_batches": 0,
+            "dropped_rows": 0,
+            "spilled_batches": 0,
+            "replayed_batches": 0,
+            "corrupt_spill_lines": 0,
+            "write_errors": 0,
+            "write_time_total": 0.0,
+            "max_depth": 0,
+        }
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if self.policy == "spill":
+            self._tasks.append(asyncio.create_task(self._replay_spill()))
+        if self.report_secs:
+            self._tasks.append(asyncio.create_task(self._report()))
+        return self
+
+    def depth(self):
+        return self._queue.qsize() if self._queue else 0
+
+    async def put(self, key, rows, on_done=None):
+        if not rows:
+            return
+        batch = (key, rows, on_done)
+        if self._queue.full():
+            if self.policy == "drop_oldest":
+                _, dropped_rows, dropped_done = self._queue.get_nowait()
+                self._queue.task_done()
+                if dropped_done is not None:
+                    dropped_done(False)
+                self.metrics["dropped_batches"] += 1
+                self.metrics["dropped_rows"] += len(dropped_rows)
+            elif self.policy == "spill":
+                self._spill((key, rows))
+                return
+        await self._queue.put(batch)
+        self.metrics["enqueued_batches"] += 1
+        self.metrics["max_depth"] = max(self.metrics["max_depth"], self._queue.qsize())
+
+    def _spill(self, batch):
+        os.makedirs(os.path.dirname(self.spill_path), exist_ok=True)
+        with open(self.spill_path, "a") as f:
+            f.write(json.dumps(batch) + "\n")
+        self.metrics["spilled_batches"] += 1
+
+    async def _replay_spill(self):
+        replay_path = f"{self.spill_path}.replay"
+        while True:
+            await asyncio.sleep(1)
+            if self._queue.qsize() > self.maxsize // 2:
+                continue
+            # A replay file still there was cut short (crash); it goes first
+            if not os.path.exists(replay_path):
+                if not os.path.exists(self.spill_path):
+                    continue
+                # Rotate first so new spills go to a fresh file while we replay
+                os.replace(self.spill_path, replay_path)
+            try:
+                await self._replay(replay_path)
+            except Exception as e:
+                # The file stays and is retried next round; never stop replaying silently
+                print(f"[{self.name}] replay of {replay_path} failed: {e}")
+
+    async def _replay(self, replay_path):
+        loop = asyncio.get_running_loop()
+        pending = []
+        bad_lines = 0
+        with open(replay_path) as f:
+            for number, line in enumerate(f, 1):
+                try:
+                    key, rows = json.loads(line)
+                except (json.JSONDecodeError, ValueError) as e:
+                    # e.g. the last line cut short by a crash mid-spill
+                    bad_lines += 1
+                    self.metrics["corrupt_spill_lines"] += 1
+                    print(f"[{self.name}] skipping unreadable line {number} of {replay_path}: {e}")
+                    continue
+                done = loop.create_future()
+                await self._queue.put((key, rows, lambda written, done=done: done.set_result(written)))
+                pending.append(done)
+                self.metrics["replayed_batches"] += 1
+        # Only forget the batches once the writers are through with them
+        await asyncio.gather(*pending)
+        if bad_lines:
+            # Kept for inspection, out of the way of the next replay
+            corrupt_path = f"{self.spill_path}.corrupt-{int(time.time())}"
+            os.replace(replay_path, corrupt_path)
+            print(f"[{self.name}] {bad_lines} unreadable spill lines kept in {corrupt_path}")
+        else:
+            os.remove(replay_path)
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            key, rows, on_done = await self._queue.get()
+            started = time.perf_counter()
+            written = False
+            try:
+                await loop.run_in_executor(self._executor, self.write_fn, key, rows)
+                written = True
+                self.metrics["written_batches"] += 1
+                self.metrics["written_rows"] += len(rows)
+            except Exception as e:
+                self.metrics["write_errors"] += 1
+                print(f"[{self.name}] write of {len(rows)} rows for {key} failed: {e}")
+            finally:
+                self.metrics["write_time_total"] += time.perf_counter() - started
+                self._queue.task_done()
+                if on_done is not None:
+                    on_done(written)
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.report_secs)
+            print(f"[{self.name}] {self.format_stats()}")
+
+    def stats(self):
+        stats = dict(self.metrics)
+        stats["depth"] = self.depth()
+        stats["maxsize"] = self.maxsize
+        stats["policy"] = self.policy
+        written = stats["written_batches"] + stats["write_errors"]
+        stats["write_time_avg"] = stats["write_time_total"] / written if written else 0.0
+        return stats
+
+    def format_stats(self):
+        s = self.stats()
+        return (f"queue {s['depth']}/{s['maxsize']} (max {s['max_depth']}, {s['policy']}) | "
+                f"written {s['written_batches']} batches / {s['written_rows']} rows, "
+                f"avg {s['write_time_avg'] * 1000:.1f} ms | dropped {s['dropped_batches']} | "
+                f"spilled {s['spilled_batches']} replayed {s['replayed_batches']} "
+                f"(corrupt lines {s['corrupt_spill_lines']}) | errors {s['write_errors']}")
+
+    async def close(self):
+        """Wait for queued batches to be written, then stop the workers."""
+        await self._queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._executor.shutdown(wait=True)